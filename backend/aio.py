@@ -0,0 +1,189 @@
+# backend/aio.py
+"""
+Percorso async per le route di lettura pesanti (dashboard, wallet, asset, performance).
+
+Una route sincrona occupa un thread del pool di default (40 per processo, condiviso
+da tutte le route `def`) per tutta la richiesta, anche mentre aspetta Yahoo: bastano
+pochi prezzi lenti per lasciare in coda ogni altra richiesta. Le route async
+dividono il lavoro in due fasi, nessuna delle quali tiene quel pool.
+
+1. warm_market() legge in parallelo i prezzi correnti e i cambi che servono alla
+   pagina (market_needs) in un pool dedicato di MARKET_WORKERS thread (yfinance e
+   Frankfurter sono sincroni). Nel processo una chiave ha al più una lettura in volo:
+   cento dashboard concorrenti attendono la stessa future. I valori passano da
+   market_cache come nelle route sincrone.
+2. run_db() esegue il calcolo (le funzioni sincrone di crud/performance) con i valori
+   già letti (pricing.seeded_live), quindi senza rete. Il calcolo gira in un limiter
+   dedicato di DB_WORKERS thread con una sessione propria; dentro /batch si usa la
+   sessione condivisa del batch. L'event loop non esegue mai SQL né calcoli.
+
+Ogni route legge in anticipo solo i valori che la sua funzione usa: la funzione
+`needs` passata a valuation() (market_needs per le valorizzazioni delle posizioni,
+category_needs e liquidity_needs per le allocazioni), o symbols/pairs espliciti. Le
+route che lavorano solo in SQL o sullo storico locale passano symbols=[] e non
+leggono nulla dal mercato.
+
+Le richieste in attesa sono coroutine ferme su un await, non thread occupati: un
+worker ne regge centinaia e le route sincrone restano servite.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
+
+import anyio
+
+from . import analytics, asset_registry, crud, performance, pricing, services
+from .database import SessionLocal, current_shared_session
+
+DB_WORKERS = 8
+MARKET_WORKERS = 16
+EPSILON = 1e-9
+
+T = TypeVar("T")
+
+_market_pool = ThreadPoolExecutor(MARKET_WORKERS, thread_name_prefix="market")
+_db_limiter: Optional[anyio.CapacityLimiter] = None
+# chiave di mercato -> lettura in corso (una per processo)
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+class MarketValues:
+    """Prezzi correnti per simbolo e cambi per (da, a) letti da warm_market()."""
+
+    def __init__(self, prices: Dict[str, float], rates: Dict[Tuple[str, str], float]):
+        self.prices = prices
+        self.rates = rates
+
+
+def _limiter() -> anyio.CapacityLimiter:
+    global _db_limiter
+    if _db_limiter is None:
+        _db_limiter = anyio.CapacityLimiter(DB_WORKERS)
+    return _db_limiter
+
+
+def market_needs(db, portfolio_id: Optional[int] = None) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    Simboli con prezzo di mercato e coppie di cambio usati per valorizzare le posizioni
+    aperte (quantità da analytics, metadati dal registro asset in cache). Liquidità e
+    valuta base non hanno prezzo di mercato; le valute sono prese come salvate e
+    normalizzate, come le usano crud e performance.
+    """
+    base = performance.get_base_currency(db)
+    assets = asset_registry.get_assets(db)
+    held = [s for s, q in analytics.positions(db, portfolio_id).items() if abs(q) > EPSILON]
+    symbols = [
+        s for s in held
+        if s.upper() not in ("EUR", base) and not (s.upper() in assets and assets[s.upper()].liquidity)
+    ]
+    currencies: Set[str] = set()
+    for s in held:
+        meta = assets.get(s.upper())
+        if meta and meta.currency:
+            currencies |= {meta.currency, services.normalize_currency(meta.currency)}
+    pairs = sorted({(c, to) for c in currencies for to in {base, "EUR"} if c.strip().upper() != to})
+    return sorted(symbols), pairs
+
+
+def _category_needs(db, quantities: Dict[str, float], skip_liquidity: bool) -> Tuple[List[str], List[Tuple[str, str]]]:
+    # come crud: asset visibili con categoria, prezzo in valuta dell'asset e cambio verso EUR
+    assets = {k: a for k, a in asset_registry.get_assets(db).items() if a.visible and a.category is not None}
+    used = [assets[k] for k in quantities if k in assets]
+    symbols = [
+        a.symbol for a in used
+        if a.symbol.upper() != "EUR" and not (skip_liquidity and a.category.lower() == "liquidità")
+    ]
+    pairs = [(c, "EUR") for c in sorted({a.currency for a in used if a.currency and a.currency.upper() != "EUR"})]
+    return sorted(symbols), pairs
+
+
+def category_needs(db, portfolio_id: Optional[int] = None) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Prezzi e cambi letti da crud.get_allocation_by_category_group."""
+    return _category_needs(db, analytics.positions(db, portfolio_id, crud.POSITIVE_TYPES | crud.NEGATIVE_TYPES), True)
+
+
+def category_history_needs(db, portfolio_id: Optional[int] = None) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Prezzi e cambi letti da crud.get_historical_allocation_by_category (ogni simbolo movimentato)."""
+    deltas = analytics.monthly_deltas(db, portfolio_id, crud.POSITIVE_TYPES | crud.NEGATIVE_TYPES)
+    return _category_needs(db, {s: 0.0 for month in deltas.values() for s in month}, False)
+
+
+def liquidity_needs(db, portfolio_id: Optional[int] = None) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Cambi verso EUR della liquidità visibile, letti da crud.get_dashboard_summary (nessun prezzo)."""
+    liquid = {a.symbol for a in asset_registry.get_assets(db).values() if a.visible and a.type == "Liquidi"}
+    return [], [(s, "EUR") for s in sorted(liquid) if s.upper() != "EUR"]
+
+
+async def _single_flight(key: str, fetch: Callable[..., float], *args) -> float:
+    future = _inflight.get(key)
+    if future is None or future.get_loop() is not asyncio.get_running_loop():
+        future = asyncio.get_running_loop().run_in_executor(_market_pool, fetch, *args)
+        _inflight[key] = future
+        future.add_done_callback(lambda done: _inflight.pop(key, None) if _inflight.get(key) is done else None)
+    # shield: una richiesta annullata non interrompe la lettura attesa dalle altre
+    return await asyncio.shield(future)
+
+
+async def _safe(key: str, fetch: Callable[..., float], *args) -> float:
+    try:
+        return float(await _single_flight(key, fetch, *args) or 0.0)
+    except Exception:
+        return 0.0
+
+
+async def warm_market(symbols: Iterable[str] = (), pairs: Iterable[Tuple[str, str]] = ()) -> MarketValues:
+    """Prezzi correnti e cambi in parallelo, fuori dal pool delle route sincrone."""
+    symbols = list(dict.fromkeys(symbols))
+    pairs = list(dict.fromkeys(pairs))
+    values = await asyncio.gather(
+        *(_safe(f"price:{s.upper()}", services.get_current_price, s) for s in symbols),
+        *(_safe(f"fx:{f.upper()}:{t.upper()}", services.get_conversion_rate, f, t) for f, t in pairs),
+    )
+    return MarketValues(dict(zip(symbols, values[:len(symbols)])), dict(zip(pairs, values[len(symbols):])))
+
+
+def _call(fn: Callable[..., T], db, args: tuple, seed: Optional[MarketValues]) -> T:
+    if seed is None:
+        return fn(db, *args)
+    with pricing.seeded_live(seed.prices, seed.rates):
+        return fn(db, *args)
+
+
+def _call_in_session(fn: Callable[..., T], args: tuple, seed: Optional[MarketValues]) -> T:
+    db = SessionLocal()
+    try:
+        return _call(fn, db, args, seed)
+    finally:
+        db.close()
+
+
+async def run_db(fn: Callable[..., T], *args, seed: Optional[MarketValues] = None) -> T:
+    """fn(db, *args) fuori dall'event loop e dal pool di default (vedi docstring del modulo)."""
+    shared = current_shared_session()
+    if shared is not None:
+        return await anyio.to_thread.run_sync(_call, fn, shared, args, seed, limiter=_limiter())
+    return await anyio.to_thread.run_sync(_call_in_session, fn, args, seed, limiter=_limiter())
+
+
+async def valuation(
+    fn: Callable[..., T],
+    *args,
+    as_of: Optional[date] = None,
+    portfolio_id: Optional[int] = None,
+    symbols: Optional[Iterable[str]] = None,
+    pairs: Iterable[Tuple[str, str]] = (),
+    needs: Callable[..., Tuple[List[str], List[Tuple[str, str]]]] = market_needs,
+) -> T:
+    """
+    fn(db, *args) con i dati di mercato correnti letti prima, in parallelo. Con as_of si
+    usano solo dati locali e non si legge nulla in anticipo. symbols/pairs limitano la
+    lettura ai valori indicati (symbols=[]: nessun prezzo); altrimenti si leggono quelli
+    indicati da needs(db, portfolio_id), di default le posizioni aperte del portafoglio.
+    """
+    seed = None
+    if as_of is None:
+        if symbols is None:
+            symbols, pairs = await run_db(needs, portfolio_id)
+        seed = await warm_market(symbols, pairs)
+    return await run_db(fn, *args, seed=seed)
@@ -0,0 +1,373 @@
+# backend/alerts.py
+"""
+Motore di alert guidato dagli eventi: le regole (tabella alert_rules) vengono valutate
+solo quando cambia il prezzo di un simbolo, un cambio o un'operazione.
+
+Per ogni portafoglio con regole attive si tiene in memoria il valore in valuta base di
+ogni posizione e i totali per categoria. Un cambiamento aggiorna solo i simboli toccati
+(un cambio, es. "USDEUR=X", tocca i simboli in quella valuta) e valuta le regole trovate
+nell'indice simbolo -> regole, più quelle di deriva di categoria che dipendono dal totale.
+Un evento viene scritto in alert_events solo quando la condizione passa da falsa a vera.
+Lo stato triggered in memoria è del singolo processo: con più worker l'evento lo scrive
+solo chi aggiorna alert_rules.triggered da 0 a 1 (UPDATE condizionato), gli altri
+allineano la propria copia senza scriverne un secondo.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .models import AlertEvent, AlertRule, Setting
+from . import asset_registry, ledger_cache, performance, price_store, services
+
+logger = logging.getLogger(__name__)
+
+RULE_KINDS = ("position_value", "drawdown", "category_drift")
+DIRECTIONS = ("above", "below")
+
+
+class _Rule:
+    __slots__ = (
+        "id", "portfolio_id", "kind", "symbol", "category", "category_label",
+        "direction", "threshold", "target_weight", "triggered",
+    )
+
+    def __init__(self, row: AlertRule, default_threshold: Optional[float]):
+        self.id = row.id
+        self.portfolio_id = row.portfolio_id
+        self.kind = row.kind
+        self.symbol = (row.symbol or "").upper()
+        self.category = _category_key(row.category)
+        self.category_label = row.category
+        self.direction = row.direction or "above"
+        self.threshold = row.threshold if row.threshold is not None else default_threshold
+        self.target_weight = row.target_weight
+        self.triggered = bool(row.triggered)
+
+
+class _RuleIndex:
+    """Regole attive per portafoglio: simbolo -> regole, più la lista delle regole di categoria."""
+
+    def __init__(self, rules: List[_Rule]):
+        self.by_id = {r.id: r for r in rules}
+        self.by_symbol: Dict[Optional[int], Dict[str, List[_Rule]]] = defaultdict(lambda: defaultdict(list))
+        self.drift: Dict[Optional[int], List[_Rule]] = defaultdict(list)
+        for rule in rules:
+            if rule.kind == "category_drift":
+                self.drift[rule.portfolio_id].append(rule)
+            else:
+                self.by_symbol[rule.portfolio_id][rule.symbol].append(rule)
+        self.portfolios: Set[Optional[int]] = set(self.by_symbol) | set(self.drift)
+
+
+class _PortfolioState:
+    """Valore per simbolo e totali per categoria di un portafoglio, aggiornati per differenza."""
+
+    def __init__(self, ledger):
+        self.values: Dict[str, float] = {}
+        self.categories: Dict[str, float] = defaultdict(float)
+        self.total = 0.0
+        self.rebase(ledger)
+
+    def rebase(self, ledger) -> None:
+        self.ledger = ledger
+        self.fallback_prices = _last_ledger_prices(ledger)
+
+    def set_value(self, symbol: str, category: str, value: float) -> None:
+        delta = value - self.values.get(symbol, 0.0)
+        self.values[symbol] = value
+        self.categories[category] += delta
+        self.total += delta
+
+
+_lock = threading.RLock()
+_rules: Optional[_RuleIndex] = None
+_states: Dict[Optional[int], _PortfolioState] = {}
+# anagrafica: symbol -> (categoria, valuta, liquidità) e valuta -> simboli, caricate alla prima valutazione
+_assets: Optional[Dict[str, tuple]] = None
+_by_currency: Dict[str, Set[str]] = {}
+_base: Optional[str] = None
+# dati di mercato condivisi tra i portafogli (prezzi nella valuta dell'asset)
+_market_prices: Dict[str, float] = {}
+_closes: Dict[str, Optional[float]] = {}  # ultima chiusura nello storico (None = assente)
+_peaks: Dict[str, float] = {}
+
+
+def _category_key(category: Optional[str]) -> str:
+    return (category or "").strip().lower()
+
+
+def _last_ledger_prices(ledger) -> Dict[str, float]:
+    """Ultimo prezzo valido per simbolo dalle operazioni (fallback come in _get_price_in_base)."""
+    price = np.where(ledger.price > 0, ledger.price, ledger.price_manual)
+    valid = (price > 0) & ~ledger.type_mask(performance.NO_PRICE_TYPES) & (ledger.day != ledger_cache.NO_DAY)
+    idx = np.flatnonzero(valid)
+    idx = idx[np.lexsort((ledger.op_id[idx], ledger.day[idx]))]
+    # la prima occorrenza nell'ordine inverso è l'ultima in ordine di data
+    codes, first = np.unique(ledger.symbol[idx][::-1], return_index=True)
+    last_prices = price[idx][::-1][first]
+    return {ledger.symbols[c]: float(p) for c, p in zip(codes.tolist(), last_prices.tolist())}
+
+
+def _load_assets(db: Session) -> None:
+    global _assets, _base
+    _base = performance.get_base_currency(db)
+    _assets = {}
+    _by_currency.clear()
+    for symbol, asset in asset_registry.get_assets(db).items():
+        ccy = services.normalize_currency(asset.currency)
+        _assets[symbol] = (_category_key(asset.category), ccy, asset.liquidity)
+        _by_currency.setdefault(ccy, set()).add(symbol)
+
+
+def _get_rules(db: Session) -> _RuleIndex:
+    global _rules
+    if _rules is None:
+        thresholds = dict(db.query(Setting.user, Setting.alert_threshold).all())
+        default = db.query(func.max(Setting.alert_threshold)).scalar()
+        rows = db.query(AlertRule).filter(AlertRule.active == True).all()
+        _rules = _RuleIndex([_Rule(r, thresholds.get(r.user, default)) for r in rows])
+    return _rules
+
+
+def _prefetch_closes(db: Session, symbols: Iterable[str]) -> None:
+    missing = [s for s in symbols if s not in _closes]
+    if missing:
+        _closes.update(dict.fromkeys(missing))
+        _closes.update(price_store.latest_closes(db, missing))
+
+
+def _last_close(db: Session, symbol: str) -> Optional[float]:
+    _prefetch_closes(db, [symbol])
+    return _closes[symbol]
+
+
+def _price(db: Session, state: _PortfolioState, symbol: str) -> float:
+    """Prezzo nella valuta dell'asset: ultimo spinto da on_prices, poi storico, poi operazioni."""
+    price = _market_prices.get(symbol) or _last_close(db, symbol)
+    return price or state.fallback_prices.get(symbol, 0.0)
+
+
+def _fx(db: Session, currency: str) -> float:
+    if currency == _base:
+        return 1.0
+    pair = services.fx_symbol(currency, _base)
+    return _market_prices.get(pair) or _last_close(db, pair) or 1.0
+
+
+def _value(db: Session, state: _PortfolioState, symbol: str) -> float:
+    qty = state.ledger.quantity_of(symbol)
+    if abs(qty) < 1e-12:
+        return 0.0
+    _, currency, liquid = _assets.get(symbol, ("", _base, False))
+    if liquid or symbol == _base:
+        return qty
+    return qty * _price(db, state, symbol) * _fx(db, currency)
+
+
+def _drawdown(db: Session, state: _PortfolioState, symbol: str) -> float:
+    """Calo del prezzo dal massimo (storico dalla prima operazione, poi prezzi osservati)."""
+    price = _price(db, state, symbol)
+    peak = _peaks.get(symbol)
+    if peak is None:
+        days, closes = price_store.load_history_arrays(db, [symbol])[symbol]
+        code = state.ledger.symbol_codes.get(symbol)
+        if code is not None and len(closes):
+            held = state.ledger.day[(state.ledger.symbol == code) & (state.ledger.day != ledger_cache.NO_DAY)]
+            if len(held):
+                closes = closes[days >= ledger_cache.EPOCH + np.timedelta64(int(held.min()), "D")]
+        peak = float(closes.max()) if len(closes) else 0.0
+    peak = max(peak, price)
+    _peaks[symbol] = peak
+    return 1.0 - price / peak if peak > 0 else 0.0
+
+
+def _check(db: Session, state: _PortfolioState, rule: _Rule) -> Optional[tuple]:
+    """Ritorna (condizione, valore osservato) oppure None se la regola non ha soglia."""
+    if not rule.threshold:
+        return None
+    if rule.kind == "position_value":
+        value = state.values.get(rule.symbol, 0.0)
+        hit = value >= rule.threshold if rule.direction == "above" else value <= rule.threshold
+        return hit, value
+    if rule.kind == "drawdown":
+        value = _drawdown(db, state, rule.symbol)
+        return value >= rule.threshold, value
+    if rule.kind == "category_drift" and rule.target_weight is not None:
+        weight = state.categories.get(rule.category, 0.0) / state.total if state.total else 0.0
+        return abs(weight - rule.target_weight) >= rule.threshold, weight
+    return None
+
+
+def _message(rule: _Rule, value: float) -> str:
+    if rule.kind == "position_value":
+        side = "sopra" if rule.direction == "above" else "sotto"
+        return f"{rule.symbol}: valore posizione {value:.2f} {_base} {side} la soglia {rule.threshold:.2f}"
+    if rule.kind == "drawdown":
+        return f"{rule.symbol}: drawdown {value:.1%} oltre la soglia {rule.threshold:.1%}"
+    return f"{rule.category_label}: peso {value:.1%} contro obiettivo {rule.target_weight:.1%} (soglia {rule.threshold:.1%})"
+
+
+def _changed_symbols(symbols: Iterable[str]) -> Set[str]:
+    """Simboli toccati, espandendo le coppie di cambio sui simboli nella valuta relativa."""
+    changed = set()
+    for symbol in symbols:
+        symbol = (symbol or "").upper()
+        if symbol.endswith("=X") and symbol[3:6] == _base:
+            changed |= _by_currency.get(symbol[:3], set())
+        elif symbol:
+            changed.add(symbol)
+    return changed
+
+
+def _evaluate(
+    db: Session,
+    symbols: Optional[Iterable[str]] = None,
+    portfolio_ids: Optional[Set[Optional[int]]] = None,
+    ledger_symbols: bool = False,
+    rule_ids: Iterable[int] = (),
+) -> List[AlertEvent]:
+    """
+    Aggiorna i simboli cambiati (None = tutti) e valuta solo le regole che ne dipendono.
+    ledger_symbols=True indica che il ledger è cambiato solo per questi simboli
+    (dopo una scrittura su operations), altrimenti un ledger nuovo ricostruisce lo stato.
+    """
+    with _lock:
+        index = _get_rules(db)
+        if _assets is None:
+            _load_assets(db)
+        forced = [index.by_id[i] for i in rule_ids if i in index.by_id]
+        changed_all = None if symbols is None else _changed_symbols(symbols)
+
+        fired, cleared = [], []
+        for pid in index.portfolios:
+            if portfolio_ids is not None and pid not in portfolio_ids:
+                continue
+            ledger = ledger_cache.get_ledger(db, pid)
+            state = _states.get(pid)
+            changed = changed_all
+            if state is None or (state.ledger is not ledger and not ledger_symbols):
+                state = _states[pid] = _PortfolioState(ledger)
+                changed = None
+            elif state.ledger is not ledger:
+                state.rebase(ledger)
+            if changed is None:
+                changed = set(ledger.symbols) | set(state.values)
+            if len(changed) > 1:
+                # ultime chiusure di tutti i simboli toccati (e dei cambi) in una sola query
+                pairs = [services.fx_symbol(c, _base) for c in _by_currency if c != _base]
+                _prefetch_closes(db, list(changed) + pairs)
+
+            for symbol in changed:
+                state.set_value(symbol, _assets.get(symbol, ("",))[0], _value(db, state, symbol))
+
+            by_symbol = index.by_symbol.get(pid, {})
+            candidates = {r.id: r for s in changed for r in by_symbol.get(s, ())}
+            if changed:
+                candidates.update((r.id, r) for r in index.drift.get(pid, ()))
+            candidates.update((r.id, r) for r in forced if r.portfolio_id == pid)
+
+            for rule in candidates.values():
+                result = _check(db, state, rule)
+                if result is None:
+                    continue
+                hit, value = result
+                if hit and not rule.triggered:
+                    fired.append((rule, value))
+                elif not hit and rule.triggered:
+                    cleared.append(rule)
+
+        if not fired and not cleared:
+            return []
+        now = datetime.now().isoformat(timespec="seconds")
+        events = []
+        for rule, value in fired:
+            # triggered in memoria è per processo: l'evento lo scrive solo chi porta la
+            # regola da 0 a 1, così due worker non registrano due volte lo stesso passaggio
+            won = db.query(AlertRule).filter(AlertRule.id == rule.id, AlertRule.triggered == False).update(
+                {AlertRule.triggered: True}, synchronize_session=False
+            )
+            if won == 1:
+                events.append(AlertEvent(
+                    rule_id=rule.id, kind=rule.kind, symbol=rule.symbol or None, category=rule.category_label,
+                    value=value, threshold=rule.threshold, message=_message(rule, value), created_at=now,
+                ))
+        db.add_all(events)
+        if cleared:
+            db.query(AlertRule).filter(AlertRule.id.in_([r.id for r in cleared])).update(
+                {AlertRule.triggered: False}, synchronize_session=False
+            )
+        db.commit()
+        for rule, _ in fired:
+            rule.triggered = True
+        for rule in cleared:
+            rule.triggered = False
+        for event in events:
+            logger.info("Alert: %s", event.message)
+        return events
+
+
+def _notify(db: Session, *args, **kwargs) -> List[AlertEvent]:
+    # la valutazione degli alert non deve mai far fallire la scrittura che l'ha innescata
+    try:
+        return _evaluate(db, *args, **kwargs)
+    except Exception:
+        logger.exception("Valutazione alert fallita")
+        db.rollback()
+        return []
+
+
+def on_operations_changed(db: Session, symbols: Iterable[Optional[str]], *portfolio_ids: Optional[int]) -> List[AlertEvent]:
+    """Da chiamare dopo il commit (e ledger_cache.invalidate) di una scrittura su operations."""
+    return _notify(db, [s for s in symbols if s], set(portfolio_ids) | {None}, ledger_symbols=True)
+
+
+def on_prices(db: Session, prices: Dict[str, float]) -> List[AlertEvent]:
+    """Nuovi prezzi live, nella valuta dell'asset; accetta anche cambi come "USDEUR=X"."""
+    _market_prices.update({s.upper(): float(p) for s, p in prices.items() if p and p > 0})
+    return _notify(db, prices.keys())
+
+
+def on_price_history(db: Session, symbols: Iterable[str]) -> List[AlertEvent]:
+    """Da chiamare dopo sync_prices con i simboli che hanno nuove chiusure nello storico."""
+    symbols = [s.upper() for s in symbols]
+    for symbol in symbols:
+        _market_prices.pop(symbol, None)
+        _closes.pop(symbol, None)
+    return _notify(db, symbols) if symbols else []
+
+
+def check_rules(db: Session, rule_ids: Iterable[int]) -> List[AlertEvent]:
+    """Valuta subito le regole indicate (es. appena create) senza toccare le altre."""
+    return _notify(db, [], rule_ids=list(rule_ids))
+
+
+def evaluate_all(db: Session) -> List[AlertEvent]:
+    """Ricostruisce lo stato e valuta tutte le regole attive."""
+    reset()
+    return _notify(db, None)
+
+
+def invalidate_rules() -> None:
+    """Da chiamare quando cambiano le regole o le soglie in settings."""
+    global _rules
+    with _lock:
+        _rules = None
+
+
+def reset() -> None:
+    """Svuota regole, anagrafica, stati dei portafogli e dati di mercato (es. dopo modifiche agli asset o un import)."""
+    global _rules, _assets
+    with _lock:
+        _rules = None
+        _assets = None
+        _states.clear()
+        _closes.clear()
+        # picchi di drawdown e prezzi live del vecchio asset non valgono per quello ricreato
+        _peaks.clear()
+        _market_prices.clear()
@@ -0,0 +1,176 @@
+# backend/analytics.py
+"""
+Aggregazioni sul ledger (quantità per simbolo e per mese) con un motore colonnare
+embedded opzionale.
+
+Di default le aggregazioni usano il ledger NumPy in cache (ledger_cache): veloce a
+cache calda, ma il primo caricamento porta in Python tutte le righe di operations.
+Con BUGETTO_ANALYTICS=duckdb e duckdb installato, il database SQLite viene
+collegato in sola lettura a una connessione DuckDB in memoria (estensione sqlite).
+Le colonne usate dalle aggregazioni vengono copiate una volta in una tabella
+colonnare ops, ricostruita quando ledger_cache viene invalidato (stessa
+generazione). monthly_deltas() e positions() sono allora GROUP BY eseguiti da
+DuckDB, senza materializzare righe in Python: su ledger di milioni di righe il
+costo è la scansione colonnare, non il caricamento.
+
+I risultati sono gli stessi del ledger NumPy: simboli in maiuscolo, quantità
+mancanti o non numeriche a 0, operazioni senza data ignorate nelle serie mensili.
+Se DuckDB fallisce (estensione sqlite non disponibile, file bloccato) si torna al
+ledger NumPy: il motore analitico non deve mai far fallire una richiesta. Dopo un
+errore DuckDB resta spento per RETRY_AFTER secondi, così un'estensione non
+scaricabile (server offline) non costa un tentativo e un warning a ogni richiesta.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from . import ledger_cache
+
+try:
+    import duckdb
+except ImportError:  # dipendenza opzionale
+    duckdb = None
+
+logger = logging.getLogger(__name__)
+
+# colonne di operations copiate in ops; con sqlite_all_varchar ogni valore arriva come
+# testo e viene convertito qui, come fa ledger_cache._floats con i valori sporchi
+_BUILD_OPS = """
+    CREATE OR REPLACE TABLE ops AS
+    SELECT
+        TRY_CAST(portfolio_id AS BIGINT) AS portfolio_id,
+        TRY_CAST(LEFT("date", 10) AS DATE) AS day,
+        UPPER(asset_symbol) AS symbol,
+        COALESCE(operation_type, '') AS type,
+        COALESCE(TRY_CAST(REPLACE(quantity, ',', '.') AS DOUBLE), 0.0) AS qty
+    FROM src.operations
+    WHERE TRY_CAST(accounting AS INTEGER) = 1 AND asset_symbol IS NOT NULL
+"""
+
+RETRY_AFTER = 300.0
+
+_lock = threading.Lock()
+_conn = None
+# (file sqlite, generazione di ledger_cache) della tabella ops caricata
+_loaded: Optional[tuple] = None
+# istante (time.monotonic) prima del quale DuckDB non viene riprovato dopo un errore
+_retry_at = 0.0
+
+
+def enabled() -> bool:
+    return (
+        duckdb is not None
+        and os.environ.get("BUGETTO_ANALYTICS", "").lower() == "duckdb"
+        and time.monotonic() >= _retry_at
+    )
+
+
+def _disable(error: Exception) -> None:
+    global _retry_at
+    _retry_at = time.monotonic() + RETRY_AFTER
+    logger.warning("analytics: DuckDB non disponibile, uso il ledger in memoria per %.0fs: %s", RETRY_AFTER, error)
+
+
+def _load_sqlite_extension(conn) -> None:
+    # LOAD prima di INSTALL: con l'estensione già installata non si va in rete
+    try:
+        conn.execute("LOAD sqlite")
+    except duckdb.Error:
+        conn.execute("INSTALL sqlite")
+        conn.execute("LOAD sqlite")
+
+
+def _database_path(db: Session) -> str:
+    return os.path.abspath(db.get_bind().url.database)
+
+
+def _cursor(db: Session):
+    """Cursore DuckDB con ops allineata alla generazione corrente del ledger."""
+    global _conn, _loaded
+    path = _database_path(db)
+    key = (path, ledger_cache.generation(db))
+    with _lock:
+        if _loaded != key:
+            try:
+                if _conn is None or _loaded is None or _loaded[0] != path:
+                    if _conn is not None:
+                        _conn.close()
+                    _conn = duckdb.connect()
+                    _load_sqlite_extension(_conn)
+                    _conn.execute("SET sqlite_all_varchar = true")
+                    quoted = path.replace("'", "''")
+                    _conn.execute(f"ATTACH '{quoted}' AS src (TYPE SQLITE, READ_ONLY)")
+                _conn.execute(_BUILD_OPS)
+            except Exception:
+                # connessione da rifare alla prossima chiamata
+                if _conn is not None:
+                    _conn.close()
+                _conn, _loaded = None, None
+                raise
+            _loaded = key
+        # un cursore per chiamata: le connessioni DuckDB non vanno condivise tra thread
+        return _conn.cursor()
+
+
+def _filters(types: Optional[Iterable[str]], until: Optional[date], portfolio_id: Optional[int]):
+    clauses, params = [], []
+    if types is not None:
+        clauses.append("list_contains(?, type)")
+        params.append(sorted(types))
+    if until is not None:
+        clauses.append("day <= ?")
+        params.append(until)
+    if portfolio_id is not None:
+        clauses.append("portfolio_id = ?")
+        params.append(portfolio_id)
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def _duckdb_positions(db, portfolio_id, types, until) -> Dict[str, float]:
+    where, params = _filters(types, until, portfolio_id)
+    # senza until anche le operazioni senza data contano (come Ledger.positions)
+    base = "TRUE" if until is None else "day IS NOT NULL"
+    rows = _cursor(db).execute(f"SELECT symbol, SUM(qty) FROM ops WHERE {base}{where} GROUP BY symbol", params).fetchall()
+    return {symbol: float(total) for symbol, total in rows}
+
+
+def _duckdb_monthly_deltas(db, portfolio_id, types, until) -> Dict[str, Dict[str, float]]:
+    where, params = _filters(types, until, portfolio_id)
+    rows = _cursor(db).execute(
+        f"SELECT strftime(day, '%Y-%m') AS month, symbol, SUM(qty) FROM ops WHERE day IS NOT NULL{where} "
+        "GROUP BY month, symbol ORDER BY month, symbol",
+        params,
+    ).fetchall()
+    result: Dict[str, Dict[str, float]] = {}
+    for month, symbol, total in rows:
+        result.setdefault(month, {})[symbol] = float(total)
+    return result
+
+
+def positions(
+    db: Session, portfolio_id: Optional[int] = None, types: Optional[Iterable[str]] = None, until: Optional[date] = None
+) -> Dict[str, float]:
+    """Quantità totale per simbolo (vedi Ledger.positions)."""
+    if enabled():
+        try:
+            return _duckdb_positions(db, portfolio_id, types, until)
+        except Exception as e:
+            _disable(e)
+    return ledger_cache.get_ledger(db, portfolio_id).positions(types, until=until)
+
+
+def monthly_deltas(
+    db: Session, portfolio_id: Optional[int] = None, types: Optional[Iterable[str]] = None, until: Optional[date] = None
+) -> Dict[str, Dict[str, float]]:
+    """Variazione di quantità per mese e simbolo, {"YYYY-MM": {symbol: qty}} (vedi Ledger.monthly_deltas)."""
+    if enabled():
+        try:
+            return _duckdb_monthly_deltas(db, portfolio_id, types, until)
+        except Exception as e:
+            _disable(e)
+    return ledger_cache.get_ledger(db, portfolio_id).monthly_deltas(types, until=until)
@@ -0,0 +1,107 @@
+# backend/asset_registry.py
+"""
+Registro in memoria dei metadati degli asset (tabella asset_info).
+
+Caricato con una sola query al primo uso e invalidato dalle scritture su asset_info
+(create_asset, delete_asset, import colonnare): i cicli per simbolo delle aggregazioni
+lo consultano senza ulteriori query. Le scritture di altri processi sono viste tramite
+la generazione condivisa di asset_info (generations.py), confrontata a ogni
+get_assets. Le chiavi sono i simboli in maiuscolo.
+"""
+import threading
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import generations
+from .models import AssetInfo
+from .price_store import is_liquidity
+
+
+class AssetMeta(NamedTuple):
+    symbol: str  # come salvato in asset_info
+    name: Optional[str]
+    currency: Optional[str]
+    type: Optional[str]
+    category: Optional[str]
+    visible: bool
+    liquidity: bool
+    id: int = 0
+    isin: Optional[str] = None
+
+
+_lock = threading.Lock()
+_assets: Optional[Dict[str, AssetMeta]] = None
+_generation = 0
+# generazione condivisa di asset_info da cui è stato caricato _assets
+_shared: Optional[int] = None
+
+
+def _load(db: Session) -> Dict[str, AssetMeta]:
+    rows = db.execute(
+        select(
+            AssetInfo.symbol, AssetInfo.name, AssetInfo.currency, AssetInfo.type, AssetInfo.category, AssetInfo.visible,
+            AssetInfo.id, AssetInfo.isin,
+        ).order_by(AssetInfo.id)
+    ).all()
+    assets: Dict[str, AssetMeta] = {}
+    for symbol, name, currency, asset_type, category, visible, asset_id, isin in rows:
+        if not symbol:
+            continue
+        # a parità di simbolo vince la riga più vecchia, come .first() sulle query per lower(symbol)
+        assets.setdefault(
+            symbol.upper(),
+            AssetMeta(
+                symbol, name, currency, asset_type, category, bool(visible), is_liquidity(asset_type, category),
+                asset_id, isin,
+            ),
+        )
+    return assets
+
+
+def _sync(db: Session) -> None:
+    """Invalida il registro se asset_info è stata modificata da un altro processo."""
+    global _assets, _generation, _shared
+    shared = generations.current(db)["asset_info"]
+    # la generazione cresce soltanto: una sessione con un valore più vecchio usa il registro più recente
+    if _shared is not None and shared <= _shared:
+        return
+    with _lock:
+        if _shared is None or shared > _shared:
+            _generation += 1
+            _assets = None
+            _shared = shared
+
+
+def get_assets(db: Session) -> Dict[str, AssetMeta]:
+    """Tutti gli asset per simbolo maiuscolo, caricandoli se assenti o invalidati."""
+    _sync(db)
+    assets = _assets
+    if assets is not None:
+        return assets
+    return _reload(db)
+
+
+def _reload(db: Session) -> Dict[str, AssetMeta]:
+    global _assets
+    with _lock:
+        if _assets is not None:
+            return _assets
+        generation = _generation
+        assets = _load(db)
+        # se nel frattempo una scrittura ha invalidato, non pubblicare dati vecchi
+        if generation == _generation:
+            _assets = assets
+        return assets
+
+
+def get(db: Session, symbol: Optional[str]) -> Optional[AssetMeta]:
+    return get_assets(db).get((symbol or "").upper())
+
+
+def invalidate() -> None:
+    """Da chiamare dopo ogni commit che modifica la tabella asset_info."""
+    global _assets, _generation
+    _generation += 1
+    _assets = None
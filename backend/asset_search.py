@@ -0,0 +1,218 @@
+# backend/asset_search.py
+"""
+Ricerca degli asset per simbolo, nome e ISIN (picker di OperationForm e AssetsManagePage)
+e cache persistente dei metadati indovinati da Yahoo (/assets/guess).
+
+L'indice sta in memoria ed è costruito dal registro asset (asset_registry): viene
+ricostruito al primo uso dopo ogni invalidazione del registro, cioè dopo ogni
+scrittura su asset_info. Contiene:
+  - i token ordinati (simbolo, ISIN, parole del nome, senza accenti e in minuscolo):
+    la ricerca per prefisso è una bisect, senza scorrere tutti gli asset;
+  - i trigrammi di ogni asset: una parola della query che non è prefisso di nessun
+    token (un refuso, "vangard") trova gli asset con abbastanza trigrammi in comune.
+    Una parola corta (meno di SHORT_WORD_LENGTH lettere) ha troppo pochi trigrammi:
+    "nwe" ne ha uno solo su quattro in comune con NEWX / "New Thing". Per queste vale
+    anche un token, o il suo inizio, a una modifica di distanza (lettera sbagliata,
+    mancante, in più o due lettere vicine scambiate): "nwe" trova "new".
+
+Con più parole ogni parola deve corrispondere allo stesso asset. Ordine dei
+risultati: simbolo o ISIN uguali alla query, poi prefisso del simbolo, dell'ISIN e
+del nome, poi le corrispondenze approssimate per somiglianza.
+
+guess() legge i metadati di un simbolo prima dal registro, poi dalla tabella
+asset_guesses (valida GUESS_TTL_DAYS) e solo altrimenti da Yahoo, salvando la risposta.
+"""
+import bisect
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import asset_registry, services
+from .asset_registry import AssetMeta
+from .models import AssetGuess
+
+FUZZY_MIN_LENGTH = 3
+FUZZY_THRESHOLD = 0.5
+SHORT_WORD_LENGTH = 5
+GUESS_TTL_DAYS = 30
+
+# rango del campo in cui la parola è prefisso (più basso = più rilevante)
+_EXACT, _SYMBOL, _ISIN, _NAME, _FUZZY = 0, 1, 2, 3, 4
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _fold(text: Optional[str]) -> str:
+    """Minuscolo e senza accenti (è -> e), per confronti indipendenti da maiuscole e diacritici."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower().strip()
+
+
+def _trigrams(text: str) -> Set[str]:
+    grams: Set[str] = set()
+    for word in _WORD.findall(text):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _one_edit(a: str, b: str) -> bool:
+    """Al più una modifica tra a e b: sostituzione, inserimento, cancellazione o scambio di lettere vicine."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [k for k in range(len(a)) if a[k] != b[k]]
+        return len(diff) <= 1 or (
+            len(diff) == 2 and diff[1] == diff[0] + 1 and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+        )
+    if len(a) > len(b):
+        a, b = b, a
+    k = 0
+    while k < len(a) and a[k] == b[k]:
+        k += 1
+    return a[k:] == b[k + 1:]
+
+
+class AssetIndex:
+    def __init__(self, assets: Dict[str, AssetMeta]):
+        # ordine di default (query vuota): come /assets/visible, per nome e simbolo
+        self.entries: List[AssetMeta] = sorted(assets.values(), key=lambda a: (_fold(a.name or a.symbol), a.symbol))
+        tokens: List[Tuple[str, int, int]] = []
+        self.keys: List[Set[str]] = []
+        postings: Dict[str, Set[int]] = defaultdict(set)
+        for i, asset in enumerate(self.entries):
+            symbol, isin = _fold(asset.symbol), _fold(asset.isin)
+            tokens.append((symbol, _SYMBOL, i))
+            if isin:
+                tokens.append((isin, _ISIN, i))
+            tokens.extend((word, _NAME, i) for word in set(_WORD.findall(_fold(asset.name))))
+            self.keys.append({symbol, isin} - {""})
+            for gram in _trigrams(" ".join((symbol, isin, _fold(asset.name)))):
+                postings[gram].add(i)
+        tokens.sort()
+        self.tokens = [t[0] for t in tokens]
+        self.token_refs = [(t[1], t[2]) for t in tokens]
+        self.postings = dict(postings)
+
+    def _prefix(self, word: str) -> Dict[int, int]:
+        """Asset con un token che inizia per word -> miglior rango del campo."""
+        found: Dict[int, int] = {}
+        start = bisect.bisect_left(self.tokens, word)
+        for pos in range(start, len(self.tokens)):
+            if not self.tokens[pos].startswith(word):
+                break
+            rank, i = self.token_refs[pos]
+            if rank < found.get(i, _NAME + 1):
+                found[i] = rank
+        return found
+
+    def _fuzzy(self, word: str) -> Dict[int, float]:
+        """Asset con almeno FUZZY_THRESHOLD dei trigrammi di word -> quota in comune."""
+        wanted = _trigrams(word)
+        common: Dict[int, int] = defaultdict(int)
+        for gram in wanted:
+            for i in self.postings.get(gram, ()):
+                common[i] += 1
+        return {i: n / len(wanted) for i, n in common.items() if n / len(wanted) >= FUZZY_THRESHOLD}
+
+    def _near(self, word: str) -> Dict[int, float]:
+        """Asset con un token (o il suo inizio) a una modifica da word -> somiglianza."""
+        score = 1.0 - 1.0 / len(word)
+        found: Dict[int, float] = {}
+        for token, (_, i) in zip(self.tokens, self.token_refs):
+            if _one_edit(word, token[:len(word)]) or _one_edit(word, token[:len(word) + 1]):
+                found[i] = score
+        return found
+
+    def search(self, query: str, visible: Optional[bool] = None) -> List[AssetMeta]:
+        """Asset che corrispondono alla query, dal più rilevante."""
+        keep = [visible is None or a.visible == visible for a in self.entries]
+        q = _fold(query)
+        if not q:
+            return [a for a, k in zip(self.entries, keep) if k]
+
+        # asset -> (rango, -somiglianza); la somiglianza conta solo per le parole approssimate
+        ranked: Dict[int, Tuple[int, float]] = {}
+        for n, word in enumerate(_WORD.findall(q)):
+            hits = {i: (rank, 0.0) for i, rank in self._prefix(word).items()}
+            if not hits and len(word) >= FUZZY_MIN_LENGTH:
+                scores = self._fuzzy(word)
+                if len(word) < SHORT_WORD_LENGTH:
+                    for i, score in self._near(word).items():
+                        scores[i] = max(score, scores.get(i, 0.0))
+                hits = {i: (_FUZZY, -score) for i, score in scores.items()}
+            # vale la parola che corrisponde peggio: tutte devono corrispondere
+            ranked = hits if n == 0 else {i: max(r, hits[i]) for i, r in ranked.items() if i in hits}
+        # simbolo o ISIN come prefisso o per intero, anche con punti o trattini ("vwce.de")
+        for i, rank in self._prefix(q).items():
+            if rank != _NAME:
+                best = (_EXACT if q in self.keys[i] else rank, 0.0)
+                ranked[i] = min(best, ranked.get(i, best))
+
+        return [self.entries[pos] for _, pos in sorted((r, pos) for pos, r in ranked.items() if keep[pos])]
+
+
+_lock = threading.Lock()
+# (dizionario del registro da cui è stato costruito, indice)
+_index: Optional[Tuple[Dict[str, AssetMeta], AssetIndex]] = None
+
+
+def get_index(db: Session) -> AssetIndex:
+    """Indice del registro corrente; ricostruito se il registro è stato invalidato."""
+    global _index
+    assets = asset_registry.get_assets(db)
+    current = _index
+    if current is not None and current[0] is assets:
+        return current[1]
+    with _lock:
+        if _index is None or _index[0] is not assets:
+            _index = (assets, AssetIndex(assets))
+        return _index[1]
+
+
+def _as_out(asset: AssetMeta) -> dict:
+    return {
+        "id": asset.id, "symbol": asset.symbol, "name": asset.name, "currency": asset.currency,
+        "type": asset.type, "category": asset.category, "isin": asset.isin, "visible": asset.visible,
+    }
+
+
+def search(db: Session, query: str = "", limit: int = 20, offset: int = 0, visible: Optional[bool] = None) -> dict:
+    """Pagina di risultati e numero totale di corrispondenze."""
+    matches = get_index(db).search(query, visible)
+    return {"total": len(matches), "items": [_as_out(a) for a in matches[offset:offset + limit]]}
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def guess(db: Session, symbol: str) -> dict:
+    """Nome e valuta del simbolo: registro, poi cache persistente, poi Yahoo (salvato in cache)."""
+    sym = symbol.strip().upper()
+    known = asset_registry.get(db, sym)
+    if known is not None and (known.name or known.currency):
+        return {"symbol": sym, "name": known.name, "currency": known.currency}
+
+    cutoff = (_utc_now() - timedelta(days=GUESS_TTL_DAYS)).isoformat(timespec="seconds")
+    cached = db.get(AssetGuess, sym)
+    if cached is not None and (cached.fetched_at or "") >= cutoff:
+        return {"symbol": sym, "name": cached.name, "currency": cached.currency}
+
+    data = services.guess_asset_metadata(sym)
+    # una risposta vuota (servizio non raggiungibile, simbolo ignoto) non viene salvata
+    if data.get("name") or data.get("currency"):
+        values = {
+            "name": data.get("name"), "currency": data.get("currency"),
+            "fetched_at": _utc_now().isoformat(timespec="seconds"),
+        }
+        # upsert: due richieste concorrenti per lo stesso simbolo nuovo non collidono sulla chiave
+        stmt = sqlite_insert(AssetGuess).values(symbol=sym, **values)
+        db.execute(stmt.on_conflict_do_update(index_elements=[AssetGuess.symbol], set_=values))
+        db.commit()
+    return {"symbol": sym, "name": data.get("name"), "currency": data.get("currency")}
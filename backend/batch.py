@@ -0,0 +1,89 @@
+# backend/batch.py
+"""
+POST /batch: più richieste di lettura in una sola chiamata HTTP.
+
+Ogni sotto-richiesta ("GET /assets/STK1/delta?portfolio_id=1") passa dall'app ASGI
+come una richiesta normale (stessi middleware, parametri, validazione ed errori), ma
+tutte usano la stessa sessione DB (database.shared_session) e gli stessi prezzi e
+cambi (pricing.shared_snapshots): niente sessione e lettura dei prezzi per ogni
+chiamata, e i numeri di una pagina sono coerenti tra loro. Le sotto-richieste
+sono eseguite in sequenza, nell'ordine ricevuto; un errore in una non ferma le altre.
+"""
+import json
+import logging
+from typing import Any, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from .database import shared_session
+from .pricing import shared_snapshots
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUESTS = 200
+# solo letture che terminano: niente stream, export o batch annidati
+_EXCLUDED_PREFIXES = ("/batch", "/stream/", "/operations/export")
+
+
+def validate(items) -> None:
+    if len(items) > MAX_REQUESTS:
+        raise ValueError(f"Al massimo {MAX_REQUESTS} richieste per batch")
+    for item in items:
+        if item.method.upper() != "GET":
+            raise ValueError(f"Solo richieste GET nel batch: {item.method} {item.path}")
+        if not item.path.startswith("/"):
+            raise ValueError(f"Percorso non valido: {item.path}")
+        if item.path.split("?", 1)[0].startswith(_EXCLUDED_PREFIXES):
+            raise ValueError(f"Percorso non ammesso nel batch: {item.path}")
+
+
+async def _dispatch(parent_scope: dict, path: str) -> Tuple[int, Any]:
+    """Esegue GET path sull'app e ritorna (status, corpo decodificato)."""
+    route_path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": parent_scope.get("asgi", {"version": "3.0"}),
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": parent_scope.get("scheme", "http"),
+        "server": parent_scope.get("server"),
+        "client": parent_scope.get("client"),
+        "root_path": parent_scope.get("root_path", ""),
+        "path": route_path,
+        "raw_path": route_path.encode(),
+        "query_string": query.encode(),
+        "headers": [(b"accept", b"application/json")],
+    }
+    status = 500
+    chunks: List[bytes] = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await parent_scope["app"](scope, receive, send)
+    raw = b"".join(chunks)
+    try:
+        return status, json.loads(raw) if raw else None
+    except ValueError:
+        return status, raw.decode("utf-8", "replace")
+
+
+async def run(parent_scope: dict, db: Session, items) -> List[dict]:
+    results = []
+    with shared_session(db), shared_snapshots():
+        for item in items:
+            try:
+                status, body = await _dispatch(parent_scope, item.path)
+            except Exception:
+                logger.exception("batch: errore in GET %s", item.path)
+                db.rollback()
+                status, body = 500, {"detail": "Internal Server Error"}
+            results.append({"path": item.path, "status": status, "body": body})
+    return results
@@ -0,0 +1,235 @@
+# backend/columnar_io.py
+"""
+Import / export colonnare (Parquet o Arrow IPC) di operations, asset_info,
+wallets e dello storico prezzi.
+
+Le colonne sono tipizzate a partire dai modelli SQLAlchemy, la scrittura e la
+lettura avvengono a blocchi (record batch) così da gestire milioni di righe
+con memoria costante. Richiede pyarrow (dipendenza opzionale).
+
+I Float possono contenere testo sporco (import da CSV, es. "1,5"): l'export non lo
+converte. La colonna float64 ha NULL e il testo salvato va nella colonna affiancata
+<nome>__raw, che l'import rimette nella colonna originale: export + import
+riproducono i valori salvati. La normalizzazione resta alle letture e aggregazioni.
+
+L'import di operations non passa dai trigger del log (event_log): i trigger sono
+sospesi per la durata dell'import, nella stessa transazione, e al loro posto si
+registra un solo evento "import" con uno snapshot dello stato calcolato dalla tabella.
+Un evento per riga renderebbe l'import lento quanto il log e lo raddoppierebbe di
+dimensione; la storia riga per riga di ciò che è importato resta nel file sorgente.
+
+Uso da riga di comando:
+    python -m backend.columnar_io export ./dump --format parquet
+    python -m backend.columnar_io import ./dump --replace
+"""
+import argparse
+import os
+from contextlib import nullcontext
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import Boolean, Date, Float, Integer, String, Text, case, delete, func, insert, select, text
+from sqlalchemy.orm import Session
+
+from . import alerts, asset_registry, event_log, ledger_cache, price_store
+from .models import AssetInfo, Operation, PriceHistory, Wallet
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:  # dipendenza opzionale
+    pa = None
+
+TABLES = {
+    "wallets": Wallet,
+    "asset_info": AssetInfo,
+    "operations": Operation,
+    "price_history": PriceHistory,
+}
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+BATCH_SIZE = 50_000
+# colonna affiancata a ogni Float con il testo salvato quando non è un numero
+RAW_SUFFIX = "__raw"
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required for Parquet/Arrow import and export (pip install pyarrow)")
+
+
+def _arrow_type(column):
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Date):
+        return pa.date32()
+    if isinstance(column.type, (String, Text)):
+        return pa.string()
+    raise TypeError(f"unsupported column type {column.type!r} for {column}")
+
+
+def _float_columns(model) -> List[str]:
+    return [c.name for c in model.__table__.columns if isinstance(c.type, Float)]
+
+
+def arrow_schema(model) -> "pa.Schema":
+    """Schema Arrow tipizzato dalle colonne del modello (nullable come nel DB), più le colonne __raw dei Float."""
+    _require_pyarrow()
+    fields = [
+        pa.field(c.name, _arrow_type(c), nullable=bool(c.nullable) and not c.primary_key)
+        for c in model.__table__.columns
+    ]
+    fields += [pa.field(name + RAW_SUFFIX, pa.string()) for name in _float_columns(model)]
+    return pa.schema(fields, metadata={"bugetto.table": model.__tablename__})
+
+
+def _select(model):
+    # Float: il numero salvato, o NULL con il testo salvato nella colonna __raw (vedi docstring)
+    columns, raw = [], []
+    for c in model.__table__.columns:
+        if isinstance(c.type, Float):
+            columns.append(case((func.typeof(c).in_(("real", "integer")), c)).label(c.name))
+            raw.append(case((func.typeof(c) == "text", c)).label(c.name + RAW_SUFFIX))
+        else:
+            columns.append(c)
+    return select(*columns, *raw).order_by(model.__table__.primary_key.columns.values()[0])
+
+
+def export_table(db: Session, name: str, path: str, fmt: str = "parquet", batch_size: int = BATCH_SIZE) -> int:
+    """Scrive la tabella `name` in `path` a blocchi di batch_size righe. Ritorna le righe scritte."""
+    _require_pyarrow()
+    model = TABLES[name]
+    schema = arrow_schema(model)
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(path, schema, compression="zstd")
+    elif fmt == "arrow":
+        writer = pa_ipc.new_file(path, schema)
+    else:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+
+    written = 0
+    stmt = _select(model).execution_options(stream_results=True, yield_per=batch_size)
+    try:
+        for rows in db.execute(stmt).partitions(batch_size):
+            columns = list(zip(*rows))
+            arrays = [pa.array(col, type=field.type) for col, field in zip(columns, schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            written += len(rows)
+    finally:
+        writer.close()
+    return written
+
+
+def _iter_batches(path: str, batch_size: int):
+    if path.endswith(FORMATS["arrow"]):
+        reader = pa_ipc.open_file(path)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+    else:
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+
+
+def import_table(db: Session, name: str, path: str, replace: bool = False, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Inserisce a blocchi le righe del file nella tabella `name`, mantenendo gli id.
+    Con replace=True la tabella viene svuotata prima dell'import.
+    """
+    _require_pyarrow()
+    model = TABLES[name]
+    pk = model.__table__.primary_key.columns.values()[0].name
+    raw_columns = {c + RAW_SUFFIX: c for c in _float_columns(model)}
+    known = set(model.__table__.columns.keys()) | set(raw_columns)
+    date_columns = {c.name for c in model.__table__.columns if isinstance(c.type, Date)}
+
+    # operations: trigger del log sospesi, un solo evento "import" con lo snapshot finale
+    log = event_log.suspended_triggers(db) if name == "operations" else nullcontext()
+    with log:
+        if replace:
+            db.execute(delete(model))
+        imported = 0
+        for batch in _iter_batches(path, batch_size):
+            unknown = set(batch.schema.names) - known
+            if unknown:
+                raise ValueError(f"{path}: unknown columns for {name}: {', '.join(sorted(unknown))}")
+            rows = batch.to_pylist()
+            # file esportati prima delle colonne Date: date come testo "YYYY-MM-DD"
+            text_dates = [f.name for f in batch.schema if f.name in date_columns and pa.types.is_string(f.type)]
+            raw_present = [(r, c) for r, c in raw_columns.items() if r in batch.schema.names]
+            raw_values: Dict[str, List[dict]] = {}
+            for row in rows:
+                for column in text_dates:
+                    row[column] = date.fromisoformat(row[column][:10]) if row[column] else None
+                for raw, column in raw_present:
+                    value = row.pop(raw)
+                    if value is not None:
+                        raw_values.setdefault(column, []).append({"pk": row[pk], "value": value})
+            if rows:
+                db.connection().execute(insert(model.__table__), rows)
+                # testo salvato così com'è: un parametro testuale non passa dalla conversione dei Float
+                for column, values in raw_values.items():
+                    db.connection().execute(text(f"UPDATE {name} SET {column} = :value WHERE {pk} = :pk"), values)
+                imported += len(rows)
+    if name == "operations":
+        event_log.record_import(db)
+    db.commit()
+
+    if name == "operations":
+        ledger_cache.invalidate()
+    if name == "price_history":
+        price_store.invalidate_history()
+    if name == "asset_info":
+        asset_registry.invalidate()
+    alerts.reset()
+    return imported
+
+
+def export_all(db: Session, directory: str, fmt: str = "parquet", tables: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    os.makedirs(directory, exist_ok=True)
+    return {
+        name: export_table(db, name, os.path.join(directory, name + FORMATS[fmt]), fmt)
+        for name in (tables or TABLES)
+    }
+
+
+def import_all(db: Session, directory: str, replace: bool = False, tables: Optional[Iterable[str]] = None) -> Dict[str, int]:
+    """Importa i file presenti nella cartella, nell'ordine delle dipendenze (wallets prima di operations)."""
+    result: Dict[str, int] = {}
+    names: List[str] = [n for n in TABLES if tables is None or n in tables]
+    for name in names:
+        for ext in FORMATS.values():
+            path = os.path.join(directory, name + ext)
+            if os.path.exists(path):
+                result[name] = import_table(db, name, path, replace=replace)
+                break
+    return result
+
+
+def main(argv=None):
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Import/export Parquet/Arrow del database bugetto")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("directory")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--tables", nargs="*", choices=list(TABLES))
+    parser.add_argument("--replace", action="store_true", help="svuota le tabelle prima dell'import")
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.command == "export":
+            counts = export_all(db, args.directory, args.format, args.tables)
+        else:
+            counts = import_all(db, args.directory, args.replace, args.tables)
+    finally:
+        db.close()
+    for name, n in counts.items():
+        print(f"[OK] {name}: {n} righe")
+
+
+if __name__ == "__main__":
+    main()
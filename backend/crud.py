@@ -4,52 +4,96 @@ from sqlalchemy import func, text
 from backend import models
 from .models import Operation, AssetInfo, Wallet
 from .services import get_conversion_rate, get_current_price
-from datetime import datetime
+from datetime import date, datetime
 from collections import defaultdict
 from .schemas import OperationIn
 from .database import SessionLocal
-from typing import Dict, List, Tuple
-from . import models, schemas
+from typing import Dict, Iterable, List, Optional, Tuple
+from . import models, schemas, ledger_cache, fast_json, alerts, asset_registry, event_log, analytics
+from .pricing import PriceSnapshot
 
-
-import yfinance as yf
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Traccia per asset della valorizzazione (quantità, prezzo, cambio): opt-in con
+# BUGETTO_VALUATION_TRACE=1 o portando il logger "backend.valuation" a DEBUG.
+# Con la variabile la traccia ha un suo handler e non si propaga: ogni riga una sola
+# volta, anche sotto gli handler di uvicorn/root e dopo un reload del modulo.
+trace_logger = logging.getLogger("backend.valuation")
+if os.environ.get("BUGETTO_VALUATION_TRACE", "") not in ("", "0"):
+    trace_logger.setLevel(logging.DEBUG)
+    trace_logger.propagate = False
+    if not trace_logger.handlers:
+        trace_logger.addHandler(logging.StreamHandler())
+
 POSITIVE_TYPES = {"Acquisto", "Donazione (ricevuta)", "Saving", "Consolidamento"}
 NEGATIVE_TYPES = {"Vendita", "Donazione (effettuata)", "Spesa"}
 
 
-def get_wallets(db: Session):
-    return db.query(models.Wallet).all()
+# Select per il percorso JSON veloce: response model verificati una volta all'import
+OPERATIONS_FAST_SELECT = fast_json.build_select(schemas.OperationOut, models.Operation)
+ASSETS_FAST_SELECT = fast_json.build_select(schemas.AssetOut, models.AssetInfo)
+WALLETS_FAST_SELECT = fast_json.build_select(schemas.WalletOut, models.Wallet)
+
+
+def _scoped(query, model, portfolio_id: Optional[int]):
+    """Filtra per portafoglio (colonna indicizzata); None = tutti i portafogli."""
+    if portfolio_id is None:
+        return query
+    return query.filter(model.portfolio_id == portfolio_id)
+
+
+def _until(query, as_of: Optional[date]):
+    """Solo le operazioni con data <= as_of (indice su operations.date)."""
+    return query if as_of is None else query.filter(models.Operation.date <= as_of)
+
+
+def get_wallets(db: Session, portfolio_id: Optional[int] = None):
+    return _scoped(db.query(models.Wallet), models.Wallet, portfolio_id).all()
+
+def get_wallets_rows(db: Session, portfolio_id: Optional[int] = None):
+    stmt = WALLETS_FAST_SELECT
+    if portfolio_id is not None:
+        stmt = stmt.where(models.Wallet.portfolio_id == portfolio_id)
+    return db.execute(stmt).all()
+
+def list_portfolios(db: Session):
+    return db.query(models.Portfolio).order_by(models.Portfolio.name.asc()).all()
+
+def create_portfolio(db: Session, data: schemas.PortfolioCreate):
+    p = models.Portfolio(name=data.name, owner_id=data.owner_id, shared=data.shared)
+    db.add(p); db.commit(); db.refresh(p)
+    return p
 
 def get_assets(db: Session):
     return db.query(models.AssetInfo).all()
 
-def get_dashboard_summary(db: Session):
-    from .services import get_conversion_rate
-    from .models import AssetInfo
+def get_assets_rows(db: Session):
+    return db.execute(ASSETS_FAST_SELECT).all()
 
-    total_value = db.query(func.sum(models.Operation.total_value)) \
+def get_dashboard_summary(db: Session, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    total_value = _until(_scoped(db.query(func.sum(models.Operation.total_value)), models.Operation, portfolio_id), as_of) \
         .filter(models.Operation.accounting == True).scalar() or 0
 
-    liquid_assets = db.query(AssetInfo).filter(
-        AssetInfo.visible == True,
-        AssetInfo.type == 'Liquidi'
-    ).all()
+    liquid_assets = [
+        a for a in asset_registry.get_assets(db).values() if a.visible and a.type == 'Liquidi'
+    ]
 
+    snapshot = PriceSnapshot(db, as_of)
+    snapshot.prefetch_fx(a.symbol for a in liquid_assets)
     total_liquidity = 0
     for asset in liquid_assets:
         symbol = asset.symbol.upper()
-        quantity = get_asset_quantity(db, symbol)
+        quantity = get_asset_quantity(db, symbol, portfolio_id, as_of)
 
         if symbol == "EUR":
             price = 1.0
         else:
-            price = get_conversion_rate(symbol, "EUR")
+            price = snapshot.rate(symbol, "EUR")
 
-        logger.warning(f">>> Liquidity conversion: {quantity} {symbol} → EUR @ {price}")
+        trace_logger.debug("liquidità: %s %s → EUR @ %s", quantity, symbol, price)
         total_liquidity += quantity * price
         
 
@@ -61,14 +105,14 @@ def get_dashboard_summary(db: Session):
     }
 
 
-def get_allocation_by_asset(db: Session):
-    total = db.query(func.sum(models.Operation.total_value))\
+def get_allocation_by_asset(db: Session, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    total = _until(_scoped(db.query(func.sum(models.Operation.total_value)), models.Operation, portfolio_id), as_of)\
         .filter(models.Operation.accounting == True).scalar() or 0
 
-    results = db.query(
+    results = _until(_scoped(db.query(
         models.Operation.asset_symbol,
         func.sum(models.Operation.total_value).label("value")
-    ).filter(models.Operation.accounting == True)\
+    ), models.Operation, portfolio_id), as_of).filter(models.Operation.accounting == True)\
      .group_by(models.Operation.asset_symbol)\
      .order_by(func.sum(models.Operation.total_value).desc()).all()
 
@@ -81,17 +125,17 @@ def get_allocation_by_asset(db: Session):
         for r in results
     ]
 
-def get_allocation_by_category(db: Session):
-    total = db.query(func.sum(models.Operation.total_value))\
+def get_allocation_by_category(db: Session, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    total = _until(_scoped(db.query(func.sum(models.Operation.total_value)), models.Operation, portfolio_id), as_of)\
         .filter(models.Operation.accounting == True).scalar() or 0
 
-    results = db.query(
+    results = _until(_scoped(db.query(
         models.AssetInfo.type,
         func.sum(models.Operation.total_value).label("value")
     ).join(
         models.AssetInfo,
         models.Operation.asset_symbol == models.AssetInfo.symbol
-    ).filter(models.Operation.accounting == True)\
+    ), models.Operation, portfolio_id), as_of).filter(models.Operation.accounting == True)\
      .group_by(models.AssetInfo.type)\
      .order_by(func.sum(models.Operation.total_value).desc()).all()
 
@@ -105,21 +149,21 @@ def get_allocation_by_category(db: Session):
     ]
 
 
-def get_average_purchase_rate(db: Session, symbol: str) -> float:
+def get_average_purchase_rate(db: Session, symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None) -> float:
     symbol_lower = symbol.lower()
 
     # Filter using case-insensitive match
-    purchase_total = db.query(
+    purchase_total = _until(_scoped(db.query(
         func.sum(models.Operation.price * models.Operation.quantity)
-    ).filter(
+    ), models.Operation, portfolio_id), as_of).filter(
         func.lower(models.Operation.asset_symbol) == symbol_lower,
         models.Operation.accounting == True,
         models.Operation.operation_type == "Acquisto"
     ).scalar() or 0
 
-    donation_total = db.query(
+    donation_total = _until(_scoped(db.query(
         func.sum(0 * models.Operation.quantity)
-    ).filter(
+    ), models.Operation, portfolio_id), as_of).filter(
         func.lower(models.Operation.asset_symbol) == symbol_lower,
         models.Operation.accounting == True,
         models.Operation.operation_type == "Donazione (ricevuta)"
@@ -127,9 +171,9 @@ def get_average_purchase_rate(db: Session, symbol: str) -> float:
 
     numerator = purchase_total + donation_total
 
-    denominator = db.query(
+    denominator = _until(_scoped(db.query(
         func.sum(models.Operation.quantity)
-    ).filter(
+    ), models.Operation, portfolio_id), as_of).filter(
         func.lower(models.Operation.asset_symbol) == symbol_lower,
         models.Operation.accounting == True,
         models.Operation.operation_type.in_(["Acquisto", "Donazione (ricevuta)"])
@@ -137,38 +181,24 @@ def get_average_purchase_rate(db: Session, symbol: str) -> float:
 
     return round(numerator / denominator, 6) if denominator else 0.0
 
-def get_asset_quantity_by_wallet(db: Session, asset_symbol: str, wallet_id: int) -> float:
-    symbol_lower = asset_symbol.lower()
-    result = db.query(
-        func.sum(models.Operation.quantity)
-    ).filter(
-        func.lower(models.Operation.asset_symbol) == symbol_lower,
-        models.Operation.wallet_id == wallet_id,
-        models.Operation.accounting == True
-    ).scalar()
-    
-    return round(result or 0, 6)
+def get_asset_quantity_by_wallet(
+    db: Session, asset_symbol: str, wallet_id: int, portfolio_id: Optional[int] = None, as_of: Optional[date] = None
+) -> float:
+    ledger = ledger_cache.get_ledger(db, portfolio_id)
+    return round(ledger.quantity_of(asset_symbol, wallet_id, until=as_of), 6)
 
 
 # Total quantity held (only operations with accounting = True)
-def get_asset_quantity(db: Session, symbol: str):
-    symbol_lower = symbol.lower()  
-   # logger.warning(">>> DEBUG SYMBOL: %s", symbol_lower)
-    result = db.query(
-        func.sum(models.Operation.quantity)
-    ).filter(
-        func.lower(models.Operation.asset_symbol) == symbol_lower,
-        models.Operation.accounting == True
-    ).scalar()
-    
-    return round(result or 0, 6)  
+def get_asset_quantity(db: Session, symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    ledger = ledger_cache.get_ledger(db, portfolio_id)
+    return round(ledger.quantity_of(symbol, until=as_of), 6)
         
-def get_total_dividends_by_asset(db: Session, symbol: str):
+def get_total_dividends_by_asset(db: Session, symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
     symbol_lower = symbol.lower()
     
-    total_dividends = db.query(
+    total_dividends = _until(_scoped(db.query(
         func.sum(models.Operation.total_value)
-    ).filter(
+    ), models.Operation, portfolio_id), as_of).filter(
         func.lower(models.Operation.asset_symbol) == symbol_lower,
         models.Operation.accounting == True,
           func.lower(models.Operation.operation_type) == "dividendo"
@@ -176,46 +206,28 @@ def get_total_dividends_by_asset(db: Session, symbol: str):
     
     return round(total_dividends or 0, 2)
 
-def get_allocation_by_category_group(db: Session):
-    from .services import get_current_price, get_conversion_rate
-    from .models import AssetInfo, Operation
-
+def get_allocation_by_category_group(db: Session, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
     POSITIVE_TYPES = {"Acquisto", "Donazione (ricevuta)", "Saving", "Consolidamento"}
     NEGATIVE_TYPES = {"Vendita", "Donazione (effettuata)", "Spesa"}
 
     category_totals = {}
-    symbol_to_category = {}
-
-    # Join operations + asset info solo su visibili
-    operations = (
-        db.query(Operation, AssetInfo)
-        .join(AssetInfo, Operation.asset_symbol == AssetInfo.symbol)
-        .filter(AssetInfo.visible == True)
-        .filter(AssetInfo.category != None)
-        .filter(Operation.accounting == True)
-        .filter(Operation.operation_type.in_(POSITIVE_TYPES.union(NEGATIVE_TYPES)))
-        .all()
-    )
 
-    # Raggruppa le quantità per asset
-    asset_quantities = {}
-    for op, asset in operations:
-        symbol = asset.symbol
-        symbol_to_category[symbol] = asset.category
-        try:
-            qty = float(op.quantity)
-        except Exception:
-            continue
+    # Quantità per asset dal ledger colonnare in cache (o da DuckDB, vedi analytics)
+    asset_quantities = analytics.positions(db, portfolio_id, POSITIVE_TYPES.union(NEGATIVE_TYPES), as_of)
 
-        if symbol not in asset_quantities:
-            asset_quantities[symbol] = 0.0
-        asset_quantities[symbol] += qty
+    # Metadati degli asset visibili con categoria (registro in memoria)
+    assets = {k: a for k, a in asset_registry.get_assets(db).items() if a.visible and a.category is not None}
+    snapshot = PriceSnapshot(db, as_of)
+    snapshot.prefetch(assets[k].symbol for k in asset_quantities if k in assets)
+    snapshot.prefetch_fx({a.currency for a in assets.values()})
+    trace = trace_logger.isEnabledFor(logging.DEBUG)
 
-    for symbol, quantity in asset_quantities.items():
+    for key, quantity in asset_quantities.items():
         try:
-            asset = db.query(AssetInfo).filter(AssetInfo.symbol == symbol).first()
+            asset = assets.get(key)
             if not asset or not asset.category:
                 continue
+            symbol = asset.symbol
 
             # ✅ Liquidità: non usare get_current_price
             if asset.category.lower() == "liquidità":
@@ -223,25 +235,26 @@ def get_allocation_by_category_group(db: Session):
             elif symbol.upper() == "EUR":
                 current_price = 1.0
             else:
-                current_price = get_current_price(symbol)
+                current_price = snapshot.price(symbol)
 
             conversion_rate = 1.0
             if asset.currency and asset.currency.upper() != "EUR":
-                conversion_rate = get_conversion_rate(asset.currency, "EUR")
+                conversion_rate = snapshot.rate(asset.currency, "EUR")
 
             value_eur = quantity * current_price * conversion_rate
 
-            logger.warning(
-                ">>> DEBUG: %s | category=%s | currency=%s | qty=%.4f | price=%.4f | rate=%.4f | EUR=%.2f",
-                symbol, asset.category, asset.currency, quantity, current_price, conversion_rate, value_eur
-            )
+            if trace:
+                trace_logger.debug(
+                    "allocazione: %s | category=%s | currency=%s | qty=%.4f | price=%.4f | rate=%.4f | EUR=%.2f",
+                    symbol, asset.category, asset.currency, quantity, current_price, conversion_rate, value_eur
+                )
 
             if asset.category not in category_totals:
                 category_totals[asset.category] = 0.0
             category_totals[asset.category] += value_eur
 
         except Exception as e:
-            logger.warning(">>> ERRORE asset %s: %s", symbol, str(e))
+            logger.warning("allocazione: errore per l'asset %s: %s", key, e)
             continue
 
     # Elimina categorie nulle o con valore irrilevante
@@ -260,66 +273,43 @@ def get_allocation_by_category_group(db: Session):
     return result
 
 
-def get_historical_allocation_by_category(db: Session):
-    from .services import get_current_price, get_conversion_rate
-    from .models import AssetInfo, Operation
+def get_historical_allocation_by_category(db: Session, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
     from collections import defaultdict
-    from datetime import datetime
 
     POSITIVE_TYPES = {"Acquisto", "Donazione (ricevuta)", "Saving", "Consolidamento"}
     NEGATIVE_TYPES = {"Vendita", "Donazione (effettuata)", "Spesa"}
 
-    # Step 1 - Carica tutte le operazioni valide e visibili
-    raw = (
-        db.query(Operation, AssetInfo)
-        .join(AssetInfo, Operation.asset_symbol == AssetInfo.symbol)
-        .filter(AssetInfo.visible == True)
-        .filter(AssetInfo.category != None)
-        .filter(Operation.accounting == True)
-        .filter(Operation.operation_type.in_(POSITIVE_TYPES.union(NEGATIVE_TYPES)))
-        .all()
-    )
-
-    # Step 2 - Raggruppa quantità per (YYYY-MM, symbol)
-    grouped_quantities = defaultdict(lambda: defaultdict(float))  # date -> symbol -> qty
-    symbol_to_category = {}
+    # Step 1 - Quantità per (YYYY-MM, symbol) dal ledger colonnare in cache (o da DuckDB, vedi analytics)
+    grouped_quantities = analytics.monthly_deltas(db, portfolio_id, POSITIVE_TYPES.union(NEGATIVE_TYPES), as_of)
 
-    for op, asset in raw:
-        try:
-            date_obj = (
-                op.date
-                if isinstance(op.date, datetime)
-                else datetime.strptime(op.date, "%Y-%m-%d")
-            )
-            year_month = date_obj.strftime("%Y-%m")
-            qty = float(str(op.quantity).replace(",", "."))
-            grouped_quantities[year_month][asset.symbol] += qty
-            symbol_to_category[asset.symbol] = asset.category
-        except Exception as e:
-            print(f"Errore parsing operazione: {e}")
-            continue
+    # Step 2 - Metadati degli asset visibili con categoria (registro in memoria)
+    assets = {k: a for k, a in asset_registry.get_assets(db).items() if a.visible and a.category is not None}
+    snapshot = PriceSnapshot(db, as_of)
+    snapshot.prefetch(a.symbol for a in assets.values())
+    snapshot.prefetch_fx({a.currency for a in assets.values()})
 
     # Step 3 - Calcola EUR value per (YYYY-MM, category)
     historical_data = []
     for date, symbol_quantities in grouped_quantities.items():
         category_totals = defaultdict(float)
 
-        for symbol, qty in symbol_quantities.items():
+        for key, qty in symbol_quantities.items():
             try:
-                asset = db.query(AssetInfo).filter(AssetInfo.symbol == symbol).first()
+                asset = assets.get(key)
                 if not asset or not asset.category:
                     continue
+                symbol = asset.symbol
 
-                current_price = 1.0 if symbol.upper() == "EUR" else get_current_price(symbol)
+                current_price = 1.0 if symbol.upper() == "EUR" else snapshot.price(symbol)
                 conversion_rate = 1.0
                 if asset.currency and asset.currency.upper() != "EUR":
-                    conversion_rate = get_conversion_rate(asset.currency, "EUR")
+                    conversion_rate = snapshot.rate(asset.currency, "EUR")
 
                 value_eur = qty * current_price * conversion_rate
                 category_totals[asset.category] += value_eur
 
             except Exception as e:
-                print(f"Errore nel calcolo EUR per {symbol}: {e}")
+                logger.warning("allocazione storica: errore nel calcolo EUR per %s: %s", key, e)
                 continue
 
         # Calcolo % su totale
@@ -345,7 +335,7 @@ def get_historical_allocation_by_category(db: Session):
 def create_operation(db: Session, op: OperationIn):
     # normalizza simbolo e recupera AssetInfo
     symbol = op.asset_symbol.upper()
-    asset = db.query(AssetInfo).filter(func.lower(AssetInfo.symbol) == symbol.lower()).first()
+    asset = asset_registry.get(db, symbol)
 
     # valuta currency di acquisto
     purchase_ccy = (op.purchase_currency or (asset.currency if asset else None) or "EUR").upper()
@@ -368,7 +358,7 @@ def create_operation(db: Session, op: OperationIn):
     else:
         from .services import get_current_price, get_day_prices
         # per liquidità o EUR: 1 nella propria valuta
-        is_liquidity = (asset and ((asset.type or "").lower() == "liquidi" or (asset.category or "").lower() == "liquidità"))
+        is_liquidity = asset and asset.liquidity
         if is_liquidity or symbol == "EUR":
             price_base = 1.0
             close, high, low = 1.0, 1.0, 1.0
@@ -409,12 +399,13 @@ def create_operation(db: Session, op: OperationIn):
     db.add(db_op)
     db.commit()
     db.refresh(db_op)
+    ledger_cache.invalidate()
     return db_op
 
 
 def _build_operation_object(db: Session, op: OperationIn) -> Operation:
     symbol = op.asset_symbol.upper()
-    asset = db.query(AssetInfo).filter(func.lower(AssetInfo.symbol) == symbol.lower()).first()
+    asset = asset_registry.get(db, symbol)
 
     purchase_ccy = (op.purchase_currency or (asset.currency if asset else None) or "EUR").upper()
 
@@ -430,7 +421,7 @@ def _build_operation_object(db: Session, op: OperationIn) -> Operation:
         close = high = low = price_base
     else:
         from .services import get_current_price, get_day_prices
-        is_liquidity = (asset and ((asset.type or "").lower() == "liquidi" or (asset.category or "").lower() == "liquidità"))
+        is_liquidity = asset and asset.liquidity
         if is_liquidity or symbol == "EUR":
             price_base = 1.0
             close = high = low = 1.0
@@ -445,8 +436,14 @@ def _build_operation_object(db: Session, op: OperationIn) -> Operation:
     total_eur = (qty * price_base * ex_rate) - fees_eur
       # <— set it from payload
 
+    # portafoglio: dal payload, altrimenti quello del wallet
+    portfolio_id = op.portfolio_id
+    if portfolio_id is None and op.wallet_id is not None:
+        portfolio_id = db.query(Wallet.portfolio_id).filter(Wallet.id == op.wallet_id).scalar()
+
     return Operation(
          user=op.user,
+        portfolio_id=portfolio_id,
         date=op.date,
         operation_type=op_type,
         quantity=qty,
@@ -477,22 +474,27 @@ def create_operation(db: Session, op: OperationIn):
     db.add(db_op)
     db.commit()
     db.refresh(db_op)
+    ledger_cache.invalidate(db_op.portfolio_id)
+    event_log.maybe_snapshot(db)
+    alerts.on_operations_changed(db, [db_op.asset_symbol], db_op.portfolio_id)
     return db_op
 
 
-def list_wallets(db: Session):
-    return db.query(Wallet).order_by(Wallet.name.asc()).all()
+def list_wallets(db: Session, portfolio_id: Optional[int] = None):
+    return _scoped(db.query(Wallet), Wallet, portfolio_id).order_by(Wallet.name.asc()).all()
 
-def create_wallet(db: Session, name: str):
-    existing = db.query(Wallet).filter(func.lower(Wallet.name) == name.lower()).first()
+def create_wallet(db: Session, name: str, portfolio_id: Optional[int] = None):
+    # stesso nome nello stesso portafoglio; senza portafoglio solo tra i wallet senza portafoglio
+    scope = Wallet.portfolio_id.is_(None) if portfolio_id is None else Wallet.portfolio_id == portfolio_id
+    existing = db.query(Wallet).filter(scope, func.lower(Wallet.name) == name.lower()).first()
     if existing:
         return existing
-    w = Wallet(name=name)
+    w = Wallet(name=name, portfolio_id=portfolio_id)
     db.add(w); db.commit(); db.refresh(w)
     return w
 
-def get_last_purchase_meta(db: Session, symbol: str):
-    q = (db.query(Operation, Wallet)
+def get_last_purchase_meta(db: Session, symbol: str, portfolio_id: Optional[int] = None):
+    q = (_scoped(db.query(Operation, Wallet), Operation, portfolio_id)
            .join(Wallet, Wallet.id == Operation.wallet_id, isouter=True)
            .filter(func.lower(Operation.asset_symbol) == symbol.lower())
            .filter(Operation.operation_type == "Acquisto")
@@ -522,6 +524,8 @@ def create_asset(db: Session, data: dict):
             if k in data and data[k] is not None:
                 setattr(a, k, data[k])
         db.commit(); db.refresh(a)
+        asset_registry.invalidate()
+        alerts.reset()
         return a
     a = AssetInfo(
         symbol=sym,
@@ -533,27 +537,52 @@ def create_asset(db: Session, data: dict):
         visible=bool(data.get("visible", True)),
     )
     db.add(a); db.commit(); db.refresh(a)
+    asset_registry.invalidate()
+    alerts.reset()
     return a
 
-def get_operations(db: Session, skip: int = 0) -> List[models.Operation]:
-    return db.query(models.Operation).offset(skip).all()
+def get_operations(db: Session, skip: int = 0, portfolio_id: Optional[int] = None) -> List[models.Operation]:
+    return _scoped(db.query(models.Operation), models.Operation, portfolio_id).offset(skip).all()
+
+def get_operations_rows(db: Session, skip: int = 0, portfolio_id: Optional[int] = None):
+    stmt = OPERATIONS_FAST_SELECT
+    if portfolio_id is not None:
+        stmt = stmt.where(models.Operation.portfolio_id == portfolio_id)
+    return db.execute(stmt.offset(skip)).all()
 
 def update_operation(db: Session, op_id: int, operation_in: schemas.OperationIn):
     # Example update implementation
     op = db.query(models.Operation).get(op_id)
     if not op:
         return None
-    for field, value in operation_in.dict(exclude_unset=True).items():
-        setattr(op, field, value)
+    previous_portfolio, previous_symbol, previous_wallet = op.portfolio_id, op.asset_symbol, op.wallet_id
+    changes = operation_in.dict(exclude_unset=True)
+    values = {column.key: getattr(op, column.key) for column in models.Operation.__table__.columns}
+    values.update(changes)
+    # portafoglio non indicato: quello del wallet, come in _build_operation_object
+    if changes.get("portfolio_id") is None and values["wallet_id"] is not None and (
+        values["wallet_id"] != previous_wallet or values["portfolio_id"] is None
+    ):
+        values["portfolio_id"] = db.query(Wallet.portfolio_id).filter(Wallet.id == values["wallet_id"]).scalar()
+    # segno della quantità, prezzo, cambio e totale ricalcolati dai nuovi valori prima di
+    # scrivere: una sola UPDATE e un solo evento per modifica
+    from .reprice import derive_operation
+    values.update(derive_operation(db, values))
+    for field, value in values.items():
+        if getattr(op, field) != value:
+            setattr(op, field, value)
     db.commit()
     db.refresh(op)
+    ledger_cache.invalidate(previous_portfolio, op.portfolio_id)
+    event_log.maybe_snapshot(db)
+    alerts.on_operations_changed(db, [previous_symbol, op.asset_symbol], previous_portfolio, op.portfolio_id)
     return op
 
 def duplicate_operation(db: Session, op_id: int):
     op = db.query(models.Operation).get(op_id)
     if not op:
         return None
-    # Copy fields except id
+    # Copia tutti i campi tranne l'id, derivati compresi (stessa data, stessi prezzi)
     new_op = models.Operation(
         date=op.date,
         operation_type=op.operation_type,
@@ -561,24 +590,39 @@ def duplicate_operation(db: Session, op_id: int):
         quantity=op.quantity,
         wallet_id=op.wallet_id,
         user=op.user,
+        portfolio_id=op.portfolio_id,
         broker=op.broker,
         accounting=op.accounting,
+        price=op.price,
         price_manual=op.price_manual,
+        price_avg_day=op.price_avg_day,
+        price_high_day=op.price_high_day,
+        price_low_day=op.price_low_day,
         purchase_currency=op.purchase_currency,
+        exchange_rate=op.exchange_rate,
+        total_value=op.total_value,
         fees=op.fees,
+        dividend_value=op.dividend_value,
         comment=op.comment,
     )
     db.add(new_op)
     db.commit()
     db.refresh(new_op)
+    ledger_cache.invalidate(new_op.portfolio_id)
+    event_log.maybe_snapshot(db)
+    alerts.on_operations_changed(db, [new_op.asset_symbol], new_op.portfolio_id)
     return new_op
 
 def delete_operation(db: Session, op_id: int):
     op = db.query(models.Operation).get(op_id)
     if not op:
         return None
+    portfolio_id, symbol = op.portfolio_id, op.asset_symbol
     db.delete(op)
     db.commit()
+    ledger_cache.invalidate(portfolio_id)
+    event_log.maybe_snapshot(db)
+    alerts.on_operations_changed(db, [symbol], portfolio_id)
     return True
 
 def delete_asset(db: Session, asset_id: int):
@@ -587,58 +631,111 @@ def delete_asset(db: Session, asset_id: int):
         return None
     db.delete(asset)
     db.commit()
+    asset_registry.invalidate()
+    alerts.reset()
     return True
 
-def _get_price_in_base(db, symbol: str, base_currency: str) -> float:
+def list_cashflows(db: Session, user: Optional[str] = None):
+    q = db.query(models.Cashflow)
+    if user:
+        q = q.filter(models.Cashflow.user == user)
+    return q.order_by(models.Cashflow.date.asc(), models.Cashflow.id.asc()).all()
+
+def create_cashflow(db: Session, data: schemas.CashflowIn):
+    cf = models.Cashflow(**data.model_dump())
+    db.add(cf); db.commit(); db.refresh(cf)
+    return cf
+
+def delete_cashflow(db: Session, cashflow_id: int):
+    cf = db.get(models.Cashflow, cashflow_id)
+    if not cf:
+        return None
+    db.delete(cf)
+    db.commit()
+    return True
+
+def list_alert_rules(db: Session, portfolio_id: Optional[int] = None):
+    return _scoped(db.query(models.AlertRule), models.AlertRule, portfolio_id).order_by(models.AlertRule.id).all()
+
+def create_alert_rule(db: Session, data: schemas.AlertRuleIn):
+    if data.kind not in alerts.RULE_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(alerts.RULE_KINDS)}")
+    if data.direction not in alerts.DIRECTIONS:
+        raise ValueError(f"direction must be one of {', '.join(alerts.DIRECTIONS)}")
+    if data.kind == "category_drift":
+        if not data.category or data.target_weight is None:
+            raise ValueError("category_drift requires category and target_weight")
+    elif not data.symbol:
+        raise ValueError(f"{data.kind} requires symbol")
+    rule = models.AlertRule(**data.model_dump())
+    rule.symbol = rule.symbol.upper() if rule.symbol else None
+    db.add(rule); db.commit(); db.refresh(rule)
+    alerts.invalidate_rules()
+    alerts.check_rules(db, [rule.id])
+    db.refresh(rule)
+    return rule
+
+def delete_alert_rule(db: Session, rule_id: int):
+    rule = db.get(models.AlertRule, rule_id)
+    if not rule:
+        return None
+    db.delete(rule)
+    db.commit()
+    alerts.invalidate_rules()
+    return True
+
+def list_alert_events(db: Session, only_open: bool = False, limit: int = 100):
+    q = db.query(models.AlertEvent)
+    if only_open:
+        q = q.filter(models.AlertEvent.acknowledged == False)
+    return q.order_by(models.AlertEvent.id.desc()).limit(limit).all()
+
+def acknowledge_alert(db: Session, event_id: int):
+    event = db.get(models.AlertEvent, event_id)
+    if not event:
+        return None
+    event.acknowledged = True
+    db.commit(); db.refresh(event)
+    return event
+
+def _prices_in_base(db, symbols: Iterable[str], base_currency: str, snapshot: Optional[PriceSnapshot] = None) -> Dict[str, float]:
     """
-    Ritorna il prezzo corrente del simbolo nella valuta base.
+    Ritorna il prezzo di ogni simbolo nella valuta base (corrente, o alla data della snapshot).
     Logica:
-      1) prova get_current_price(symbol)
-      2) fallback: ultimo prezzo NON nullo/zero da operations,
-         escludendo i tipi che non definiscono il prezzo (Movimento Interno, Saving, Spesa, ecc.)
+      1) prova snapshot.prices(symbols)
+      2) fallback: ultimo prezzo NON nullo/zero da operations, per tutti i simboli senza
+         prezzo in una sola query (escludendo i tipi che non definiscono il prezzo:
+         Movimento Interno, Saving, Spesa, ecc.)
       3) converte dalla currency dell'asset alla base_currency se necessario
     """
+    snapshot = snapshot or PriceSnapshot(db)
+    base = (base_currency or "EUR").upper()
+    assets = {s: asset_registry.get(db, s) for s in set(symbols)}
+
     # 0) EUR / liquidità: prezzo=1 nella propria valuta
-    asset = db.query(AssetInfo).filter(func.lower(AssetInfo.symbol) == symbol.lower()).first()
-    if asset:
-        is_liquidity = ((asset.type or "").lower() == "liquidi") or ((asset.category or "").lower() == "liquidità")
-        if symbol.upper() == "EUR" or is_liquidity:
-            return 1.0
-
-    # 1) Prezzo corrente dal servizio (se disponibile)
-    try:
-        p_now = get_current_price(symbol)
-        if p_now and p_now > 0:
-            price_eur = float(p_now)
-        else:
-            raise ValueError("no live price")
-    except Exception:
-        # 2) Fallback: ultimo prezzo valido dalle operations
-        sql = text("""
-            SELECT COALESCE(NULLIF(o.price,0), NULLIF(o.price_manual,0)) AS p
-            FROM operations o
-            WHERE o.asset_symbol = :symbol
-              AND o.accounting = 1
-              AND COALESCE(o.price, o.price_manual) IS NOT NULL
-              AND COALESCE(o.price, o.price_manual) > 0
-              AND o.operation_type NOT IN ('Movimento Interno', 'Saving', 'Spesa')
-            ORDER BY date(o.date) DESC, o.id DESC
-            LIMIT 1
-        """)
-        row = db.execute(sql, {"symbol": symbol}).first()
-        price_eur = float(row.p) if row and row.p is not None else 0.0
-
-    # 3) Conversione in base currency se serve
-    if asset and asset.currency and asset.currency.upper() != (base_currency or "EUR").upper():
-        rate = get_conversion_rate(asset.currency.upper(), (base_currency or "EUR").upper()) or 1.0
-        price_eur *= rate
-
-    return price_eur or 0.0
-
-
-def get_wallets_summary(db) -> Tuple[float, List[dict]]:
+    result: Dict[str, float] = {
+        s: 1.0 for s, asset in assets.items() if asset and (s.upper() == "EUR" or asset.liquidity)
+    }
+    priced = snapshot.prices(s for s in assets if s not in result)
+    snapshot.prefetch_fx({a.currency for s, a in assets.items() if a and a.currency and s in priced}, base)
+
+    for symbol, price in priced.items():
+        asset = assets[symbol]
+        # 3) Conversione in base currency se serve
+        if asset and asset.currency and asset.currency.upper() != base:
+            price *= snapshot.rate(asset.currency.upper(), base) or 1.0
+        result[symbol] = price or 0.0
+    return result
+
+
+def _get_price_in_base(db, symbol: str, base_currency: str, snapshot: Optional[PriceSnapshot] = None) -> float:
+    """Prezzo del simbolo nella valuta base (vedi _prices_in_base)."""
+    return _prices_in_base(db, [symbol], base_currency, snapshot)[symbol]
+
+
+def get_wallets_summary(db, portfolio_id: Optional[int] = None, as_of: Optional[date] = None) -> Tuple[float, List[dict]]:
     """
-    Aggrega quantità per (wallet, asset), valorizza con prezzo corrente e
+    Aggrega quantità per (wallet, asset), valorizza con prezzo corrente (o alla data as_of) e
     calcola top-assets e % sul portafoglio.
     """
     # Prendi base_currency dalle settings (prima riga o default EUR)
@@ -646,22 +743,23 @@ def get_wallets_summary(db) -> Tuple[float, List[dict]]:
     base_currency = db.execute(base_sql).scalar() or "EUR"
 
     # Quantità per wallet/asset
-    q_sql = text("""
+    portfolio_filter = "AND o.portfolio_id = :portfolio_id" if portfolio_id is not None else ""
+    date_filter = "AND o.date <= :as_of" if as_of is not None else ""
+    q_sql = text(f"""
         SELECT o.wallet_id AS wallet_id, w.name AS wallet_name, o.asset_symbol AS symbol,
                SUM(o.quantity) AS qty
         FROM operations o
         JOIN wallets w ON w.id = o.wallet_id
-        WHERE o.accounting = 1
+        WHERE o.accounting = 1 {portfolio_filter} {date_filter}
         GROUP BY o.wallet_id, w.name, o.asset_symbol
         HAVING ABS(SUM(o.quantity)) > 1e-12
         ORDER BY w.name ASC
     """)
-    rows = db.execute(q_sql).mappings().all()
+    rows = db.execute(q_sql, {"portfolio_id": portfolio_id, "as_of": as_of}).mappings().all()
 
-    # Valorizza e raggruppa per wallet
+    # Valorizza e raggruppa per wallet (prezzi di tutti i simboli in blocco)
     wallet_map: Dict[int, dict] = {}
-    # cache prezzi per simbolo
-    price_cache: Dict[str, float] = {}
+    price_cache = _prices_in_base(db, {r["symbol"] for r in rows}, base_currency, PriceSnapshot(db, as_of))
 
     for r in rows:
         wid = r["wallet_id"]
@@ -669,8 +767,6 @@ def get_wallets_summary(db) -> Tuple[float, List[dict]]:
         symbol = r["symbol"]
         qty = float(r["qty"])
 
-        if symbol not in price_cache:
-            price_cache[symbol] = _get_price_in_base(db, symbol, base_currency)
         price = price_cache[symbol]
         value = qty * price
 
@@ -708,25 +804,8 @@ def get_wallets_summary(db) -> Tuple[float, List[dict]]:
     items.sort(key=lambda i: i["total_value"], reverse=True)
     return total_portfolio_value, items
 
-def get_asset_breakdown_by_wallet(db, symbol: str) -> dict:
-    """
-    Breakdown per asset → wallet, con % sull'asset.
-    """
-    base_sql = text("SELECT COALESCE(MAX(base_currency), 'EUR') FROM settings")
-    base_currency = db.execute(base_sql).scalar() or "EUR"
-
-    q_sql = text("""
-        SELECT o.wallet_id AS wallet_id, w.name AS wallet_name, SUM(o.quantity) AS qty
-        FROM operations o
-        JOIN wallets w ON w.id = o.wallet_id
-        WHERE o.accounting = 1 AND o.asset_symbol = :symbol
-        GROUP BY o.wallet_id, w.name
-        HAVING ABS(SUM(o.quantity)) > 1e-12
-        ORDER BY w.name ASC
-    """)
-    rows = db.execute(q_sql, {"symbol": symbol}).mappings().all()
-
-    price = _get_price_in_base(db, symbol, base_currency)
+def _asset_breakdown(symbol: str, rows: List[dict], price: float) -> dict:
+    """Righe (wallet, quantità) di un asset → breakdown valorizzato con % sull'asset."""
     total_qty = sum(float(r["qty"]) for r in rows)
     breakdown = []
     for r in rows:
@@ -748,3 +827,54 @@ def get_asset_breakdown_by_wallet(db, symbol: str) -> dict:
         "total_value": total_qty * price,
         "breakdown": breakdown
     }
+
+def get_asset_breakdown_by_wallet(db, symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None) -> dict:
+    """
+    Breakdown per asset → wallet, con % sull'asset.
+    """
+    base_sql = text("SELECT COALESCE(MAX(base_currency), 'EUR') FROM settings")
+    base_currency = db.execute(base_sql).scalar() or "EUR"
+
+    portfolio_filter = "AND o.portfolio_id = :portfolio_id" if portfolio_id is not None else ""
+    date_filter = "AND o.date <= :as_of" if as_of is not None else ""
+    q_sql = text(f"""
+        SELECT o.wallet_id AS wallet_id, w.name AS wallet_name, SUM(o.quantity) AS qty
+        FROM operations o
+        JOIN wallets w ON w.id = o.wallet_id
+        WHERE o.accounting = 1 AND o.asset_symbol = :symbol {portfolio_filter} {date_filter}
+        GROUP BY o.wallet_id, w.name
+        HAVING ABS(SUM(o.quantity)) > 1e-12
+        ORDER BY w.name ASC
+    """)
+    rows = db.execute(q_sql, {"symbol": symbol, "portfolio_id": portfolio_id, "as_of": as_of}).mappings().all()
+
+    price = _get_price_in_base(db, symbol, base_currency, PriceSnapshot(db, as_of))
+    return _asset_breakdown(symbol, rows, price)
+
+def get_assets_breakdown_by_wallet(db, portfolio_id: Optional[int] = None, as_of: Optional[date] = None) -> List[dict]:
+    """
+    Breakdown asset → wallet di tutte le posizioni aperte: una query raggruppata per
+    (asset, wallet) e una sola valorizzazione dei prezzi. Stesso formato di
+    get_asset_breakdown_by_wallet per ogni asset, in ordine di simbolo.
+    """
+    base_sql = text("SELECT COALESCE(MAX(base_currency), 'EUR') FROM settings")
+    base_currency = db.execute(base_sql).scalar() or "EUR"
+
+    portfolio_filter = "AND o.portfolio_id = :portfolio_id" if portfolio_id is not None else ""
+    date_filter = "AND o.date <= :as_of" if as_of is not None else ""
+    q_sql = text(f"""
+        SELECT o.asset_symbol AS symbol, o.wallet_id AS wallet_id, w.name AS wallet_name, SUM(o.quantity) AS qty
+        FROM operations o
+        JOIN wallets w ON w.id = o.wallet_id
+        WHERE o.accounting = 1 {portfolio_filter} {date_filter}
+        GROUP BY o.asset_symbol, o.wallet_id, w.name
+        HAVING ABS(SUM(o.quantity)) > 1e-12
+        ORDER BY o.asset_symbol ASC, w.name ASC
+    """)
+    rows = db.execute(q_sql, {"portfolio_id": portfolio_id, "as_of": as_of}).mappings().all()
+
+    by_symbol: Dict[str, List[dict]] = {}
+    for r in rows:
+        by_symbol.setdefault(r["symbol"], []).append(r)
+    prices = _prices_in_base(db, by_symbol.keys(), base_currency, PriceSnapshot(db, as_of))
+    return [_asset_breakdown(symbol, items, prices[symbol]) for symbol, items in by_symbol.items()]
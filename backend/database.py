@@ -1,5 +1,9 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./bugetto.db"
 
@@ -8,8 +12,30 @@ engine = create_engine(
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# sessione imposta da shared_session(): get_db la riusa invece di aprirne una nuova
+_shared_session: ContextVar[Optional[Session]] = ContextVar("shared_session", default=None)
+
+
+@contextmanager
+def shared_session(db: Session) -> Iterator[Session]:
+    """Le richieste eseguite nel blocco (es. le sotto-richieste di /batch) usano tutte db."""
+    token = _shared_session.set(db)
+    try:
+        yield db
+    finally:
+        _shared_session.reset(token)
+
+
+def current_shared_session() -> Optional[Session]:
+    return _shared_session.get()
+
+
 # NEW: dependency FastAPI condivisa
 def get_db():
+    shared = _shared_session.get()
+    if shared is not None:
+        yield shared
+        return
     db = SessionLocal()
     try:
         yield db
@@ -0,0 +1,282 @@
+# backend/event_log.py
+"""
+Log append-only delle scritture su operations e snapshot periodici dello stato derivato.
+
+Tre trigger SQLite (TRIGGERS, installati dalla migrazione 6) scrivono in
+operation_events ogni insert, update e delete di operations con l'immagine JSON
+della riga prima e dopo: sono coperti anche gli UPDATE in blocco (reprice), che non
+passano dall'ORM. Gli import colonnari invece sospendono i trigger (suspended_triggers)
+e registrano un solo evento "import" senza immagini con uno snapshot calcolato da
+operations (record_import): milioni di righe importate non diventano milioni di eventi.
+
+Lo stato derivato (LedgerState) è la quantità per (portafoglio, simbolo, wallet) e il
+costo di carico per (portafoglio, simbolo) come in get_average_purchase_rate. Ogni
+evento toglie il contributo della riga vecchia e aggiunge quello della nuova, quindi
+lo stato dopo l'evento N si ottiene dallo snapshot più vicino (ledger_snapshots,
+event_id <= N) rigiocando solo gli eventi successivi. maybe_snapshot() compatta un
+nuovo snapshot ogni SNAPSHOT_EVERY eventi: ricostruzioni all'avvio o a un istante
+passato costano quanto l'attività recente, non quanto l'intero ledger.
+"""
+import json
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+SNAPSHOT_EVERY = 1000
+IMPORT_KIND = "import"
+
+COST_TYPES = ("Acquisto", "Donazione (ricevuta)")
+
+# colonne salvate nell'immagine della riga
+_ROW_COLUMNS = (
+    "id", "date", "operation_type", "asset_symbol", "quantity", "wallet_id", "portfolio_id", "accounting",
+    "price", "price_manual", "purchase_currency", "exchange_rate", "total_value", "fees", "dividend_value",
+)
+_NOW = "strftime('%Y-%m-%dT%H:%M:%fZ', 'now')"
+
+
+def _row_json(alias: str) -> str:
+    return "json_object(" + ", ".join(f"'{c}', {alias}.{c}" for c in _ROW_COLUMNS) + ")"
+
+
+TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_operations_log_insert AFTER INSERT ON operations BEGIN
+        INSERT INTO operation_events (operation_id, kind, recorded_at, old_row, new_row)
+        VALUES (NEW.id, 'insert', {_NOW}, NULL, {_row_json('NEW')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_operations_log_update AFTER UPDATE ON operations BEGIN
+        INSERT INTO operation_events (operation_id, kind, recorded_at, old_row, new_row)
+        VALUES (NEW.id, 'update', {_NOW}, {_row_json('OLD')}, {_row_json('NEW')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_operations_log_delete AFTER DELETE ON operations BEGIN
+        INSERT INTO operation_events (operation_id, kind, recorded_at, old_row, new_row)
+        VALUES (OLD.id, 'delete', {_NOW}, {_row_json('OLD')}, NULL);
+    END""",
+]
+
+
+def _num_sql(column: str) -> str:
+    # testo sporco ("1,5") convertito come _number; i numeri restano come sono
+    return f"(CASE WHEN typeof({column}) = 'text' THEN CAST(REPLACE({column}, ',', '.') AS REAL) ELSE COALESCE({column}, 0) END)"
+
+
+_BASE_HOLDINGS = f"""
+    SELECT portfolio_id, UPPER(asset_symbol), COALESCE(wallet_id, 0), SUM({_num_sql('quantity')})
+    FROM operations
+    WHERE accounting = 1 AND asset_symbol IS NOT NULL
+    GROUP BY 1, 2, 3
+"""
+_BASE_COST = f"""
+    SELECT portfolio_id, UPPER(asset_symbol), SUM({_num_sql('quantity')}),
+           SUM(CASE WHEN operation_type = 'Acquisto' THEN {_num_sql('price')} * {_num_sql('quantity')} ELSE 0 END)
+    FROM operations
+    WHERE accounting = 1 AND asset_symbol IS NOT NULL AND operation_type IN ('Acquisto', 'Donazione (ricevuta)')
+    GROUP BY 1, 2
+"""
+
+HoldingKey = Tuple[Optional[int], str, int]
+CostKey = Tuple[Optional[int], str]
+
+
+def _number(value) -> float:
+    """Valore numerico di una colonna Float, anche se salvata come testo sporco (come ledger_cache._floats)."""
+    try:
+        return float(str(value).replace(",", ".")) if value is not None else 0.0
+    except ValueError:
+        return 0.0
+
+
+class LedgerState:
+    """Posizioni e costo di carico; apply() somma (+1) o toglie (-1) il contributo di una riga."""
+
+    def __init__(self):
+        self.holdings: Dict[HoldingKey, float] = {}
+        self.cost: Dict[CostKey, List[float]] = {}  # [quantità acquistata, costo]
+
+    def apply(self, row: Optional[dict], sign: float) -> None:
+        if not row or not row.get("accounting") or not row.get("asset_symbol"):
+            return
+        portfolio_id, symbol = row.get("portfolio_id"), row["asset_symbol"].upper()
+        qty = _number(row.get("quantity"))
+        key = (portfolio_id, symbol, row.get("wallet_id") or 0)
+        self.holdings[key] = self.holdings.get(key, 0.0) + sign * qty
+        op_type = row.get("operation_type")
+        if op_type in COST_TYPES:
+            basis = self.cost.setdefault((portfolio_id, symbol), [0.0, 0.0])
+            basis[0] += sign * qty
+            if op_type == "Acquisto":
+                basis[1] += sign * qty * _number(row.get("price"))
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "holdings": [[p, s, w, q] for (p, s, w), q in self.holdings.items() if abs(q) > 1e-12],
+            "cost": [[p, s, q, c] for (p, s), (q, c) in self.cost.items() if abs(q) > 1e-12 or abs(c) > 1e-12],
+        })
+
+    @classmethod
+    def from_json(cls, raw: str) -> "LedgerState":
+        data = json.loads(raw)
+        state = cls()
+        state.holdings = {(p, s, w): q for p, s, w, q in data["holdings"]}
+        state.cost = {(p, s): [q, c] for p, s, q, c in data["cost"]}
+        return state
+
+    def holdings_rows(self, portfolio_id: Optional[int] = None) -> List[dict]:
+        return [
+            {"portfolio_id": p, "symbol": s, "wallet_id": w, "quantity": q}
+            for (p, s, w), q in sorted(self.holdings.items(), key=lambda kv: (kv[0][1], kv[0][2], kv[0][0] or 0))
+            if abs(q) > 1e-9 and (portfolio_id is None or p == portfolio_id)
+        ]
+
+    def cost_rows(self, portfolio_id: Optional[int] = None) -> List[dict]:
+        return [
+            {"portfolio_id": p, "symbol": s, "quantity": q, "cost": c, "average_price": round(c / q, 6) if q else 0.0}
+            for (p, s), (q, c) in sorted(self.cost.items(), key=lambda kv: (kv[0][1], kv[0][0] or 0))
+            if abs(q) > 1e-9 and (portfolio_id is None or p == portfolio_id)
+        ]
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def state_from_operations(conn) -> LedgerState:
+    """Stato corrente calcolato da operations con due query raggruppate (snapshot di partenza)."""
+    state = LedgerState()
+    for p, s, w, q in conn.execute(text(_BASE_HOLDINGS)):
+        state.holdings[(p, s, w)] = q
+    for p, s, q, c in conn.execute(text(_BASE_COST)):
+        state.cost[(p, s)] = [q, c]
+    return state
+
+
+def store_snapshot(conn, event_id: int, state: LedgerState) -> None:
+    conn.execute(
+        text("INSERT INTO ledger_snapshots (event_id, created_at, state) VALUES (:e, :t, :s)"),
+        {"e": event_id, "t": _utc_now(), "s": state.to_json()},
+    )
+
+
+def latest_event_id(db) -> int:
+    return db.execute(text("SELECT COALESCE(MAX(id), 0) FROM operation_events")).scalar()
+
+
+def touched_portfolios(db, after: int, until: int) -> Optional[Set[Optional[int]]]:
+    """
+    Portafogli delle righe (prima e dopo la modifica) scritte dagli eventi in (after, until];
+    None se tra questi c'è un import, che può aver toccato tutti i portafogli.
+    """
+    rows = db.execute(
+        text(
+            "SELECT DISTINCT kind = :import, json_extract(old_row, '$.portfolio_id'), "
+            "json_extract(new_row, '$.portfolio_id') FROM operation_events WHERE id > :a AND id <= :u"
+        ),
+        {"a": after, "u": until, "import": IMPORT_KIND},
+    ).all()
+    if any(imported for imported, _, _ in rows):
+        return None
+    return {pid for _, old, new in rows for pid in (old, new)}
+
+
+def event_id_at(db, at: datetime) -> int:
+    """Ultimo evento registrato entro l'istante at (UTC se senza fuso)."""
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    stamp = at.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    return db.execute(
+        text("SELECT COALESCE(MAX(id), 0) FROM operation_events WHERE recorded_at <= :t"), {"t": stamp}
+    ).scalar()
+
+
+def state_at(db, event_id: Optional[int] = None) -> dict:
+    """
+    Stato dopo l'evento event_id (default: l'ultimo): snapshot più vicino + eventi successivi.
+    Ritorna state, l'evento raggiunto, quello dello snapshot e il numero di eventi rigiocati.
+    """
+    target = latest_event_id(db) if event_id is None else event_id
+    snap = db.execute(
+        text("SELECT event_id, state FROM ledger_snapshots WHERE event_id <= :e ORDER BY event_id DESC, id DESC LIMIT 1"),
+        {"e": target},
+    ).first()
+    if snap is None:
+        raise ValueError(f"Nessuno snapshot del ledger fino all'evento {target}")
+    state = LedgerState.from_json(snap.state)
+    rows = db.execute(
+        text("SELECT old_row, new_row FROM operation_events WHERE id > :s AND id <= :e ORDER BY id"),
+        {"s": snap.event_id, "e": target},
+    )
+    replayed = 0
+    for old_row, new_row in rows:
+        state.apply(json.loads(old_row) if old_row else None, -1.0)
+        state.apply(json.loads(new_row) if new_row else None, +1.0)
+        replayed += 1
+    return {"state": state, "event_id": target, "snapshot_event_id": snap.event_id, "replayed_events": replayed}
+
+
+@contextmanager
+def suspended_triggers(db) -> Iterator[None]:
+    """
+    Scritture su operations senza eventi (import in blocco). I trigger vengono tolti e
+    ricreati nella stessa transazione: gli altri processi non vedono mai il log senza
+    trigger. Da chiudere con record_import prima del commit.
+    """
+    for kind in ("insert", "update", "delete"):
+        db.execute(text(f"DROP TRIGGER IF EXISTS trg_operations_log_{kind}"))
+    try:
+        yield
+    finally:
+        for ddl in TRIGGERS:
+            db.execute(text(ddl))
+
+
+def record_import(db) -> int:
+    """
+    Un evento "import" senza immagini e uno snapshot calcolato da operations, dopo
+    scritture fatte con suspended_triggers. Ritorna l'id dell'evento; il commit resta
+    a chi importa.
+    """
+    db.execute(
+        text("INSERT INTO operation_events (operation_id, kind, recorded_at) VALUES (NULL, :k, :t)"),
+        {"k": IMPORT_KIND, "t": _utc_now()},
+    )
+    event_id = latest_event_id(db)
+    store_snapshot(db, event_id, state_from_operations(db))
+    return event_id
+
+
+def take_snapshot(db) -> int:
+    """Compatta lo stato corrente in un nuovo snapshot; ritorna l'evento a cui si riferisce."""
+    current = state_at(db)
+    if current["replayed_events"]:
+        store_snapshot(db, current["event_id"], current["state"])
+        db.commit()
+    return current["event_id"]
+
+
+def maybe_snapshot(db, every: int = SNAPSHOT_EVERY) -> bool:
+    """Nuovo snapshot se dall'ultimo sono passati almeno every eventi (due letture sugli indici)."""
+    last_snapshot = db.execute(text("SELECT COALESCE(MAX(event_id), 0) FROM ledger_snapshots")).scalar()
+    if latest_event_id(db) - last_snapshot < every:
+        return False
+    take_snapshot(db)
+    return True
+
+
+def operation_events(db, operation_id: int) -> List[dict]:
+    """Storia di un'operazione (creazione, modifiche, cancellazione) in ordine."""
+    rows = db.execute(
+        text("SELECT id, kind, recorded_at, old_row, new_row FROM operation_events WHERE operation_id = :o ORDER BY id"),
+        {"o": operation_id},
+    ).mappings()
+    return [
+        {
+            "event_id": r["id"],
+            "kind": r["kind"],
+            "recorded_at": r["recorded_at"],
+            "before": json.loads(r["old_row"]) if r["old_row"] else None,
+            "after": json.loads(r["new_row"]) if r["new_row"] else None,
+        }
+        for r in rows
+    ]
@@ -0,0 +1,102 @@
+# backend/fast_json.py
+"""
+Percorso veloce per gli endpoint lista: query a tuple di colonne serializzate
+direttamente in JSON (orjson se installato, altrimenti json della stdlib),
+senza idratare oggetti ORM né validare ogni riga con Pydantic.
+
+La corrispondenza tra response model e colonne viene verificata una volta
+sola, quando si costruisce la select (all'import dei moduli).
+"""
+import json
+import typing
+from typing import Any, List, Optional, Sequence, Type
+
+from pydantic import BaseModel
+from sqlalchemy import Date, Float, String, case, cast, func, select, type_coerce
+from sqlalchemy.sql import Select
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # dipendenza opzionale
+    orjson = None
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def _is_optional(annotation) -> bool:
+    return type(None) in typing.get_args(annotation)
+
+
+def _is_float(annotation) -> bool:
+    return annotation is float or float in typing.get_args(annotation)
+
+
+def normalize_numeric(column):
+    """
+    Stesso comportamento di OperationOut._normalize_numeric, ma in SQL:
+    stringhe vuote / "nan" -> NULL, stringhe numeriche -> REAL, con la virgola
+    decimale come in event_log._num_sql ("1,5" -> 1.5). Il testo non numerico
+    ("abc") resta testo: un CAST lo renderebbe 0.0, rows_response lo rifiuta.
+    """
+    text_value = func.lower(func.trim(column))
+    number = func.replace(func.trim(column), ",", ".")
+    return case(
+        (func.typeof(column) != "text", column),
+        (text_value.in_(["", "nan"]), None),
+        (number.op("GLOB")("*[0-9]*") & ~number.op("GLOB")("*[^0-9.eE+-]*"), cast(number, Float)),
+        else_=column,
+    )
+
+
+def build_select(model: Type[BaseModel], orm_cls) -> Select:
+    """
+    Select delle colonne di `orm_cls` che corrispondono ai campi di `model`,
+    nello stesso ordine. Solleva TypeError se il model non è servibile così:
+    campo senza colonna, oppure campo obbligatorio non-nullable su colonna nullable.
+    """
+    columns = []
+    table = orm_cls.__table__
+    for name, field in model.model_fields.items():
+        if name not in table.c:
+            raise TypeError(f"{model.__name__}.{name}: no column on {orm_cls.__name__}")
+        column = getattr(orm_cls, name)
+        table_column = table.c[name]
+
+        expr = column
+        if _is_float(field.annotation):
+            expr = normalize_numeric(column)
+        elif isinstance(table_column.type, Date):
+            # in SQLite le date sono già testo ISO: niente parsing in date Python per riga
+            expr = type_coerce(column, String)
+        if table_column.nullable and not table_column.primary_key and not _is_optional(field.annotation):
+            if field.is_required():
+                raise TypeError(f"{model.__name__}.{name} is required but column {table}.{name} is nullable")
+            expr = func.coalesce(expr, field.default)
+        columns.append(expr.label(name) if expr is not column else column)
+    return select(*columns)
+
+
+def rows_response(rows: Sequence, model: Optional[Type[BaseModel]] = None) -> FastJSONResponse:
+    """
+    Serializza le Row di una select costruita con build_select come lista di oggetti.
+    Con il model dato, un campo float rimasto testo (non numerico) solleva ValueError
+    come farebbe la validazione della risposta sul percorso ORM.
+    """
+    if not rows:
+        return FastJSONResponse([])
+    keys: List[str] = list(rows[0]._fields)
+    if model is not None:
+        floats = [i for i, key in enumerate(keys) if key in model.model_fields and _is_float(model.model_fields[key].annotation)]
+        for row in rows:
+            for i in floats:
+                if isinstance(row[i], str):
+                    raise ValueError(f"{model.__name__}.{keys[i]}: not a number: {row[i]!r}")
+    return FastJSONResponse([dict(zip(keys, row)) for row in rows])
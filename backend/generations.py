@@ -0,0 +1,54 @@
+# backend/generations.py
+"""
+Generazioni condivise tra processi delle tabelle copiate nelle cache in memoria.
+
+Le cache di processo (ledger_cache) sono invalidate subito dalle scritture dello
+stesso processo, ma non vedono quelle di un altro worker uvicorn, degli script di
+import o di SQL manuale. Per queste si usa un valore che cresce a ogni scrittura ed è
+mantenuto dai trigger SQLite, quindi uguale per tutti i processi:
+  - operations: l'ultimo id di operation_events (trigger di event_log);
+  - asset_info: il contatore in cache_generations incrementato da TRIGGERS,
+    installati dalla migrazione 8.
+
+Una cache confronta la generazione letta con quella da cui è stata costruita e si
+ricarica se diversa. La lettura è una query sugli indici, fatta una volta per
+sessione: il valore resta in db.info fino al commit o rollback successivo.
+"""
+from typing import Dict
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+_INFO_KEY = "shared_generations"
+_QUERY = text(
+    "SELECT (SELECT COALESCE(MAX(id), 0) FROM operation_events), "
+    "(SELECT COALESCE(MAX(value), 0) FROM cache_generations WHERE name = 'asset_info')"
+)
+
+# tabelle con un contatore in cache_generations (operations usa già operation_events)
+COUNTED_TABLES = ("asset_info",)
+
+
+def _bump(table: str, kind: str) -> str:
+    return f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_generation_{kind.lower()} AFTER {kind} ON {table} BEGIN
+        UPDATE cache_generations SET value = value + 1 WHERE name = '{table}';
+    END"""
+
+
+TRIGGERS = [_bump(table, kind) for table in COUNTED_TABLES for kind in ("INSERT", "UPDATE", "DELETE")]
+
+
+def current(db: Session) -> Dict[str, int]:
+    """Generazioni condivise {tabella: valore}, lette al più una volta per sessione."""
+    values = db.info.get(_INFO_KEY)
+    if values is None:
+        row = db.execute(_QUERY).one()
+        values = {"operations": row[0], "asset_info": row[1]}
+        db.info[_INFO_KEY] = values
+    return values
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _forget(session: Session) -> None:
+    session.info.pop(_INFO_KEY, None)
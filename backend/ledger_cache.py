@@ -0,0 +1,246 @@
+# backend/ledger_cache.py
+"""
+Copia in memoria, a colonne (array NumPy), delle operazioni contabilizzate.
+
+Simboli, wallet, tipi operazione e valute sono internati in codici interi; il ledger
+viene caricato una volta per portafoglio con una sola query e invalidato dalle
+funzioni di scrittura in crud.py (create/update/duplicate/delete operation). Le
+scritture di altri processi (altri worker, script di import, SQL manuale) sono viste
+tramite la generazione condivisa di operations (generations.py), confrontata a ogni
+get_ledger.
+"""
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import Session
+
+from . import event_log, generations
+from .models import Operation
+
+EPOCH = np.datetime64("1970-01-01", "D")
+NO_DAY = np.iinfo(np.int32).min
+
+
+def _intern(values) -> tuple:
+    """Ritorna (valori distinti ordinati, codici int32, {valore: codice})."""
+    uniques, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+    labels = uniques.tolist()
+    return labels, codes.astype(np.int32), {v: i for i, v in enumerate(labels)}
+
+
+def _floats(values) -> np.ndarray:
+    try:
+        return np.array(values, dtype=float)
+    except (ValueError, TypeError):
+        out = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            try:
+                out[i] = float(str(v).replace(",", "."))
+            except (ValueError, TypeError):
+                pass
+        return out
+
+
+def day_ordinal(column):
+    """Espressione SQL: giorni dall'epoch della data (julianday del 1970-01-01 = 2440587.5), NO_DAY se mancante."""
+    return func.coalesce(cast(func.julianday(column) - 2440587.5, Integer), NO_DAY)
+
+
+class Ledger:
+    """
+    Operazioni contabilizzate come array paralleli. I simboli sono in maiuscolo,
+    il wallet assente è 0, le valute di acquisto sono normalizzate (upper/trim).
+    """
+
+    def __init__(self, rows: List[tuple]):
+        cols = list(zip(*rows)) if rows else [()] * 11
+        self.op_id = np.array(cols[0], dtype=np.int64)
+        self.day = np.array(cols[1], dtype=np.int32)
+        self.symbols, self.symbol, self.symbol_codes = _intern(cols[2])
+        wallet_ids = np.array(cols[3], dtype=np.int64)
+        self.wallets, wallet_codes = np.unique(wallet_ids, return_inverse=True)
+        self.wallet = wallet_codes.astype(np.int32)
+        self.wallet_codes = {int(w): i for i, w in enumerate(self.wallets)}
+        self.types, self.type, self.type_codes = _intern(cols[4])
+        self.quantity = _floats(cols[5])
+        self.price = _floats(cols[6])
+        self.price_manual = _floats(cols[7])
+        self.exchange_rate = _floats(cols[8])
+        self.currencies, self.currency, self.currency_codes = _intern(cols[9])
+        self.income = _floats(cols[10])
+
+        qty = np.nan_to_num(self.quantity)
+        n_sym, n_wal = len(self.symbols), len(self.wallets)
+        self._qty_by_symbol = np.bincount(self.symbol, weights=qty, minlength=n_sym)
+        self._qty_by_symbol_wallet = np.bincount(
+            self.symbol.astype(np.int64) * max(n_wal, 1) + self.wallet, weights=qty, minlength=n_sym * n_wal
+        ).reshape(n_sym, n_wal)
+
+    def __len__(self) -> int:
+        return len(self.op_id)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(v.nbytes for v in vars(self).values() if isinstance(v, np.ndarray))
+
+    def days_as_dates(self) -> np.ndarray:
+        """Date delle operazioni come datetime64[D] (NaT dove mancanti)."""
+        out = (EPOCH + self.day.astype("timedelta64[D]")).astype("datetime64[D]")
+        out[self.day == NO_DAY] = np.datetime64("NaT")
+        return out
+
+    def until_mask(self, until: date) -> np.ndarray:
+        """Operazioni con data valida fino a until incluso."""
+        day = (np.datetime64(until, "D") - EPOCH).astype(np.int64)
+        return (self.day != NO_DAY) & (self.day <= day)
+
+    def quantity_of(self, symbol: str, wallet_id: Optional[int] = None, until: Optional[date] = None) -> float:
+        code = self.symbol_codes.get((symbol or "").upper())
+        if code is None:
+            return 0.0
+        w = None
+        if wallet_id is not None:
+            w = self.wallet_codes.get(int(wallet_id))
+            if w is None:
+                return 0.0
+        if until is not None:
+            mask = (self.symbol == code) & self.until_mask(until)
+            if w is not None:
+                mask &= self.wallet == w
+            return float(np.nan_to_num(self.quantity[mask]).sum())
+        if w is None:
+            return float(self._qty_by_symbol[code])
+        return float(self._qty_by_symbol_wallet[code, w])
+
+    def type_mask(self, types: Iterable[str]) -> np.ndarray:
+        codes = [self.type_codes[t] for t in types if t in self.type_codes]
+        return np.isin(self.type, codes)
+
+    def positions(self, types: Optional[Iterable[str]] = None, until: Optional[date] = None) -> Dict[str, float]:
+        """Quantità totale per simbolo, opzionalmente solo per i tipi operazione dati e fino a until."""
+        if types is None:
+            mask = np.ones(len(self), dtype=bool)
+        else:
+            mask = self.type_mask(types)
+        if until is not None:
+            mask &= self.until_mask(until)
+        n_sym = len(self.symbols)
+        symbols = self.symbol[mask]
+        totals = np.bincount(symbols, weights=np.nan_to_num(self.quantity[mask]), minlength=n_sym)
+        present = np.flatnonzero(np.bincount(symbols, minlength=n_sym))
+        return {self.symbols[i]: float(totals[i]) for i in present}
+
+    def monthly_deltas(self, types: Optional[Iterable[str]] = None, until: Optional[date] = None) -> Dict[str, Dict[str, float]]:
+        """
+        Variazione di quantità per mese e simbolo: {"YYYY-MM": {symbol: qty}}.
+        Le operazioni senza data valida vengono ignorate.
+        """
+        mask = self.day != NO_DAY if until is None else self.until_mask(until)
+        if types is not None:
+            mask &= self.type_mask(types)
+        months = (EPOCH + self.day[mask].astype("timedelta64[D]")).astype("datetime64[M]")
+        month_labels, month_idx = np.unique(months, return_inverse=True)
+        n_sym = len(self.symbols)
+        key = month_idx.astype(np.int64) * n_sym + self.symbol[mask]
+        keys, inverse = np.unique(key, return_inverse=True)
+        sums = np.bincount(inverse, weights=np.nan_to_num(self.quantity[mask]), minlength=len(keys))
+
+        result: Dict[str, Dict[str, float]] = {}
+        labels = month_labels.astype(str)
+        for k, total in zip(keys.tolist(), sums.tolist()):
+            m, s = divmod(k, n_sym)
+            result.setdefault(labels[m], {})[self.symbols[s]] = total
+        return result
+
+
+_lock = threading.Lock()
+# una copia per portafoglio; la chiave None è la vista globale (tutti i portafogli)
+_ledgers: Dict[Optional[int], Ledger] = {}
+_generation = 0
+# generazione condivisa di operations da cui sono stati caricati i ledger in cache
+_shared: Optional[int] = None
+
+
+def _load(db: Session, portfolio_id: Optional[int] = None) -> Ledger:
+    stmt = (
+        select(
+            Operation.id,
+            day_ordinal(Operation.date),
+            func.upper(Operation.asset_symbol),
+            func.coalesce(Operation.wallet_id, 0),
+            func.coalesce(Operation.operation_type, ""),
+            func.coalesce(Operation.quantity, 0.0),
+            Operation.price,
+            Operation.price_manual,
+            Operation.exchange_rate,
+            func.coalesce(func.upper(func.trim(Operation.purchase_currency)), ""),
+            func.coalesce(Operation.dividend_value, Operation.total_value, 0.0),
+        )
+        .where(Operation.accounting == True)
+        .where(Operation.asset_symbol != None)
+        .order_by(Operation.id)
+    )
+    if portfolio_id is not None:
+        stmt = stmt.where(Operation.portfolio_id == portfolio_id)
+    return Ledger(db.execute(stmt).all())
+
+
+def _sync(db: Session) -> None:
+    """Svuota la cache se operations è stata modificata da un altro processo."""
+    global _shared, _generation
+    shared = generations.current(db)["operations"]
+    # la generazione cresce soltanto: una sessione con un valore più vecchio usa la cache più recente
+    if _shared is not None and shared <= _shared:
+        return
+    with _lock:
+        if _shared is None or shared > _shared:
+            _generation += 1
+            touched = None if _shared is None else event_log.touched_portfolios(db, _shared, shared)
+            if touched is None:
+                _ledgers.clear()
+            else:
+                # solo i portafogli toccati dagli eventi nuovi (e la vista globale)
+                for pid in touched | {None}:
+                    _ledgers.pop(pid, None)
+            _shared = shared
+
+
+def get_ledger(db: Session, portfolio_id: Optional[int] = None) -> Ledger:
+    """Ritorna il ledger in cache del portafoglio (None = tutti), caricandolo se assente o invalidato."""
+    _sync(db)
+    ledger = _ledgers.get(portfolio_id)
+    if ledger is not None:
+        return ledger
+    with _lock:
+        ledger = _ledgers.get(portfolio_id)
+        if ledger is not None:
+            return ledger
+        generation = _generation
+        ledger = _load(db, portfolio_id)
+        # se nel frattempo una scrittura ha invalidato, non pubblicare dati vecchi
+        if generation == _generation:
+            _ledgers[portfolio_id] = ledger
+        return ledger
+
+
+def generation(db: Session) -> int:
+    """Contatore delle invalidazioni: cambia a ogni scrittura su operations, anche di altri processi."""
+    _sync(db)
+    return _generation
+
+
+def invalidate(*portfolio_ids: Optional[int]) -> None:
+    """
+    Da chiamare dopo ogni commit che modifica la tabella operations.
+    Senza argomenti svuota tutto; altrimenti solo i portafogli indicati e la vista globale.
+    """
+    global _generation
+    _generation += 1
+    if not portfolio_ids:
+        _ledgers.clear()
+        return
+    for pid in set(portfolio_ids) | {None}:
+        _ledgers.pop(pid, None)
@@ -0,0 +1,96 @@
+# backend/ledger_export.py
+"""
+Export in streaming del ledger operations (NDJSON o CSV), a blocchi di dimensione
+fissa letti dal cursore, con compressione gzip al volo.
+La memoria resta costante indipendentemente dalla lunghezza dello storico.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date
+from typing import Iterator, Optional
+
+from .crud import OPERATIONS_FAST_SELECT
+from .database import SessionLocal
+from .models import Operation
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_BATCH_SIZE = 1000
+
+
+def iter_operation_batches(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    wallet_id: Optional[int] = None,
+    portfolio_id: Optional[int] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[list]:
+    """
+    Righe di operations (stesse colonne di /operations/) a blocchi di batch_size.
+    Usa una sessione propria: il generatore vive oltre la dipendenza get_db.
+    """
+    stmt = OPERATIONS_FAST_SELECT
+    if start:
+        stmt = stmt.where(Operation.date >= start)
+    if end:
+        stmt = stmt.where(Operation.date <= end)
+    if wallet_id is not None:
+        stmt = stmt.where(Operation.wallet_id == wallet_id)
+    if portfolio_id is not None:
+        stmt = stmt.where(Operation.portfolio_id == portfolio_id)
+    stmt = stmt.order_by(Operation.id).execution_options(stream_results=True, yield_per=batch_size)
+
+    db = SessionLocal()
+    try:
+        for batch in db.execute(stmt).partitions(batch_size):
+            yield batch
+    finally:
+        db.close()
+
+
+def _ndjson(batches: Iterator[list]) -> Iterator[bytes]:
+    keys = None
+    for batch in batches:
+        if keys is None:
+            keys = list(batch[0]._fields)
+        lines = [json.dumps(dict(zip(keys, row)), ensure_ascii=False, default=str) for row in batch]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _csv(batches: Iterator[list]) -> Iterator[bytes]:
+    header = list(OPERATIONS_FAST_SELECT.selected_columns.keys())
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    yield buf.getvalue().encode("utf-8")
+    for batch in batches:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # formato gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_operations(
+    fmt: str = "ndjson",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    wallet_id: Optional[int] = None,
+    compress: bool = True,
+    portfolio_id: Optional[int] = None,
+) -> Iterator[bytes]:
+    """Generatore di byte pronto per una StreamingResponse."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    batches = iter_operation_batches(start, end, wallet_id, portfolio_id)
+    chunks = _ndjson(batches) if fmt == "ndjson" else _csv(batches)
+    return _gzip(chunks) if compress else chunks
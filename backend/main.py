@@ -1,18 +1,24 @@
-from fastapi import FastAPI, Depends, Query, HTTPException, Response
+from fastapi import FastAPI, Depends, Query, HTTPException, Request, Response
 from sqlalchemy.orm import Session
-from backend import models, schemas, crud
+from backend import models, schemas, crud, performance, price_store, price_stream, ledger_export, projection, alerts, sql_budget, batch, reprice, event_log, aio, asset_search
+from backend.pricing import PriceSnapshot
+from backend.fast_json import FastJSONResponse, rows_response
 from backend.database import SessionLocal, engine, get_db
+from backend.migrations import migrate
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from .services import get_current_price
 from .services import get_exchange_rate
 from .services import get_conversion_rate
 from backend.schemas import OperationIn, OperationOut
 from fastapi.middleware.cors import CORSMiddleware
+from datetime import date, datetime
+from typing import Optional
 import logging
 
 logger = logging.getLogger("uvicorn.error")
-models.Base.metadata.create_all(bind=engine)
+migrate(engine)
 
 app = FastAPI()
 
@@ -28,50 +34,66 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"],
 )
+# conteggio query per richiesta e budget per endpoint (solo con BUGETTO_SQL_TRACE=1)
+sql_budget.install(app, engine)
 
-@app.get("/operations/", response_model=list[schemas.OperationOut])
-def read_operations(db: Session = Depends(get_db)):
-    return crud.get_operations(db)
+# Portafogli (partizionamento dei dati: operations e wallets hanno portfolio_id)
+@app.get("/portfolios", response_model=list[schemas.PortfolioOut])
+def portfolios_list(db: Session = Depends(get_db)):
+    return crud.list_portfolios(db)
 
-@app.get("/wallets/", response_model=list[schemas.WalletOut])
-def read_wallets(db: Session = Depends(get_db)):
-    return crud.get_wallets(db)
+@app.post("/portfolios", response_model=schemas.PortfolioOut)
+def portfolios_create(payload: schemas.PortfolioCreate, db: Session = Depends(get_db)):
+    return crud.create_portfolio(db, payload)
 
-@app.get("/assets/", response_model=list[schemas.AssetOut])
+# Liste grandi: percorso veloce (tuple di colonne -> JSON, niente validazione per riga)
+@app.get("/operations/", response_model=list[schemas.OperationOut], response_class=FastJSONResponse)
+def read_operations(portfolio_id: Optional[int] = None, db: Session = Depends(get_db)):
+    return rows_response(crud.get_operations_rows(db, portfolio_id=portfolio_id), schemas.OperationOut)
+
+@app.get("/wallets/", response_model=list[schemas.WalletOut], response_class=FastJSONResponse)
+def read_wallets(portfolio_id: Optional[int] = None, db: Session = Depends(get_db)):
+    return rows_response(crud.get_wallets_rows(db, portfolio_id))
+
+@app.get("/assets/", response_model=list[schemas.AssetOut], response_class=FastJSONResponse)
 def read_assets(db: Session = Depends(get_db)):
-    return crud.get_assets(db)
+    return rows_response(crud.get_assets_rows(db))
 
+# Le route di valorizzazione sono async: prezzi e cambi letti in parallelo, calcolo in un
+# pool dedicato (backend/aio.py), senza occupare i thread delle route sincrone
 @app.get("/dashboard/summary", response_model=schemas.DashboardSummary)
-def read_dashboard_summary(db: Session = Depends(get_db)):
-    return crud.get_dashboard_summary(db)
+async def read_dashboard_summary(portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    return await aio.valuation(
+        crud.get_dashboard_summary, portfolio_id, as_of, as_of=as_of, portfolio_id=portfolio_id, needs=aio.liquidity_needs
+    )
 
 @app.get("/dashboard/allocation/assets")
-def dashboard_allocation_assets(db: Session = Depends(get_db)):
-    return crud.get_allocation_by_asset(db)
+async def dashboard_allocation_assets(portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    # solo SQL sui totali salvati: nessun dato di mercato
+    return await aio.valuation(crud.get_allocation_by_asset, portfolio_id, as_of, as_of=as_of, symbols=[])
 
 @app.get("/dashboard/allocation/categories")
-def dashboard_allocation_categories(db: Session = Depends(get_db)):
-    return crud.get_allocation_by_category(db)
+async def dashboard_allocation_categories(portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    return await aio.valuation(crud.get_allocation_by_category, portfolio_id, as_of, as_of=as_of, symbols=[])
 
 @app.get("/assets/{symbol}/average-price")
-def get_asset_average_price(symbol: str, db: Session = Depends(get_db)):
+def get_asset_average_price(symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None, db: Session = Depends(get_db)):
     return {
         "symbol": symbol,
-        "average_purchase_rate": crud.get_average_purchase_rate(db, symbol)
+        "average_purchase_rate": crud.get_average_purchase_rate(db, symbol, portfolio_id, as_of)
     }
 
 @app.get("/assets/{symbol}/wallet/{wallet_id}/quantity")
-def get_asset_quantity(symbol: str, wallet_id: int, db: Session = Depends(get_db)):
-    quantity = crud.get_asset_quantity_by_wallet(db, symbol.lower(), wallet_id)
+def get_asset_quantity(
+    symbol: str, wallet_id: int, portfolio_id: Optional[int] = None, as_of: Optional[date] = None, db: Session = Depends(get_db)
+):
+    quantity = crud.get_asset_quantity_by_wallet(db, symbol.lower(), wallet_id, portfolio_id, as_of)
     return {"symbol": symbol, "wallet_id": wallet_id, "quantity": quantity}
 
-@app.get("/assets/{symbol}/delta")
-def asset_delta(symbol: str, db: Session = Depends(get_db)):
-    symbol_lower = symbol.lower()
-
-    avg_price = crud.get_average_purchase_rate(db, symbol)
-    quantity = crud.get_asset_quantity(db, symbol.lower())  # oppure una funzione totale
-    current_price = get_current_price(symbol)  # integra yfinance
+def _asset_delta(db: Session, symbol: str, portfolio_id: Optional[int], as_of: Optional[date]):
+    avg_price = crud.get_average_purchase_rate(db, symbol, portfolio_id, as_of)
+    quantity = crud.get_asset_quantity(db, symbol.lower(), portfolio_id, as_of)  # oppure una funzione totale
+    current_price = PriceSnapshot(db, as_of).price(symbol)  # yfinance, o storico locale con as_of
 
     delta_value = (current_price - avg_price) * quantity
     delta_pct = ((current_price - avg_price) / avg_price) * 100 if avg_price != 0 else 0
@@ -85,39 +107,85 @@ def asset_delta(symbol: str, db: Session = Depends(get_db)):
         "delta_percentage": round(delta_pct, 2)
     }
 
+@app.get("/assets/{symbol}/delta")
+async def asset_delta(symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    return await aio.valuation(_asset_delta, symbol, portfolio_id, as_of, as_of=as_of, symbols=[symbol])
+
 @app.get("/assets/{symbol}/current-price")
-def get_asset_current_price(symbol: str):
-    current_price = get_current_price(symbol)
+async def get_asset_current_price(symbol: str, as_of: Optional[date] = None):
+    current_price = await aio.valuation(lambda db: PriceSnapshot(db, as_of).price(symbol), as_of=as_of, symbols=[symbol])
     return {
         "symbol": symbol,
         "current_price": round(current_price, 4)
     }
 
 @app.get("/assets/{symbol}/total-quantity")
-def dashboard_allocation_categories(symbol: str, db: Session = Depends(get_db)):
-    return crud.get_asset_quantity(db, symbol)
+def dashboard_allocation_categories(symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None, db: Session = Depends(get_db)):
+    return crud.get_asset_quantity(db, symbol, portfolio_id, as_of)
 
 
 @app.get("/assets/{symbol}/dividends")
-def read_total_dividends(symbol: str, db: Session = Depends(get_db)):
-    return crud.get_total_dividends_by_asset(db, symbol)
+def read_total_dividends(symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None, db: Session = Depends(get_db)):
+    return crud.get_total_dividends_by_asset(db, symbol, portfolio_id, as_of)
 
 @app.get("/convert")
-def convert_currency(
+async def convert_currency(
     from_currency: str = Query(..., alias="from"),
-    to_currency: str = Query(..., alias="to")
+    to_currency: str = Query(..., alias="to"),
+    as_of: Optional[date] = None,
 ):
-    return get_conversion_rate(from_currency, to_currency)
+    # cambio corrente, o storico locale con as_of (condiviso tra le sotto-richieste di /batch)
+    pairs = [(from_currency, to_currency)] if from_currency.upper() != to_currency.upper() else []
+    return await aio.valuation(
+        lambda db: PriceSnapshot(db, as_of).rate(from_currency, to_currency), as_of=as_of, symbols=[], pairs=pairs
+    )
 
     
 
 @app.get("/dashboard/allocation/categories-group", response_model=list[dict])
-def get_category_allocation(db: Session = Depends(get_db)):
-    return crud.get_allocation_by_category_group(db)
+async def get_category_allocation(portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    return await aio.valuation(
+        crud.get_allocation_by_category_group, portfolio_id, as_of, as_of=as_of, portfolio_id=portfolio_id,
+        needs=aio.category_needs,
+    )
 
 @app.get("/dashboard/allocation/categories-history")
-def get_historical_category_allocation(db: Session = Depends(get_db)):
-    return crud.get_historical_allocation_by_category(db)
+async def get_historical_category_allocation(portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    return await aio.valuation(
+        crud.get_historical_allocation_by_category, portfolio_id, as_of, as_of=as_of, portfolio_id=portfolio_id,
+        needs=aio.category_history_needs,
+    )
+
+# Export in streaming del ledger (NDJSON/CSV, gzip al volo)
+@app.get("/operations/export")
+def export_operations(
+    fmt: str = Query("ndjson", alias="format"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    wallet_id: Optional[int] = None,
+    compress: bool = True,
+    portfolio_id: Optional[int] = None,
+):
+    if fmt not in ledger_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(ledger_export.EXPORT_FORMATS)}")
+    chunks = ledger_export.stream_operations(
+        fmt,
+        start,
+        end,
+        wallet_id,
+        compress,
+        portfolio_id,
+    )
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    filename = f"operations.{fmt}"
+    if compress:
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 @app.post("/operations/", response_model=schemas.OperationOut)
 def create_operation_endpoint(payload: OperationIn, db: Session = Depends(get_db)):
@@ -153,18 +221,18 @@ def preview_operation_endpoint(payload: schemas.OperationIn, db: Session = Depen
 
 # Wallets
 @app.get("/wallets", response_model=list[schemas.WalletOut])
-def wallets_list(db: Session = Depends(get_db)):
-    return crud.list_wallets(db)
+def wallets_list(portfolio_id: Optional[int] = None, db: Session = Depends(get_db)):
+    return crud.list_wallets(db, portfolio_id)
 
 @app.post("/wallets", response_model=schemas.WalletOut)
 def wallets_create(payload: schemas.WalletCreate, db: Session = Depends(get_db)):
-    w = crud.create_wallet(db, payload.name)
+    w = crud.create_wallet(db, payload.name, payload.portfolio_id)
     return w
 
 # Last purchase meta for an asset
 @app.get("/assets/{symbol}/last-purchase-meta")
-def last_purchase_meta(symbol: str, db: Session = Depends(get_db)):
-    meta = crud.get_last_purchase_meta(db, symbol)
+def last_purchase_meta(symbol: str, portfolio_id: Optional[int] = None, db: Session = Depends(get_db)):
+    meta = crud.get_last_purchase_meta(db, symbol, portfolio_id)
     return meta or {}
 
 
@@ -178,17 +246,57 @@ def assets_visible(db: Session = Depends(get_db)):
 def assets_create(payload: schemas.AssetCreate, db: Session = Depends(get_db)):
     return crud.create_asset(db, payload.dict())
 
-# auto-compila da symbol
+# ricerca per simbolo, nome e ISIN (prefisso e approssimata), paginata
+@app.get("/assets/search", response_model=schemas.AssetSearchResponse)
+def assets_search(
+    q: str = "",
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    visible: Optional[bool] = None,
+    db: Session = Depends(get_db),
+):
+    return asset_search.search(db, q, limit, offset, visible)
+
+# auto-compila da symbol (registro, poi cache persistente, poi Yahoo)
 @app.get("/assets/guess", response_model=schemas.AssetGuessOut)
 def assets_guess(symbol: str, db: Session = Depends(get_db)):
-    from .services import guess_asset_metadata
-    data = guess_asset_metadata(symbol)
-    return schemas.AssetGuessOut(**data)
+    return schemas.AssetGuessOut(**asset_search.guess(db, symbol))
 
 """ @app.get("/operations/")
 def read_operations(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return crud.get_operations(db, skip=skip, limit=limit) """
 
+# Storia di un'operazione dal log append-only (creazione, modifiche, cancellazione)
+@app.get("/operations/{op_id}/events", response_model=list[schemas.OperationEventOut])
+def operation_events(op_id: int, db: Session = Depends(get_db)):
+    return event_log.operation_events(db, op_id)
+
+# Posizioni e costo di carico ricostruiti da snapshot + eventi (correnti, dopo un evento o a un istante)
+@app.get("/ledger/state", response_model=schemas.LedgerStateOut)
+def ledger_state(
+    portfolio_id: Optional[int] = None,
+    event_id: Optional[int] = None,
+    at: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+):
+    if at is not None:
+        event_id = event_log.event_id_at(db, at) if event_id is None else min(event_id, event_log.event_id_at(db, at))
+    try:
+        result = event_log.state_at(db, event_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    state = result.pop("state")
+    return {**result, "holdings": state.holdings_rows(portfolio_id), "cost_basis": state.cost_rows(portfolio_id)}
+
+@app.post("/ledger/snapshots")
+def ledger_snapshot(db: Session = Depends(get_db)):
+    return {"event_id": event_log.take_snapshot(db)}
+
+# Ricalcolo di prezzo, cambio e totale dallo storico, per alcune operazioni o per tutto il ledger
+@app.post("/operations/reprice", response_model=schemas.RepriceResult)
+def reprice_operations(payload: schemas.RepriceRequest, db: Session = Depends(get_db)):
+    return reprice.reprice_operations(db, payload.ids, payload.portfolio_id, payload.fetch_missing)
+
 @app.put("/operations/{op_id}")
 def update_operation(op_id: int, operation: schemas.OperationIn, db: Session = Depends(get_db)):
     return crud.update_operation(db, op_id, operation)
@@ -217,16 +325,34 @@ def delete_operation_endpoint(asset_id: int, db: Session = Depends(get_db)):
     return {"deleted": asset_id}
 
 @app.get("/wallets/summary", response_model=schemas.WalletSummaryResponse)
-def wallets_summary(db: Session = Depends(get_db)):
-    total, items = crud.get_wallets_summary(db)
+async def wallets_summary(portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    total, items = await aio.valuation(crud.get_wallets_summary, portfolio_id, as_of, as_of=as_of, portfolio_id=portfolio_id)
     return schemas.WalletSummaryResponse(
         total_portfolio_value=total,
         items=[schemas.WalletSummaryItem(**i) for i in items]
     )
 
+# Più richieste GET in una chiamata, con una sola sessione DB e gli stessi prezzi/cambi
+@app.post("/batch", response_model=schemas.BatchResponse)
+async def run_batch(payload: schemas.BatchRequest, request: Request, db: Session = Depends(get_db)):
+    try:
+        batch.validate(payload.requests)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": await batch.run(request.scope, db, payload.requests)}
+
+# breakdown per wallet di tutti gli asset detenuti (righe espanse di AssetTable in una richiesta)
+@app.get("/assets/by-wallet", response_model=list[schemas.AssetByWalletResponse])
+async def assets_by_wallet(portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    return await aio.valuation(
+        crud.get_assets_breakdown_by_wallet, portfolio_id, as_of, as_of=as_of, portfolio_id=portfolio_id
+    )
+
 @app.get("/assets/{symbol}/by-wallet", response_model=schemas.AssetByWalletResponse)
-def asset_by_wallet(symbol: str, db: Session = Depends(get_db)):
-    data = crud.get_asset_breakdown_by_wallet(db, symbol)
+async def asset_by_wallet(symbol: str, portfolio_id: Optional[int] = None, as_of: Optional[date] = None):
+    data = await aio.valuation(
+        crud.get_asset_breakdown_by_wallet, symbol, portfolio_id, as_of, as_of=as_of, symbols=[symbol]
+    )
     return schemas.AssetByWalletResponse(
         symbol=data["symbol"],
         price_used=data["price_used"],
@@ -234,3 +360,113 @@ def asset_by_wallet(symbol: str, db: Session = Depends(get_db)):
         total_value=data["total_value"],
         breakdown=[schemas.AssetWalletBreakdownItem(**x) for x in data["breakdown"]],
     )
+
+# Rendimenti del portafoglio (TWR / XIRR) su un intervallo di date
+@app.get("/performance", response_model=schemas.PerformanceResponse)
+async def read_performance(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = "total",
+    portfolio_id: Optional[int] = None,
+):
+    # prezzi e cambi dallo storico locale: nulla da leggere in anticipo
+    try:
+        return await aio.valuation(performance.get_performance, start, end, group_by, portfolio_id, symbols=[])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/performance/series")
+async def read_performance_series(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = "total",
+    portfolio_id: Optional[int] = None,
+):
+    # prezzi e cambi dallo storico locale: nulla da leggere in anticipo
+    try:
+        return await aio.valuation(performance.get_valuation_series, start, end, group_by, portfolio_id, symbols=[])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Aggiorna lo storico prezzi/cambi locale (scarica solo le chiusure mancanti)
+@app.post("/prices/sync")
+def sync_price_history(db: Session = Depends(get_db)):
+    base_currency = performance.get_base_currency(db)
+    inserted = price_store.sync_prices(db, base_currency=base_currency)
+    alerts.on_price_history(db, [s for s, n in inserted.items() if n])
+    return {"symbols": len(inserted), "inserted": sum(inserted.values())}
+
+# Stream live di prezzi e valori delle posizioni (Server-Sent Events), un solo ciclo per tutti i client
+@app.get("/stream/prices")
+async def stream_prices(request: Request, symbols: Optional[str] = None):
+    wanted = [s.strip() for s in (symbols or "").split(",") if s.strip()]
+    return StreamingResponse(
+        price_stream.stream(request, wanted),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Flussi di cassa (budget) e proiezione mensile con i versamenti PAC
+@app.get("/cashflow", response_model=list[schemas.CashflowOut])
+def cashflow_list(user: Optional[str] = None, db: Session = Depends(get_db)):
+    return crud.list_cashflows(db, user)
+
+@app.post("/cashflow", response_model=schemas.CashflowOut)
+def cashflow_create(payload: schemas.CashflowIn, db: Session = Depends(get_db)):
+    return crud.create_cashflow(db, payload)
+
+@app.delete("/cashflow/{cashflow_id}")
+def cashflow_delete(cashflow_id: int, db: Session = Depends(get_db)):
+    ok = crud.delete_cashflow(db, cashflow_id)
+    if not ok:
+        raise HTTPException(status_code=404, detail="Cashflow not found")
+    return {"deleted": cashflow_id}
+
+@app.get("/cashflow/projection")
+def cashflow_projection(
+    months: int = 360,
+    start: Optional[date] = None,
+    user: Optional[str] = None,
+    annual_return: float = 0.0,
+    initial_value: Optional[float] = None,
+    initial_cash: float = 0.0,
+    db: Session = Depends(get_db),
+):
+    try:
+        return projection.get_projection(db, months, start, user, annual_return, initial_value, initial_cash)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Alert: regole (soglie su valore posizione, drawdown, deriva di categoria) ed eventi scattati
+@app.get("/alerts", response_model=list[schemas.AlertEventOut])
+def alerts_list(only_open: bool = False, limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+    return crud.list_alert_events(db, only_open, limit)
+
+@app.post("/alerts/{event_id}/ack", response_model=schemas.AlertEventOut)
+def alerts_acknowledge(event_id: int, db: Session = Depends(get_db)):
+    event = crud.acknowledge_alert(db, event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return event
+
+@app.post("/alerts/evaluate", response_model=list[schemas.AlertEventOut])
+def alerts_evaluate(db: Session = Depends(get_db)):
+    return alerts.evaluate_all(db)
+
+@app.get("/alerts/rules", response_model=list[schemas.AlertRuleOut])
+def alert_rules_list(portfolio_id: Optional[int] = None, db: Session = Depends(get_db)):
+    return crud.list_alert_rules(db, portfolio_id)
+
+@app.post("/alerts/rules", response_model=schemas.AlertRuleOut)
+def alert_rules_create(payload: schemas.AlertRuleIn, db: Session = Depends(get_db)):
+    try:
+        return crud.create_alert_rule(db, payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/alerts/rules/{rule_id}")
+def alert_rules_delete(rule_id: int, db: Session = Depends(get_db)):
+    ok = crud.delete_alert_rule(db, rule_id)
+    if not ok:
+        raise HTTPException(status_code=404, detail="Alert rule not found")
+    return {"deleted": rule_id}
@@ -0,0 +1,154 @@
+# backend/market_cache.py
+"""
+Cache di prezzi e cambi condivisa tra i processi worker sullo stesso host.
+
+I valori stanno in un piccolo database SQLite separato (CACHE_PATH, modalità WAL)
+con l'istante di lettura e la scadenza: il primo worker che legge un prezzo lo
+scrive con un upsert atomico e gli altri lo trovano senza chiamare Yahoo o
+Frankfurter finché non scade. Se più worker cercano insieme un valore mancante,
+solo chi ottiene il lease della chiave lo legge dal servizio; gli altri attendono
+il risultato (al massimo LEASE_SECONDS). Ogni processo tiene anche una copia
+locale con la stessa scadenza, per non interrogare SQLite a ogni chiamata.
+
+Se il file di cache non è utilizzabile (bloccato, sola lettura) si va diretti al
+servizio di mercato: la cache non deve mai far fallire una richiesta.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = "./market_cache.db"
+BUSY_TIMEOUT_SECONDS = 5.0
+LEASE_SECONDS = 10.0
+POLL_SECONDS = 0.05
+
+_local = threading.local()
+# key -> (valore, scadenza epoch)
+_memory: Dict[str, Tuple[float, float]] = {}
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS quotes (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL,
+        fetched_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS leases (
+        key TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        until REAL NOT NULL
+    );
+"""
+
+
+def _connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != CACHE_PATH:
+        conn = sqlite3.connect(CACHE_PATH, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn, _local.path = conn, CACHE_PATH
+    return conn
+
+
+def read(key: str) -> Optional[float]:
+    """Valore non scaduto per key (prima la copia locale, poi il file condiviso)."""
+    now = time.time()
+    hit = _memory.get(key)
+    if hit is not None and hit[1] > now:
+        return hit[0]
+    try:
+        row = _connection().execute(
+            "SELECT value, expires_at FROM quotes WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.debug("market cache non disponibile in lettura: %s", e)
+        return None
+    if row is None:
+        return None
+    _memory[key] = (row[0], row[1])
+    return row[0]
+
+
+def write(key: str, value: float, ttl: float) -> None:
+    now = time.time()
+    _memory[key] = (value, now + ttl)
+    try:
+        _connection().execute(
+            "INSERT INTO quotes (key, value, fetched_at, expires_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, "
+            "fetched_at = excluded.fetched_at, expires_at = excluded.expires_at",
+            (key, value, now, now + ttl),
+        )
+    except sqlite3.Error as e:
+        logger.debug("market cache non disponibile in scrittura: %s", e)
+
+
+def _holder() -> str:
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def _acquire(key: str) -> bool:
+    """Prende il lease della chiave se libero o scaduto (upsert condizionale, atomico)."""
+    now = time.time()
+    try:
+        cur = _connection().execute(
+            "INSERT INTO leases (key, holder, until) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET holder = excluded.holder, until = excluded.until "
+            "WHERE leases.until < ?",
+            (key, _holder(), now + LEASE_SECONDS, now),
+        )
+    except sqlite3.Error as e:
+        logger.debug("market cache non disponibile per il lease: %s", e)
+        return True
+    return cur.rowcount == 1
+
+
+def _release(key: str) -> None:
+    try:
+        _connection().execute("DELETE FROM leases WHERE key = ? AND holder = ?", (key, _holder()))
+    except sqlite3.Error as e:
+        logger.debug("market cache non disponibile per il lease: %s", e)
+
+
+def cached(key: str, ttl: float, fetch: Callable[[], float]) -> float:
+    """
+    Ritorna il valore in cache o lo legge con fetch() e lo salva per ttl secondi.
+    I valori nulli o non positivi (servizio non raggiungibile) non vengono salvati.
+    """
+    value = read(key)
+    if value is not None:
+        return value
+
+    deadline = time.time() + LEASE_SECONDS
+    while not _acquire(key):
+        # un altro worker sta leggendo lo stesso valore: attende il suo risultato
+        time.sleep(POLL_SECONDS)
+        value = read(key)
+        if value is not None:
+            return value
+        if time.time() > deadline:
+            break
+
+    try:
+        value = fetch()
+        if value and value > 0:
+            write(key, float(value), ttl)
+        return value
+    finally:
+        _release(key)
+
+
+def clear() -> None:
+    """Svuota la cache (locale e condivisa)."""
+    _memory.clear()
+    try:
+        _connection().execute("DELETE FROM quotes")
+    except sqlite3.Error as e:
+        logger.debug("market cache non disponibile: %s", e)
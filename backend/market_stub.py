@@ -0,0 +1,74 @@
+# backend/market_stub.py
+"""
+Dati di mercato sintetici per load test e benchmark, senza rete.
+
+Si attiva con la variabile d'ambiente BUGETTO_MARKET_STUB=1 (letta a ogni chiamata):
+services risponde con prezzi deterministici per simbolo e cambi fissi invece di
+interrogare Yahoo Finance e Frankfurter. BUGETTO_MARKET_STUB_LATENCY_MS aggiunge un
+ritardo a ogni chiamata per simulare il servizio remoto. I simboli che iniziano con
+DELISTED_PREFIX non hanno quotazione (prezzo 0, nessuno storico), come un titolo
+non più quotato: il chiamante deve ricadere sui prezzi delle operazioni.
+"""
+import os
+import time
+import zlib
+from datetime import date, timedelta
+
+# valore in EUR di un'unità di valuta
+FX_EUR = {"EUR": 1.0, "USD": 0.92, "GBP": 1.17, "CHF": 1.04, "JPY": 0.0062}
+DELISTED_PREFIX = "DEL"
+
+
+def enabled() -> bool:
+    return os.environ.get("BUGETTO_MARKET_STUB", "") not in ("", "0")
+
+
+def _wait() -> None:
+    latency_ms = float(os.environ.get("BUGETTO_MARKET_STUB_LATENCY_MS", "0") or 0)
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000.0)
+
+
+def _base_price(symbol: str) -> float:
+    return 10.0 + zlib.crc32(symbol.upper().encode()) % 49000 / 100.0
+
+
+def rate(from_currency: str, to_currency: str = "EUR") -> float:
+    _wait()
+    return FX_EUR.get(from_currency.upper(), 1.0) / FX_EUR.get(to_currency.upper(), 1.0)
+
+
+def price(symbol: str) -> float:
+    """Prezzo corrente; per le coppie "USDEUR=X" il cambio."""
+    symbol = symbol.upper()
+    if symbol.endswith("=X"):
+        return rate(symbol[:3], symbol[3:6])
+    _wait()
+    if symbol.startswith(DELISTED_PREFIX):
+        return 0.0
+    return _base_price(symbol)
+
+
+def day_prices(symbol: str):
+    close = price(symbol)
+    return (close, round(close * 1.01, 4), round(close * 0.99, 4))
+
+
+def history(symbol: str, start: str, end: str = None):
+    """Chiusure giornaliere [start, end) che crescono dello 0,02% al giorno fino al prezzo corrente."""
+    _wait()
+    first = date.fromisoformat(start[:10])
+    last = date.fromisoformat(end[:10]) if end else date.today()
+    days = (last - first).days
+    current = price(symbol)
+    if not current:
+        return []
+    return [
+        ((first + timedelta(days=i)).isoformat(), round(current / (1.0002 ** (days - i)), 6))
+        for i in range(max(days, 0))
+    ]
+
+
+def metadata(symbol: str) -> dict:
+    _wait()
+    return {"symbol": symbol.upper(), "name": f"Stub {symbol.upper()}", "currency": "EUR"}
@@ -0,0 +1,168 @@
+# backend/migrations.py
+"""
+Migrazioni dello schema SQLite, versionate con PRAGMA user_version.
+
+All'avvio migrate() legge la versione: se è già l'ultima non fa nient'altro (una
+sola PRAGMA). Su un database vuoto crea le tabelle dai modelli e imposta l'ultima
+versione; altrimenti applica in ordine le migrazioni mancanti.
+
+Le migrazioni devono essere idempotenti: i database creati prima del versionamento
+(user_version = 0) possono avere già parte delle tabelle e delle colonne.
+Per modificare lo schema: aggiornare models.py e aggiungere un passo in coda a MIGRATIONS.
+"""
+import logging
+from datetime import date, datetime
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from . import event_log, generations, models
+from .database import engine
+
+logger = logging.getLogger(__name__)
+
+
+def _create_tables(conn: Connection, *names: str) -> None:
+    # create_all controlla l'esistenza: crea solo le tabelle (e gli indici) mancanti
+    models.Base.metadata.create_all(conn, tables=[models.Base.metadata.tables[n] for n in names])
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str) -> None:
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _add_index(conn: Connection, table: str, *columns: str, name: Optional[str] = None) -> None:
+    name = name or f"ix_{table}_{'_'.join(columns)}"
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+# formati visti nei dati importati prima delle colonne Date
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y/%m/%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y")
+
+
+def _parse_date(value) -> Optional[str]:
+    raw = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(raw, fmt).date().isoformat()
+        except ValueError:
+            continue
+    try:
+        return date.fromisoformat(raw[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+def _normalize_dates(conn: Connection, table: str, column: str) -> None:
+    """
+    Riscrive in ISO "YYYY-MM-DD" i valori non canonici; quelli non interpretabili diventano NULL.
+    Il passaggio per julianday scarta anche i giorni inesistenti (es. 2024-02-30).
+    """
+    rows = conn.execute(text(
+        f"SELECT id, {column} FROM {table} "
+        f"WHERE {column} IS NOT NULL AND strftime('%Y-%m-%d', julianday({column})) IS NOT {column}"
+    )).all()
+    if not rows:
+        return
+    fixed = [{"id": row_id, "value": _parse_date(value) if str(value).strip() else None} for row_id, value in rows]
+    conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE id = :id"), fixed)
+    dropped = sum(1 for f in fixed if f["value"] is None)
+    logger.info("%s.%s: %d date normalizzate, %d non valide azzerate", table, column, len(fixed) - dropped, dropped)
+
+
+def _initial_schema(conn: Connection) -> None:
+    _create_tables(conn, "users", "portfolios", "wallets", "asset_info", "operations", "cashflow", "settings")
+
+
+def _price_history(conn: Connection) -> None:
+    _create_tables(conn, "price_history")
+
+
+def _portfolio_scope(conn: Connection) -> None:
+    for table in ("operations", "wallets"):
+        _add_column(conn, table, "portfolio_id", "INTEGER REFERENCES portfolios(id)")
+        _add_index(conn, table, "portfolio_id")
+
+
+def _alerts(conn: Connection) -> None:
+    _create_tables(conn, "alert_rules", "alert_events")
+
+
+def _typed_dates(conn: Connection) -> None:
+    for table, column in (("operations", "date"), ("cashflow", "date"), ("cashflow", "end_date")):
+        _normalize_dates(conn, table, column)
+    _add_index(conn, "operations", "date")
+    _add_index(conn, "operations", "asset_symbol", "date", name="ix_operations_symbol_date")
+
+
+def _operation_log(conn: Connection) -> None:
+    # trigger del log (create_all non li crea) e snapshot di partenza dello stato attuale
+    _create_tables(conn, "operation_events", "ledger_snapshots")
+    for ddl in event_log.TRIGGERS:
+        conn.execute(text(ddl))
+    if conn.execute(text("SELECT COUNT(*) FROM ledger_snapshots")).scalar() == 0:
+        event_log.store_snapshot(conn, event_log.latest_event_id(conn), event_log.state_from_operations(conn))
+
+
+def _asset_guesses(conn: Connection) -> None:
+    _create_tables(conn, "asset_guesses")
+
+
+def _cache_generations(conn: Connection) -> None:
+    # contatori condivisi tra processi delle cache in memoria, tenuti dai trigger
+    _create_tables(conn, "cache_generations")
+    for table in generations.COUNTED_TABLES:
+        conn.execute(text("INSERT OR IGNORE INTO cache_generations (name, value) VALUES (:n, 0)"), {"n": table})
+    for ddl in generations.TRIGGERS:
+        conn.execute(text(ddl))
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "schema iniziale", _initial_schema),
+    (2, "storico prezzi", _price_history),
+    (3, "portfolio_id su operations e wallets", _portfolio_scope),
+    (4, "regole ed eventi di alert", _alerts),
+    (5, "date in formato ISO e indici su operations.date", _typed_dates),
+    (6, "log eventi di operations e snapshot del ledger", _operation_log),
+    (7, "cache dei metadati indovinati per simbolo", _asset_guesses),
+    (8, "generazioni condivise delle cache in memoria", _cache_generations),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+
+def _set_version(conn: Connection, version: int) -> None:
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def migrate(bind=engine) -> int:
+    """Porta lo schema all'ultima versione. Ritorna il numero di passi applicati."""
+    with bind.connect() as conn:
+        if schema_version(conn) >= LATEST_VERSION:
+            return 0
+
+    with bind.begin() as conn:
+        version = schema_version(conn)
+        if version == 0 and not inspect(conn).get_table_names():
+            models.Base.metadata.create_all(conn)
+            _operation_log(conn)
+            _cache_generations(conn)
+            _set_version(conn, LATEST_VERSION)
+            logger.info("Schema creato alla versione %d", LATEST_VERSION)
+            return 1
+
+        applied = 0
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info("Migrazione schema %d: %s", number, description)
+            step(conn)
+            _set_version(conn, number)
+            applied += 1
+        return applied
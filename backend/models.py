@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, ForeignKey, Index, Text, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -25,6 +25,7 @@ class Wallet(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     description = Column(String)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"), index=True)
     operations = relationship("Operation", back_populates="wallet")
 
 class AssetInfo(Base):
@@ -40,14 +41,17 @@ class AssetInfo(Base):
 
 class Operation(Base):
     __tablename__ = "operations"
+    # ultimo prezzo per simbolo e filtri per periodo: indice su (asset_symbol, date)
+    __table_args__ = (Index("ix_operations_symbol_date", "asset_symbol", "date"),)
     id = Column(Integer, primary_key=True)
     user = Column(String)
-    date = Column(String)
+    date = Column(Date, index=True)  # in SQLite: testo ISO "YYYY-MM-DD"
     operation_type = Column(String)
     quantity = Column(Float)
     asset_symbol = Column(String)
     wallet_id = Column(Integer, ForeignKey("wallets.id"))
     wallet = relationship("Wallet", back_populates="operations")
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"), index=True)
     broker = Column(String)
     accounting = Column(Boolean, default=True)
     comment = Column(Text)
@@ -69,11 +73,11 @@ class Cashflow(Base):
     type = Column(String)
     category = Column(String)
     description = Column(String)
-    date = Column(String)
+    date = Column(Date)
     amount = Column(Float)
     recurring = Column(Boolean, default=False)
     recurrence_months = Column(Integer)
-    end_date = Column(String)
+    end_date = Column(Date)
 
 class Setting(Base):
     __tablename__ = "settings"
@@ -82,3 +86,76 @@ class Setting(Base):
     base_currency = Column(String, default="EUR")
     pac_monthly = Column(Float, default=0)
     alert_threshold = Column(Float, default=0)
+
+class PriceHistory(Base):
+    # Storico prezzi di chiusura giornalieri (anche cambi, es. "USDEUR=X")
+    __tablename__ = "price_history"
+    __table_args__ = (UniqueConstraint("symbol", "date", name="uq_price_history_symbol_date"),)
+    id = Column(Integer, primary_key=True)
+    symbol = Column(String, nullable=False)
+    date = Column(String, nullable=False)  # "YYYY-MM-DD"
+    close = Column(Float, nullable=False)
+
+class AlertRule(Base):
+    # kind: "position_value" (valore posizione sopra/sotto soglia), "drawdown" (calo dal massimo,
+    # frazione) o "category_drift" (scostamento del peso di categoria da target_weight)
+    __tablename__ = "alert_rules"
+    id = Column(Integer, primary_key=True)
+    user = Column(String)
+    portfolio_id = Column(Integer, ForeignKey("portfolios.id"), index=True)
+    kind = Column(String, nullable=False)
+    symbol = Column(String, index=True)
+    category = Column(String)
+    direction = Column(String, default="above")
+    threshold = Column(Float)  # se vuota si usa Setting.alert_threshold
+    target_weight = Column(Float)
+    active = Column(Boolean, default=True)
+    triggered = Column(Boolean, default=False)  # condizione attualmente vera (evento solo al cambio di stato)
+
+class AlertEvent(Base):
+    __tablename__ = "alert_events"
+    id = Column(Integer, primary_key=True)
+    rule_id = Column(Integer, ForeignKey("alert_rules.id"), index=True)
+    kind = Column(String)
+    symbol = Column(String)
+    category = Column(String)
+    value = Column(Float)
+    threshold = Column(Float)
+    message = Column(String)
+    created_at = Column(String)  # ISO datetime
+    acknowledged = Column(Boolean, default=False)
+
+class OperationEvent(Base):
+    # Log append-only delle scritture su operations, riempito dai trigger SQLite
+    # (event_log.TRIGGERS): immagine JSON della riga prima e dopo la modifica
+    __tablename__ = "operation_events"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = Column(Integer, primary_key=True)
+    operation_id = Column(Integer, index=True)
+    kind = Column(String, nullable=False)  # "insert" | "update" | "delete"
+    recorded_at = Column(String, index=True)  # ISO datetime UTC
+    old_row = Column(Text)  # NULL per gli insert
+    new_row = Column(Text)  # NULL per i delete
+
+class LedgerSnapshot(Base):
+    # Stato derivato (posizioni e costo di carico) compattato dopo l'evento event_id
+    __tablename__ = "ledger_snapshots"
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(String)  # ISO datetime UTC
+    state = Column(Text, nullable=False)  # JSON
+
+class AssetGuess(Base):
+    # Metadati indovinati da Yahoo per un simbolo (/assets/guess), per non ripetere la lettura lenta
+    __tablename__ = "asset_guesses"
+    symbol = Column(String, primary_key=True)  # maiuscolo
+    name = Column(String)
+    currency = Column(String)
+    fetched_at = Column(String)  # ISO datetime UTC
+
+class CacheGeneration(Base):
+    # Contatore di scritture per tabella, incrementato dai trigger SQLite (generations.TRIGGERS):
+    # le cache in memoria di ogni processo lo confrontano per vedere le scritture degli altri
+    __tablename__ = "cache_generations"
+    name = Column(String, primary_key=True)  # nome della tabella
+    value = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,414 @@
+# backend/performance.py
+"""
+Serie giornaliera di valorizzazione del portafoglio e metriche di rendimento (TWR / XIRR).
+
+Tutto il calcolo avviene su matrici NumPy (giorni × posizioni): quantità cumulate,
+prezzi e cambi riempiti in avanti, flussi di cassa per giorno e gruppo.
+"""
+from datetime import date
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from .models import AssetInfo, Wallet
+from . import ledger_cache, price_store, services
+
+GROUP_BY_CHOICES = ("total", "category", "type", "symbol", "wallet")
+
+# Tipi che non definiscono un prezzo di mercato (come nel fallback di _get_price_in_base)
+NO_PRICE_TYPES = {"Movimento Interno", "Saving", "Spesa"}
+INCOME_TYPES = {"Dividendo"}
+
+EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def _scatter_last(n_days: int, n_cols: int, day_idx, col_idx, values, order) -> np.ndarray:
+    """
+    Matrice (n_days × n_cols) piena di NaN con i punti dati; se più punti cadono
+    nella stessa cella vince quello con `order` maggiore.
+    """
+    matrix = np.full((n_days, n_cols), np.nan)
+    if len(values) == 0:
+        return matrix
+    flat = day_idx * n_cols + col_idx
+    sort = np.lexsort((order, flat))
+    flat_sorted = flat[sort]
+    last = np.r_[flat_sorted[1:] != flat_sorted[:-1], True]
+    matrix.flat[flat_sorted[last]] = values[sort][last]
+    return matrix
+
+
+def _fill_gaps(matrix: np.ndarray, default: float) -> np.ndarray:
+    """
+    Riempie i NaN in avanti lungo i giorni, poi all'indietro per i giorni
+    precedenti al primo punto; le colonne senza punti prendono `default`.
+    """
+    n_days, n_cols = matrix.shape
+    cols = np.arange(n_cols)
+
+    idx = np.where(~np.isnan(matrix), np.arange(n_days)[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = matrix[idx, cols]
+
+    rev = filled[::-1]
+    idx = np.where(~np.isnan(rev), np.arange(n_days)[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = rev[idx, cols][::-1]
+
+    return np.where(np.isnan(filled), default, filled)
+
+
+def _history_points(db: Session, names: List[str], end_day: np.datetime64):
+    """
+    Punti dello storico prezzi fino a end_day per i simboli dati, come array paralleli
+    (indice del simbolo in `names`, data, close).
+    """
+    history = price_store.load_history_arrays(db, names)
+    days = [history[n][0] for n in names]
+    closes = [history[n][1] for n in names]
+    if not names or not sum(len(d) for d in days):
+        return np.array([], dtype=np.int64), np.array([], dtype="datetime64[D]"), np.array([], dtype=float)
+    pos = np.repeat(np.arange(len(names)), [len(d) for d in days])
+    days = np.concatenate(days)
+    closes = np.concatenate(closes)
+    keep = days <= end_day
+    return pos[keep], days[keep], closes[keep]
+
+
+def get_base_currency(db: Session) -> str:
+    base = db.execute(text("SELECT COALESCE(MAX(base_currency), 'EUR') FROM settings")).scalar()
+    return services.normalize_currency(base)
+
+
+def _load_ledger(db: Session, end: date, portfolio_id: Optional[int] = None):
+    """Colonne del ledger in cache (operazioni fino a end incluso) come array di etichette."""
+    ledger = ledger_cache.get_ledger(db, portfolio_id)
+    keep = (ledger.day != ledger_cache.NO_DAY) & (ledger.day <= (np.datetime64(end, "D") - EPOCH).astype(np.int64))
+    if not keep.any():
+        return None
+    return {
+        "days": ledger.days_as_dates()[keep],
+        "symbol": np.array(ledger.symbols, dtype=str)[ledger.symbol[keep]],
+        "wallet": ledger.wallets[ledger.wallet[keep]],
+        "type": np.array(ledger.types, dtype=str)[ledger.type[keep]],
+        "qty": np.nan_to_num(ledger.quantity[keep]),
+        "price": ledger.price[keep],
+        "price_manual": ledger.price_manual[keep],
+        "fx": ledger.exchange_rate[keep],
+        "ccy": np.array(ledger.currencies, dtype=str)[ledger.currency[keep]],
+        "income": ledger.income[keep],
+    }
+
+
+def build_valuation(
+    db: Session,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = "total",
+    portfolio_id: Optional[int] = None,
+) -> Optional[dict]:
+    """
+    Costruisce la serie giornaliera di valore (in valuta base) e dei flussi esterni
+    per gruppo, tra start ed end inclusi.
+
+    Ritorna None se non ci sono operazioni, altrimenti un dict con:
+      - dates: datetime64[D] (n+1,), il primo giorno è la base (start - 1)
+      - groups: lista delle chiavi di gruppo
+      - values: matrice (n+1 × gruppi) del valore a fine giornata
+      - flows: matrice (n+1 × gruppi) dei flussi entrati (+) / usciti (-) nel giorno
+    """
+    if group_by not in GROUP_BY_CHOICES:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY_CHOICES)}")
+
+    end = end or date.today()
+    ledger = _load_ledger(db, end, portfolio_id)
+    if ledger is None:
+        return None
+
+    valid = ~np.isnat(ledger["days"]) & (ledger["symbol"] != "")
+    ledger = {k: v[valid] for k, v in ledger.items()}
+    if not len(ledger["days"]):
+        return None
+
+    base = get_base_currency(db)
+    first_day = ledger["days"].min()
+    start_day = np.datetime64(start, "D") if start else first_day
+    grid_start = start_day - np.timedelta64(1, "D")
+    end_day = np.datetime64(end, "D")
+    if end_day < start_day:
+        raise ValueError("end must not be before start")
+    n_days = int((end_day - grid_start).astype(int)) + 1
+    dates = grid_start + np.arange(n_days)
+
+    # Simboli e metadati asset (una sola query)
+    symbols, sym_idx = np.unique(ledger["symbol"], return_inverse=True)
+    meta = {
+        s: (ccy, t, c)
+        for s, ccy, t, c in db.query(
+            func.upper(AssetInfo.symbol), AssetInfo.currency, AssetInfo.type, AssetInfo.category
+        ).all()
+    }
+    sym_meta = [meta.get(s, (None, None, None)) for s in symbols]
+    sym_ccy = [services.normalize_currency(m[0]) for m in sym_meta]
+    sym_type = [m[1] or "N/D" for m in sym_meta]
+    sym_cat = [m[2] or "N/D" for m in sym_meta]
+    is_cash = np.array(
+        [s == base or price_store.is_liquidity(m[1], m[2]) for s, m in zip(symbols, sym_meta)],
+        dtype=bool,
+    )
+
+    raw_day = (ledger["days"] - grid_start).astype(np.int64)
+    day_idx = np.clip(raw_day, 0, None)
+    date_ord = (ledger["days"] - EPOCH).astype(np.int64)
+
+    # Prezzi (valuta dell'asset): storico + prezzi delle operazioni, riempiti in avanti
+    n_sym = len(symbols)
+    h_pos, h_days, h_close = _history_points(db, symbols[~is_cash].tolist(), end_day)
+    h_pos = np.flatnonzero(~is_cash)[h_pos]
+    h_raw = (h_days - grid_start).astype(np.int64)
+    h_ord = (h_days - EPOCH).astype(np.int64)
+
+    op_price = np.where(ledger["price"] > 0, ledger["price"], ledger["price_manual"])
+    has_price = (op_price > 0) & ~np.isin(ledger["type"], list(NO_PRICE_TYPES))
+    prices = _scatter_last(
+        n_days,
+        n_sym,
+        np.clip(np.r_[day_idx[has_price], h_raw], 0, None),
+        np.r_[sym_idx[has_price], h_pos],
+        np.r_[op_price[has_price], h_close],
+        np.r_[date_ord[has_price] * 2, h_ord * 2 + 1],  # a parità di giorno vince lo storico
+    )
+    prices = _fill_gaps(prices, 0.0)
+    prices[:, is_cash] = 1.0
+
+    # Cambi verso la valuta base: storico "XXXEUR=X" + cambi delle operazioni
+    currencies, sym_ccy_idx = np.unique(np.array(sym_ccy, dtype=str), return_inverse=True)
+    n_ccy = len(currencies)
+    fx_symbols = {services.fx_symbol(c, base): i for i, c in enumerate(currencies) if c != base}
+    f_pos, f_days, f_rate = _history_points(db, list(fx_symbols), end_day)
+    f_pos = np.array(list(fx_symbols.values()), dtype=np.int64)[f_pos] if len(f_pos) else f_pos
+    f_raw = (f_days - grid_start).astype(np.int64)
+    f_ord = (f_days - EPOCH).astype(np.int64)
+
+    # il cambio salvato nelle operazioni è sempre valuta di acquisto -> EUR: vale come
+    # cambio verso la base solo se la base è EUR (altrimenti solo storico e cambio corrente)
+    ccy_codes, ccy_inverse = np.unique(ledger["ccy"], return_inverse=True)
+    op_ccy = np.array([services.normalize_currency(c, default="") for c in ccy_codes], dtype=str)[ccy_inverse]
+    op_ccy_pos = np.searchsorted(currencies, op_ccy)
+    op_ccy_pos = np.clip(op_ccy_pos, 0, n_ccy - 1)
+    stored_fx = ledger["fx"] if base == "EUR" else np.zeros(len(ledger["fx"]))
+    has_fx = (stored_fx > 0) & (currencies[op_ccy_pos] == op_ccy) & (op_ccy != base)
+    fx = _scatter_last(
+        n_days,
+        n_ccy,
+        np.clip(np.r_[day_idx[has_fx], f_raw], 0, None),
+        np.r_[op_ccy_pos[has_fx], f_pos],
+        np.r_[stored_fx[has_fx], f_rate],
+        np.r_[date_ord[has_fx] * 2, f_ord * 2 + 1],
+    )
+    for i, c in enumerate(currencies):
+        if c == base:
+            fx[:, i] = 1.0
+        elif np.isnan(fx[:, i]).all():
+            # nessun dato storico: cambio corrente costante
+            fx[:, i] = services.get_conversion_rate(c, base) or 1.0
+    fx = _fill_gaps(fx, 1.0)
+
+    # Colonne posizione: simbolo, oppure (simbolo, wallet) se si raggruppa per wallet
+    if group_by == "wallet":
+        wallets, wal_idx = np.unique(ledger["wallet"], return_inverse=True)
+        pair_key = sym_idx * len(wallets) + wal_idx
+        pairs, col_idx = np.unique(pair_key, return_inverse=True)
+        col_sym = pairs // len(wallets)
+        names = dict(db.query(Wallet.id, Wallet.name).all())
+        col_group = [names.get(int(wallets[w]), "N/D") for w in pairs % len(wallets)]
+    else:
+        col_idx = sym_idx
+        col_sym = np.arange(n_sym)
+        if group_by == "symbol":
+            col_group = symbols.tolist()
+        elif group_by == "category":
+            col_group = sym_cat
+        elif group_by == "type":
+            col_group = sym_type
+        else:
+            col_group = ["total"] * n_sym
+    n_cols = len(col_sym)
+
+    groups, grp_of_col = np.unique(np.array(col_group, dtype=str), return_inverse=True)
+    n_grp = len(groups)
+    onehot = np.zeros((n_cols, n_grp))
+    onehot[np.arange(n_cols), grp_of_col] = 1.0
+
+    # Quantità cumulate e valore a fine giornata
+    qty_delta = np.bincount(
+        day_idx * n_cols + col_idx, weights=ledger["qty"], minlength=n_days * n_cols
+    ).reshape(n_days, n_cols)
+    quantities = np.cumsum(qty_delta, axis=0)
+    unit_value = prices[:, col_sym] * fx[:, sym_ccy_idx[col_sym]]
+    values = (quantities * unit_value) @ onehot
+
+    # Flussi esterni nella finestra: quantità × prezzo dell'operazione (o di mercato)
+    in_window = raw_day >= 1
+    market_unit = prices[day_idx, sym_idx] * fx[day_idx, sym_ccy_idx[sym_idx]]
+    trade_fx = np.where(stored_fx > 0, stored_fx, fx[day_idx, sym_ccy_idx[sym_idx]])
+    trade_unit = np.where((op_price > 0) & ~is_cash[sym_idx], op_price * trade_fx, market_unit)
+    flow = ledger["qty"] * trade_unit
+    is_income = np.isin(ledger["type"], list(INCOME_TYPES))
+    # dividendo senza quantità: incassato fuori dal portafoglio → distribuzione
+    flow = np.where(is_income, np.where(ledger["qty"] == 0, -ledger["income"], 0.0), flow)
+    flow = np.where(in_window, np.nan_to_num(flow), 0.0)
+    flows = np.bincount(
+        day_idx * n_grp + grp_of_col[col_idx], weights=flow, minlength=n_days * n_grp
+    ).reshape(n_days, n_grp)
+
+    return {
+        "dates": dates,
+        "groups": groups.tolist(),
+        "values": values,
+        "flows": flows,
+        "base_currency": base,
+    }
+
+
+def time_weighted_returns(values: np.ndarray, flows: np.ndarray) -> np.ndarray:
+    """
+    Rendimento time-weighted cumulato giorno per giorno (righe 1..n) per ogni gruppo.
+    Il flusso del giorno è considerato a fine giornata.
+    """
+    prev = values[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        daily = np.where(np.abs(prev) > 1e-9, (values[1:] - flows[1:]) / prev - 1.0, 0.0)
+    return np.cumprod(1.0 + daily, axis=0) - 1.0
+
+
+def xirr(day_offsets: np.ndarray, amounts: np.ndarray) -> Optional[float]:
+    """
+    Tasso interno di rendimento annuo per flussi a date irregolari
+    (Newton, con bisezione di riserva). None se non esiste una soluzione.
+    """
+    mask = amounts != 0
+    t = day_offsets[mask] / 365.0
+    c = amounts[mask]
+    if not (c > 0).any() or not (c < 0).any():
+        return None
+
+    def npv(rate):
+        return float(np.sum(c * (1.0 + rate) ** -t))
+
+    rate = 0.1
+    for _ in range(50):
+        disc = (1.0 + rate) ** -t
+        value = np.sum(c * disc)
+        deriv = np.sum(-t * c * disc / (1.0 + rate))
+        if not np.isfinite(value) or deriv == 0:
+            break
+        new_rate = rate - value / deriv
+        if new_rate <= -0.999999:
+            break
+        if abs(new_rate - rate) < 1e-10:
+            return float(new_rate)
+        rate = new_rate
+
+    lo, hi = -0.999999, 10.0
+    f_lo, f_hi = npv(lo), npv(hi)
+    while f_lo * f_hi > 0 and hi < 1e6:
+        hi *= 10
+        f_hi = npv(hi)
+    if f_lo * f_hi > 0:
+        return None
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        f_mid = npv(mid)
+        if abs(f_mid) < 1e-9 or hi - lo < 1e-12:
+            break
+        if f_lo * f_mid < 0:
+            hi, f_hi = mid, f_mid
+        else:
+            lo, f_lo = mid, f_mid
+    return float((lo + hi) / 2)
+
+
+def _annualize(total_return: float, n_days: int) -> Optional[float]:
+    # periodi sotto l'anno non vengono annualizzati
+    if n_days < 365 or total_return <= -1:
+        return None
+    return (1.0 + total_return) ** (365.0 / n_days) - 1.0
+
+
+def get_performance(
+    db: Session,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = "total",
+    portfolio_id: Optional[int] = None,
+) -> dict:
+    """
+    Rendimenti TWR (cumulato e annualizzato) e XIRR per gruppo nel periodo richiesto.
+    """
+    series = build_valuation(db, start, end, group_by, portfolio_id)
+    if series is None:
+        return {"start": str(start) if start else None, "end": str(end) if end else None, "group_by": group_by, "items": []}
+
+    values, flows, dates = series["values"], series["flows"], series["dates"]
+    n_days = len(dates) - 1
+    twr = time_weighted_returns(values, flows)[-1] if n_days else np.zeros(values.shape[1])
+    offsets = np.arange(len(dates), dtype=float)
+
+    items: List[dict] = []
+    for g, key in enumerate(series["groups"]):
+        # prospettiva dell'investitore: valore iniziale e versamenti negativi, valore finale positivo
+        cash = -flows[:, g].copy()
+        cash[0] = -values[0, g]
+        cash[-1] += values[-1, g]
+        items.append({
+            "key": key,
+            "start_value": round(float(values[0, g]), 2),
+            "end_value": round(float(values[-1, g]), 2),
+            "net_flows": round(float(flows[1:, g].sum()), 2),
+            "twr": round(float(twr[g]), 6),
+            "twr_annualized": _annualize(float(twr[g]), n_days),
+            "xirr": xirr(offsets, cash),
+        })
+    items.sort(key=lambda i: i["end_value"], reverse=True)
+
+    return {
+        "start": str(dates[1]) if n_days else str(dates[0]),
+        "end": str(dates[-1]),
+        "group_by": group_by,
+        "base_currency": series["base_currency"],
+        "items": items,
+    }
+
+
+def get_valuation_series(
+    db: Session,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = "total",
+    portfolio_id: Optional[int] = None,
+) -> dict:
+    """
+    Serie giornaliera di valore e TWR cumulato per gruppo, pronta per i grafici.
+    """
+    series = build_valuation(db, start, end, group_by, portfolio_id)
+    if series is None:
+        return {"group_by": group_by, "dates": [], "series": {}}
+
+    values, flows = series["values"], series["flows"]
+    twr = time_weighted_returns(values, flows)
+    return {
+        "group_by": group_by,
+        "base_currency": series["base_currency"],
+        "dates": series["dates"][1:].astype(str).tolist(),
+        "series": {
+            key: {
+                "value": np.round(values[1:, g], 2).tolist(),
+                "flows": np.round(flows[1:, g], 2).tolist(),
+                "twr": np.round(twr[:, g], 6).tolist(),
+            }
+            for g, key in enumerate(series["groups"])
+        },
+    }
@@ -0,0 +1,201 @@
+# backend/price_store.py
+import json
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import func, insert, text
+from sqlalchemy.orm import Session
+
+from .models import AssetInfo, Operation, PriceHistory
+from . import services
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cache in-process dello storico: symbol -> (date datetime64[D], close float64).
+# Lo storico cambia solo con sync_prices, che invalida i simboli toccati.
+_history_cache: Dict[str, tuple] = {}
+
+_LATEST_CLOSES = """
+    SELECT s.value, (
+        SELECT p.close FROM price_history p
+        WHERE p.symbol = s.value AND p.date <= :end
+        ORDER BY p.date DESC LIMIT 1
+    )
+    FROM json_each(:symbols) s
+"""
+
+
+def is_liquidity(asset_type: Optional[str], category: Optional[str]) -> bool:
+    return (asset_type or "").lower() == "liquidi" or (category or "").lower() == "liquidità"
+
+
+def last_stored_dates(db: Session, symbols: Iterable[str]) -> Dict[str, str]:
+    """
+    Ritorna {symbol: ultima data presente nello storico} con una sola query.
+    """
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    rows = (
+        db.query(PriceHistory.symbol, func.max(PriceHistory.date))
+        .filter(PriceHistory.symbol.in_(symbols))
+        .group_by(PriceHistory.symbol)
+        .all()
+    )
+    return {sym: last for sym, last in rows}
+
+
+def store_prices(db: Session, symbol: str, rows: List[tuple]) -> int:
+    """
+    Inserisce in blocco le chiusure [(YYYY-MM-DD, close), ...] ignorando le date già presenti.
+    """
+    return store_many(db, {symbol: rows})[symbol]
+
+
+def store_many(db: Session, rows_by_symbol: Dict[str, List[tuple]]) -> Dict[str, int]:
+    """
+    Come store_prices per più simboli, con un solo INSERT in blocco. Ritorna {symbol: righe}.
+    """
+    payload = []
+    counts: Dict[str, int] = {}
+    for symbol, rows in rows_by_symbol.items():
+        valid = [
+            {"symbol": symbol, "date": d, "close": float(c)}
+            for d, c in rows
+            if c is not None and c == c and c > 0
+        ]
+        counts[symbol] = len(valid)
+        payload += valid
+    if payload:
+        db.execute(insert(PriceHistory).prefix_with("OR IGNORE"), payload)
+        for symbol, n in counts.items():
+            if n:
+                _history_cache.pop(symbol, None)
+    return counts
+
+
+def tracked_symbols(db: Session, base_currency: str = "EUR") -> Dict[str, str]:
+    """
+    Simboli da tenere aggiornati nello storico: asset in portafoglio (escluse le liquidità)
+    e coppie di cambio delle valute diverse dalla base. Ritorna {symbol: prima data utile}.
+    """
+    base = services.normalize_currency(base_currency)
+    rows = (
+        db.query(
+            func.upper(Operation.asset_symbol),
+            func.min(Operation.date),
+            AssetInfo.type,
+            AssetInfo.category,
+            AssetInfo.currency,
+        )
+        .outerjoin(AssetInfo, func.upper(AssetInfo.symbol) == func.upper(Operation.asset_symbol))
+        .filter(Operation.accounting == True)
+        .group_by(func.upper(Operation.asset_symbol))
+        .all()
+    )
+
+    result: Dict[str, str] = {}
+    for symbol, first_date, asset_type, category, currency in rows:
+        if not symbol or not first_date:
+            continue
+        first_date = first_date.isoformat()
+        ccy = services.normalize_currency(currency)
+        if ccy != base:
+            pair = services.fx_symbol(ccy, base)
+            result[pair] = min(result.get(pair, first_date), first_date)
+        if symbol == base or is_liquidity(asset_type, category):
+            continue
+        result[symbol] = first_date
+    return result
+
+
+def sync_prices(db: Session, symbols: Optional[Dict[str, str]] = None, base_currency: str = "EUR") -> Dict[str, int]:
+    """
+    Scarica le chiusure mancanti (dall'ultima data salvata a oggi) e le salva nello storico.
+    Ritorna {symbol: righe inserite}.
+    """
+    targets = symbols if symbols is not None else tracked_symbols(db, base_currency)
+    last = last_stored_dates(db, targets.keys())
+    today = date.today().isoformat()
+
+    inserted: Dict[str, int] = {}
+    fetched: Dict[str, List[tuple]] = {}
+    starts: Dict[str, str] = {}
+    for symbol, first_date in targets.items():
+        start = first_date
+        if symbol in last:
+            start = (date.fromisoformat(last[symbol]) + timedelta(days=1)).isoformat()
+        if start > today:
+            inserted[symbol] = 0
+            continue
+        fetched[symbol] = services.get_price_history(symbol, start)
+        starts[symbol] = start
+    # un solo INSERT per tutti i simboli, non uno per simbolo
+    for symbol, n in store_many(db, fetched).items():
+        inserted[symbol] = n
+        logger.info("Storico prezzi %s: %d nuove chiusure da %s", symbol, n, starts[symbol])
+    db.commit()
+    return inserted
+
+
+def latest_closes(db: Session, symbols: Iterable[str], end: Optional[str] = None) -> Dict[str, float]:
+    """
+    Ultima chiusura salvata per ciascun simbolo (fino a end incluso, se dato), con una
+    sola query: per ogni simbolo della lista (json_each) una sottoquery correlata fa un
+    seek all'indietro sull'indice (symbol, date), senza scorrere tutto lo storico.
+    """
+    symbols = sorted(set(symbols))
+    if not symbols:
+        return {}
+    rows = db.execute(text(_LATEST_CLOSES), {"symbols": json.dumps(symbols), "end": end or "9999-12-31"})
+    return {sym: close for sym, close in rows if close is not None}
+
+
+def load_price_points(db: Session, symbols: Iterable[str], end: Optional[str] = None) -> List[tuple]:
+    """
+    Ritorna le righe (symbol, date, close) dello storico per i simboli dati, fino a end incluso,
+    ordinate per simbolo e data.
+    """
+    symbols = list(symbols)
+    if not symbols:
+        return []
+    q = db.query(PriceHistory.symbol, PriceHistory.date, PriceHistory.close).filter(
+        PriceHistory.symbol.in_(symbols)
+    )
+    if end:
+        q = q.filter(PriceHistory.date <= end)
+    return q.order_by(PriceHistory.symbol, PriceHistory.date).all()
+
+
+def load_history_arrays(db: Session, symbols: Iterable[str]) -> Dict[str, tuple]:
+    """
+    Ritorna {symbol: (date datetime64[D], close float64)} dello storico completo.
+    I simboli non ancora in cache vengono caricati con una sola query.
+    """
+    symbols = list(symbols)
+    missing = [s for s in symbols if s not in _history_cache]
+    if missing:
+        loaded = {s: (np.array([], dtype="datetime64[D]"), np.array([], dtype=float)) for s in missing}
+        rows = load_price_points(db, missing)
+        if rows:
+            sym, days, close = zip(*rows)
+            sym = np.array(sym, dtype=str)
+            days = np.array(days, dtype="datetime64[D]")
+            close = np.array(close, dtype=float)
+            bounds = np.r_[0, np.flatnonzero(sym[1:] != sym[:-1]) + 1, len(sym)]
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                loaded[sym[lo]] = (days[lo:hi], close[lo:hi])
+        _history_cache.update(loaded)
+    return {s: _history_cache[s] for s in symbols}
+
+
+def invalidate_history(symbols: Optional[Iterable[str]] = None) -> None:
+    """Svuota la cache dello storico (tutta o solo per i simboli dati)."""
+    if symbols is None:
+        _history_cache.clear()
+        return
+    for symbol in symbols:
+        _history_cache.pop(symbol, None)
@@ -0,0 +1,173 @@
+# backend/price_stream.py
+"""
+Stream live di prezzi e valori delle posizioni (Server-Sent Events su /stream/prices).
+
+Un solo ciclo di aggiornamento, condiviso da tutti i client, legge ogni
+REFRESH_SECONDS i prezzi dei simboli in portafoglio e calcola il valore delle
+posizioni nella valuta base: il carico verso i servizi di mercato è lo stesso con
+uno o cento client collegati. Il ciclo parte con il primo client e si ferma
+quando si scollega l'ultimo. I prezzi letti vengono passati anche agli alert.
+
+Ogni client riceve all'inizio lo stato completo, poi solo i simboli cambiati.
+Gli aggiornamenti non ancora inviati vengono fusi per simbolo (resta l'ultimo
+valore): un client lento riceve meno eventi, più grandi, senza accumulare code
+e senza rallentare gli altri.
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+
+from . import alerts, asset_registry, ledger_cache, performance, services
+from .database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+REFRESH_SECONDS = 30.0
+HEARTBEAT_SECONDS = 15.0
+FETCH_WORKERS = 8
+EPSILON = 1e-9
+
+
+class _Subscriber:
+    def __init__(self, symbols: Optional[Set[str]] = None):
+        self.symbols = symbols
+        self.pending: Dict[str, Optional[dict]] = {}
+        self.ready = asyncio.Event()
+
+    def push(self, ticks: Dict[str, Optional[dict]]) -> None:
+        if self.symbols is not None:
+            ticks = {s: t for s, t in ticks.items() if s in self.symbols}
+        if ticks:
+            self.pending.update(ticks)
+            self.ready.set()
+
+    def drain(self) -> Dict[str, Optional[dict]]:
+        ticks, self.pending = self.pending, {}
+        self.ready.clear()
+        return ticks
+
+
+_subscribers: Set[_Subscriber] = set()
+# ultimo stato pubblicato: symbol -> {price, currency, quantity, value}
+_snapshot: Dict[str, dict] = {}
+_updated_at: Optional[str] = None
+# cambi già passati agli alert (toccati solo dal thread di refresh)
+_rates: Dict[str, float] = {}
+_task: Optional[asyncio.Task] = None
+
+
+def _fetch_prices(symbols: Iterable[str]) -> Dict[str, float]:
+    symbols = list(symbols)
+    if not symbols:
+        return {}
+    with ThreadPoolExecutor(min(FETCH_WORKERS, len(symbols))) as pool:
+        return dict(zip(symbols, pool.map(services.get_current_price, symbols)))
+
+
+def refresh(previous: Dict[str, dict]) -> Tuple[Dict[str, dict], Dict[str, Optional[dict]]]:
+    """
+    Un giro di aggiornamento (sincrono, gira in un thread): ritorna il nuovo stato e
+    i tick cambiati rispetto a previous (None = posizione chiusa).
+    Un prezzo non disponibile lascia invariato il tick precedente del simbolo.
+    """
+    db = SessionLocal()
+    try:
+        base = performance.get_base_currency(db)
+        assets = asset_registry.get_assets(db)
+        positions = {s: q for s, q in ledger_cache.get_ledger(db).positions().items() if abs(q) > EPSILON}
+
+        currencies = {}
+        for symbol in positions:
+            meta = assets.get(symbol)
+            currencies[symbol] = services.normalize_currency(meta.currency if meta else None, base)
+        # liquidità e valuta base: prezzo 1 nella propria valuta, nessuna chiamata di mercato
+        priced = [s for s in positions if s != base and not (s in assets and assets[s].liquidity)]
+        prices = _fetch_prices(priced)
+        rates = {c: 1.0 if c == base else services.get_conversion_rate(c, base) for c in set(currencies.values())}
+
+        state: Dict[str, dict] = {}
+        for symbol, qty in positions.items():
+            price = prices.get(symbol, 1.0)
+            if not price or price <= 0:
+                if symbol in previous:
+                    state[symbol] = previous[symbol]
+                continue
+            ccy = currencies[symbol]
+            state[symbol] = {
+                "price": round(float(price), 6),
+                "currency": ccy,
+                "quantity": round(qty, 6),
+                "value": round(qty * price * rates[ccy], 2),
+            }
+
+        changes: Dict[str, Optional[dict]] = {s: t for s, t in state.items() if previous.get(s) != t}
+        changes.update({s: None for s in previous if s not in state})
+
+        live = {s: prices[s] for s in changes if s in prices and prices[s] and prices[s] > 0}
+        for ccy, rate in rates.items():
+            pair = services.fx_symbol(ccy, base)
+            if ccy != base and rate and _rates.get(pair) != rate:
+                live[pair] = _rates[pair] = rate
+        if live:
+            alerts.on_prices(db, live)
+        return state, changes
+    finally:
+        db.close()
+
+
+def _total(state: Dict[str, dict]) -> float:
+    return round(sum(t["value"] for t in state.values()), 2)
+
+
+async def _run() -> None:
+    global _snapshot, _updated_at
+    while _subscribers:
+        try:
+            state, changes = await asyncio.to_thread(refresh, _snapshot)
+        except Exception:
+            logger.exception("Aggiornamento prezzi dello stream fallito")
+        else:
+            _snapshot, _updated_at = state, datetime.now().isoformat(timespec="seconds")
+            if changes:
+                for subscriber in list(_subscribers):
+                    subscriber.push(changes)
+        await asyncio.sleep(REFRESH_SECONDS)
+
+
+def _subscribe(symbols: Optional[Set[str]]) -> _Subscriber:
+    global _task
+    subscriber = _Subscriber(symbols)
+    _subscribers.add(subscriber)
+    if _task is None or _task.done():
+        _task = asyncio.create_task(_run())
+    return subscriber
+
+
+def _event(name: str, ticks: Dict[str, Optional[dict]]) -> str:
+    payload = {"updated_at": _updated_at, "total_value": _total(_snapshot), "symbols": ticks}
+    return f"event: {name}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
+
+
+async def stream(request, symbols: Optional[Iterable[str]] = None) -> AsyncIterator[str]:
+    """
+    Generatore SSE per un client: evento "snapshot" con lo stato corrente, poi eventi
+    "prices" con i soli simboli cambiati e un commento di keep-alive ogni HEARTBEAT_SECONDS.
+    """
+    wanted = {s.upper() for s in symbols} if symbols else None
+    subscriber = _subscribe(wanted)
+    try:
+        current = {s: t for s, t in _snapshot.items() if wanted is None or s in wanted}
+        yield _event("snapshot", current)
+        while not await request.is_disconnected():
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield _event("prices", subscriber.drain())
+    finally:
+        _subscribers.discard(subscriber)
+
@@ -0,0 +1,202 @@
+# backend/pricing.py
+"""
+Prezzi e cambi usati per valorizzare il portafoglio, correnti o a una data passata
+(parametro as_of degli endpoint di dashboard, wallet e asset).
+
+Senza as_of i valori arrivano dai servizi di mercato, come prima. Con as_of si usano
+solo dati locali: ultima chiusura <= as_of in price_history (popolata da /prices/sync),
+poi l'ultimo prezzo registrato nelle operazioni fino a quella data. Per i cambi senza
+storico si ricade sul cambio corrente.
+
+Una PriceSnapshot vive per una richiesta e ricorda i simboli già risolti; prefetch()
+carica le chiusure di più simboli con una sola query sull'indice (symbol, date) e
+prices() risolve un insieme di simboli, fallback sulle operazioni compreso, con un
+numero di query che non dipende da quanti sono. Dentro shared_snapshots() le snapshot
+della stessa data condividono questi valori (POST /batch); seeded_live() le fa partire
+dai prezzi correnti già letti in parallelo dalle route async (backend/aio.py).
+"""
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import price_store, services
+
+# ultimo prezzo valido per ogni simbolo della lista in una sola passata: la finestra
+# per simbolo sull'indice (asset_symbol, date) sostituisce una query LIMIT 1 per simbolo
+_LAST_OPERATION_PRICES = """
+    SELECT symbol, p FROM (
+        SELECT o.asset_symbol AS symbol,
+               COALESCE(NULLIF(o.price,0), NULLIF(o.price_manual,0)) AS p,
+               ROW_NUMBER() OVER (PARTITION BY o.asset_symbol ORDER BY o.date DESC, o.id DESC) AS rn
+        FROM operations o
+        WHERE o.asset_symbol IN (SELECT value FROM json_each(:symbols))
+          AND o.accounting = 1
+          AND COALESCE(o.price, o.price_manual) IS NOT NULL
+          AND COALESCE(o.price, o.price_manual) > 0
+          AND o.operation_type NOT IN ('Movimento Interno', 'Saving', 'Spesa')
+          {until}
+    )
+    WHERE rn = 1
+"""
+
+
+def last_operation_prices(db: Session, symbols: Iterable[str], as_of: Optional[date] = None) -> Dict[str, float]:
+    """Ultimo prezzo valido registrato nelle operazioni (fino ad as_of incluso) per simbolo, 0 se assente."""
+    wanted = sorted({s for s in symbols if s})
+    if not wanted:
+        return {}
+    sql = text(_LAST_OPERATION_PRICES.format(until="AND o.date <= :as_of" if as_of else ""))
+    rows = db.execute(sql, {"symbols": json.dumps(wanted), "as_of": as_of}).all()
+    prices = dict.fromkeys(wanted, 0.0)
+    prices.update({r.symbol: float(r.p) for r in rows if r.p is not None})
+    return prices
+
+
+def last_operation_price(db: Session, symbol: str, as_of: Optional[date] = None) -> float:
+    """Ultimo prezzo valido registrato nelle operazioni (fino ad as_of incluso), 0 se assente."""
+    return last_operation_prices(db, [symbol], as_of).get(symbol, 0.0)
+
+
+class _SnapshotState:
+    """Valori già risolti da una snapshot, condivisibili tra snapshot della stessa data."""
+
+    def __init__(self):
+        self.closes: Dict[str, float] = {}
+        self.loaded: Set[str] = set()
+        self.fallback: Dict[str, float] = {}
+        self.live: Dict[str, float] = {}
+        self.rates: Dict[Tuple[str, str], float] = {}
+
+
+# stato condiviso per as_of dentro shared_snapshots() (es. le sotto-richieste di /batch)
+_shared: ContextVar[Optional[Dict[Optional[date], _SnapshotState]]] = ContextVar("price_snapshots", default=None)
+
+
+@contextmanager
+def shared_snapshots() -> Iterator[None]:
+    """
+    Nel blocco (e nei thread che ne copiano il contesto) le PriceSnapshot con lo stesso
+    as_of condividono prezzi e cambi: ogni simbolo è letto una volta e tutte le risposte
+    usano gli stessi valori.
+    """
+    token = _shared.set({})
+    try:
+        yield
+    finally:
+        _shared.reset(token)
+
+
+@contextmanager
+def seeded_live(prices: Dict[str, float], rates: Dict[Tuple[str, str], float]) -> Iterator[None]:
+    """
+    Nel blocco le PriceSnapshot correnti (as_of None) partono da prezzi e cambi già letti
+    (aio.warm_market): nessuna chiamata ai servizi di mercato per questi valori.
+    """
+    token = _shared.set({}) if _shared.get() is None else None
+    try:
+        state = _shared.get().setdefault(None, _SnapshotState())
+        for symbol, price in prices.items():
+            state.live.setdefault(symbol, price)
+        for key, rate in rates.items():
+            state.rates.setdefault((key[0].upper(), key[1].upper()), rate)
+        yield
+    finally:
+        if token is not None:
+            _shared.reset(token)
+
+
+class PriceSnapshot:
+    """Prezzi e cambi di una richiesta: correnti se as_of è None, altrimenti alla data."""
+
+    def __init__(self, db: Session, as_of: Optional[date] = None):
+        self.db = db
+        self.as_of = as_of
+        scope = _shared.get()
+        state = scope.setdefault(as_of, _SnapshotState()) if scope is not None else _SnapshotState()
+        self._closes = state.closes
+        self._loaded = state.loaded
+        self._fallback = state.fallback
+        self._live = state.live
+        self._rates = state.rates
+
+    def prefetch(self, symbols: Iterable[str]) -> None:
+        """Carica in blocco le chiusure <= as_of (nessun effetto sui prezzi correnti)."""
+        if self.as_of is None:
+            return
+        missing = {s for s in symbols if s} - self._loaded
+        if missing:
+            self._closes.update(price_store.latest_closes(self.db, missing, self.as_of.isoformat()))
+            self._loaded |= missing
+
+    def prefetch_fx(self, currencies: Iterable[str], to_currency: str = "EUR") -> None:
+        self.prefetch(
+            services.fx_symbol(c, to_currency) for c in currencies if c and c.upper() != to_currency.upper()
+        )
+
+    def _close(self, symbol: str) -> Optional[float]:
+        self.prefetch([symbol])
+        return self._closes.get(symbol)
+
+    def price(self, symbol: str) -> float:
+        """Prezzo nella valuta dell'asset, 0 se non disponibile."""
+        if self.as_of is None:
+            return self._live_price(symbol)
+        close = self._close(symbol)
+        if close:
+            return float(close)
+        return self.fallback(symbol)
+
+    def prefetch_fallback(self, symbols: Iterable[str]) -> None:
+        """Carica con una query l'ultimo prezzo delle operazioni per i simboli non ancora risolti."""
+        missing = {s for s in symbols if s} - self._fallback.keys()
+        if missing:
+            self._fallback.update(last_operation_prices(self.db, missing, self.as_of))
+
+    def fallback(self, symbol: str) -> float:
+        """Ultimo prezzo registrato nelle operazioni (fino ad as_of), 0 se assente."""
+        self.prefetch_fallback([symbol])
+        return self._fallback.get(symbol, 0.0)
+
+    def prices(self, symbols: Iterable[str]) -> Dict[str, float]:
+        """
+        Prezzi di più simboli nella loro valuta, con il fallback sulle operazioni risolto
+        in blocco per quelli senza prezzo: numero di query costante nel numero di simboli.
+        """
+        wanted = {s for s in symbols if s}
+        prices: Dict[str, float] = {}
+        if self.as_of is not None:
+            self.prefetch(wanted)
+            prices = {s: float(self._closes.get(s) or 0.0) for s in wanted}
+        else:
+            for symbol in wanted:
+                try:
+                    prices[symbol] = float(self._live_price(symbol) or 0.0)
+                except Exception:
+                    prices[symbol] = 0.0
+        missing = [s for s, p in prices.items() if not p > 0]
+        self.prefetch_fallback(missing)
+        for symbol in missing:
+            prices[symbol] = self._fallback.get(symbol, 0.0)
+        return prices
+
+    def _live_price(self, symbol: str) -> float:
+        if symbol not in self._live:
+            self._live[symbol] = services.get_current_price(symbol)
+        return self._live[symbol]
+
+    def rate(self, from_currency: str, to_currency: str = "EUR") -> float:
+        if from_currency.upper() == to_currency.upper():
+            return 1.0
+        if self.as_of is not None:
+            close = self._close(services.fx_symbol(from_currency, to_currency))
+            if close:
+                return float(close)
+        key = (from_currency.upper(), to_currency.upper())
+        if key not in self._rates:
+            self._rates[key] = services.get_conversion_rate(from_currency, to_currency)
+        return self._rates[key]
@@ -0,0 +1,150 @@
+# backend/projection.py
+"""
+Proiezione mensile dei flussi di cassa (tabella cashflow) e dei versamenti PAC.
+
+I flussi ricorrenti sono progressioni aritmetiche sui mesi: invece di espandere ogni
+occorrenza, per ogni periodo distinto si usa un array di differenze a passo p e una
+somma cumulata per residuo, quindi il costo è O(flussi + mesi × periodi distinti).
+"""
+from datetime import date
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import Integer, cast, func
+from sqlalchemy.orm import Session
+
+from .models import Cashflow, Operation, Setting
+
+EXPENSE_TYPES = {"uscita", "spesa", "expense"}
+INCOME_TYPES = {"entrata", "income", "saving"}
+MAX_MONTHS = 12 * 100
+
+
+def month_index(column):
+    """Espressione SQL: indice assoluto del mese (anno*12 + mese-1), -1 se la data manca."""
+    year = cast(func.strftime("%Y", column), Integer)
+    month = cast(func.strftime("%m", column), Integer)
+    return func.coalesce(year * 12 + month - 1, -1)
+
+
+def expand_monthly(first: np.ndarray, period: np.ndarray, last: np.ndarray, amounts: np.ndarray, n_months: int) -> np.ndarray:
+    """
+    Somma per mese dei flussi che cadono ai mesi first, first+period, ... <= last
+    (indici relativi all'inizio della griglia, first può essere negativo).
+    """
+    total = np.zeros(n_months)
+    if not len(amounts):
+        return total
+
+    # prima occorrenza dentro la griglia e ultima occorrenza effettiva
+    skip = np.where(first < 0, (-first + period - 1) // period, 0)
+    first = first + skip * period
+    last = np.minimum(last, n_months - 1)
+    keep = first <= last
+    first, period, last, amounts = first[keep], period[keep], last[keep], amounts[keep]
+    last = first + ((last - first) // period) * period
+
+    for p in np.unique(period).tolist():
+        sel = period == p
+        rows = (n_months + p) // p + 1
+        diff = np.zeros(rows * p)
+        np.add.at(diff, first[sel], amounts[sel])
+        np.add.at(diff, last[sel] + p, -amounts[sel])
+        # indice m = j*p + r: la cumulata lungo j accumula solo i mesi con lo stesso residuo r
+        total += np.cumsum(diff.reshape(rows, p), axis=0).ravel()[:n_months]
+    return total
+
+
+def _signed_amounts(types, amounts) -> np.ndarray:
+    kinds = np.char.lower(np.char.strip(np.array(types, dtype=str)))
+    values = np.nan_to_num(np.array(amounts, dtype=float))
+    values = np.where(np.isin(kinds, list(EXPENSE_TYPES)), -np.abs(values), values)
+    values = np.where(np.isin(kinds, list(INCOME_TYPES)), np.abs(values), values)
+    return values
+
+
+def _pac_monthly(db: Session, user: Optional[str]) -> float:
+    q = db.query(func.max(Setting.pac_monthly))
+    if user:
+        q = q.filter(Setting.user == user)
+    return float(q.scalar() or 0.0)
+
+
+def get_projection(
+    db: Session,
+    months: int = 360,
+    start: Optional[date] = None,
+    user: Optional[str] = None,
+    annual_return: float = 0.0,
+    initial_value: Optional[float] = None,
+    initial_cash: float = 0.0,
+) -> dict:
+    """
+    Griglia mensile da start (default mese corrente) per `months` mesi con:
+    entrate, uscite, saldo netto, PAC, liquidità cumulata (netto - PAC) e valore
+    del portafoglio che cresce al rendimento annuo dato con i versamenti PAC.
+    """
+    if not 1 <= months <= MAX_MONTHS:
+        raise ValueError(f"months must be between 1 and {MAX_MONTHS}")
+    if not annual_return > -1.0:
+        raise ValueError("annual_return must be greater than -1")
+    start = start or date.today()
+    grid_start = start.year * 12 + start.month - 1
+
+    q = db.query(
+        func.coalesce(Cashflow.type, ""),
+        Cashflow.amount,
+        month_index(Cashflow.date),
+        func.coalesce(Cashflow.recurring, False),
+        Cashflow.recurrence_months,
+        month_index(Cashflow.end_date),
+    )
+    if user:
+        q = q.filter(Cashflow.user == user)
+    rows = q.all()
+
+    if rows:
+        types, amounts, first, recurring, every, end_month = zip(*rows)
+        amounts = _signed_amounts(types, amounts)
+        first = np.array(first, dtype=np.int64)
+        valid = first >= 0
+        recurring = np.array(recurring, dtype=bool)
+        period = np.array([p or 1 for p in every], dtype=np.int64)
+        period = np.where(recurring, np.maximum(period, 1), 1)
+        end_month = np.array(end_month, dtype=np.int64)
+        # senza ricorrenza: una sola occorrenza; ricorrente senza fine: fino a fine griglia
+        last = np.where(recurring, np.where(end_month >= 0, end_month, grid_start + months), first)
+        first, period, last, amounts = first[valid] - grid_start, period[valid], last[valid] - grid_start, amounts[valid]
+    else:
+        first = period = last = np.array([], dtype=np.int64)
+        amounts = np.array([], dtype=float)
+
+    income = expand_monthly(first, period, last, np.where(amounts > 0, amounts, 0.0), months)
+    expenses = expand_monthly(first, period, last, np.where(amounts < 0, amounts, 0.0), months)
+    net = income + expenses
+
+    pac = np.full(months, _pac_monthly(db, user))
+    cash_balance = initial_cash + np.cumsum(net - pac)
+
+    if initial_value is None:
+        # stesso filtro per utente di PAC e flussi di cassa
+        q = db.query(func.sum(Operation.total_value)).filter(Operation.accounting == True)
+        if user:
+            q = q.filter(Operation.user == user)
+        initial_value = float(q.scalar() or 0.0)
+    # V_t = g^t * (V_0 + sum_{k<=t} c_k * g^-k), con g il fattore di crescita mensile
+    growth = (1.0 + annual_return) ** (1.0 / 12.0)
+    factors = growth ** np.arange(1, months + 1)
+    portfolio_value = factors * (initial_value + np.cumsum(pac / factors))
+
+    labels = (np.datetime64("1970-01", "M") + np.arange(grid_start - 1970 * 12, grid_start - 1970 * 12 + months)).astype(str)
+    return {
+        "start": labels[0],
+        "months": labels.tolist(),
+        "income": np.round(income, 2).tolist(),
+        "expenses": np.round(expenses, 2).tolist(),
+        "net": np.round(net, 2).tolist(),
+        "pac": np.round(pac, 2).tolist(),
+        "cash_balance": np.round(cash_balance, 2).tolist(),
+        "portfolio_value": np.round(portfolio_value, 2).tolist(),
+    }
@@ -0,0 +1,339 @@
+# backend/reprice.py
+"""
+Ricalcolo dei campi derivati delle operazioni (prezzo, cambio, valore totale, segno
+della quantità) per un insieme di operazioni o per tutto il ledger.
+
+Il prezzo è la chiusura del giorno dell'operazione (o l'ultima nei MAX_STALE_DAYS
+precedenti, per weekend e festivi) dallo storico price_history; il cambio verso EUR
+allo stesso modo dalla coppia "USDEUR=X". Prima del ricalcolo una query raggruppata
+trova i simboli e le coppie coinvolti con il loro intervallo di date: le parti di
+storico mancanti vengono scaricate in parallelo (FETCH_WORKERS thread) e salvate,
+così un secondo ricalcolo lavora solo in locale. Le operazioni vengono poi lette a
+blocchi di BATCH_SIZE righe (per id crescente), le chiusure cercate con searchsorted
+sugli array dello storico in cache, e solo le righe cambiate scritte con un UPDATE
+in blocco per chiave primaria.
+
+Regole come in crud._build_operation_object: price_manual vince sul prezzo storico,
+liquidità ed EUR valgono 1, fee convertite in EUR e sottratte dal totale. Se una
+chiusura non è disponibile resta il prezzo (o cambio) già salvato. Quando la chiusura
+cambia (es. data modificata), massimo e minimo del giorno diventano NULL: lo storico
+non li contiene e quelli salvati si riferiscono a un altro giorno. Le operazioni di
+tipi che non definiscono un prezzo (Dividendo, Movimento Interno, ...) non cambiano.
+
+Uso da riga di comando:
+    python -m backend.reprice
+    python -m backend.reprice --portfolio 2 --no-fetch
+    python -m backend.reprice --ids 10 11 12
+"""
+import argparse
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text, update
+from sqlalchemy.orm import Session
+
+from . import alerts, asset_registry, event_log, ledger_cache, price_store, services
+from .crud import NEGATIVE_TYPES, POSITIVE_TYPES
+from .models import Operation
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5_000
+FETCH_WORKERS = 8
+MAX_STALE_DAYS = 7
+
+PRICED_TYPES = POSITIVE_TYPES | NEGATIVE_TYPES
+
+_TYPES_SQL = ", ".join(f"'{t}'" for t in sorted(PRICED_TYPES))
+
+_PLAN = """
+    SELECT UPPER(o.asset_symbol) AS symbol, UPPER(TRIM(o.purchase_currency)) AS ccy,
+           MIN(o.date) AS first, MAX(o.date) AS last, SUM(o.price_manual IS NULL) AS auto_priced
+    FROM operations o
+    WHERE o.asset_symbol IS NOT NULL AND o.date IS NOT NULL
+      AND o.operation_type IN ({types}) {where}
+    GROUP BY 1, 2
+"""
+
+_BATCH = """
+    SELECT o.id, o.date, o.operation_type, o.asset_symbol, UPPER(o.asset_symbol) AS symbol, o.quantity,
+           o.price, o.price_manual, o.price_avg_day, o.price_high_day, o.price_low_day,
+           o.purchase_currency, o.exchange_rate, o.fees, o.total_value, o.portfolio_id
+    FROM operations o
+    WHERE o.id > :after AND o.asset_symbol IS NOT NULL AND o.date IS NOT NULL
+      AND o.operation_type IN ({types}) {where}
+    ORDER BY o.id
+    LIMIT :limit
+"""
+
+
+def _filter(ids: Optional[List[int]], portfolio_id: Optional[int]) -> str:
+    where = ""
+    if ids is not None:
+        where += " AND o.id IN (SELECT value FROM json_each(:ids))"
+    if portfolio_id is not None:
+        where += " AND o.portfolio_id = :portfolio_id"
+    return where
+
+
+def _currency(stored: Optional[str], asset) -> str:
+    return ((stored or "").strip() or (asset.currency if asset else None) or "EUR").upper()
+
+
+def _needs_market_price(symbol: str, asset) -> bool:
+    return symbol != "EUR" and not (asset and asset.liquidity)
+
+
+def _plan(db: Session, where: str, params: dict) -> Dict[str, Tuple[str, str]]:
+    """{simbolo o coppia di cambio: (prima data, ultima data)} da avere nello storico."""
+    ranges: Dict[str, Tuple[str, str]] = {}
+
+    def extend(key: str, first: str, last: str) -> None:
+        lo, hi = ranges.get(key, (first, last))
+        ranges[key] = (min(lo, first), max(hi, last))
+
+    for r in db.execute(text(_PLAN.format(types=_TYPES_SQL, where=where)), params).mappings():
+        first, last = str(r["first"])[:10], str(r["last"])[:10]
+        asset = asset_registry.get(db, r["symbol"])
+        if r["auto_priced"] and _needs_market_price(r["symbol"], asset):
+            extend(r["symbol"], first, last)
+        ccy = _currency(r["ccy"], asset)
+        if ccy != "EUR":
+            extend(services.fx_symbol(ccy, "EUR"), first, last)
+    return ranges
+
+
+def _missing_ranges(history: tuple, first: str, last: str) -> List[Tuple[str, str]]:
+    """Intervalli [start, end) di storico da scaricare per coprire [first - MAX_STALE_DAYS, last]."""
+    start = (date.fromisoformat(first) - timedelta(days=MAX_STALE_DAYS)).isoformat()
+    end = (date.fromisoformat(last) + timedelta(days=1)).isoformat()
+    days = history[0]
+    if len(days) == 0:
+        return [(start, end)]
+    stored_first, stored_last = str(days[0]), str(days[-1])
+    missing = []
+    if start < stored_first:
+        missing.append((start, stored_first))
+    if stored_last < last:
+        missing.append(((date.fromisoformat(stored_last) + timedelta(days=1)).isoformat(), end))
+    return missing
+
+
+def fetch_missing_history(db: Session, ranges: Dict[str, Tuple[str, str]]) -> int:
+    """Scarica in parallelo le chiusure mancanti per gli intervalli dati e le salva. Ritorna le righe inserite."""
+    histories = price_store.load_history_arrays(db, ranges.keys())
+    jobs = [
+        (symbol, start, end)
+        for symbol, (first, last) in ranges.items()
+        for start, end in _missing_ranges(histories[symbol], first, last)
+    ]
+    if not jobs:
+        return 0
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        results = list(pool.map(lambda job: services.get_price_history(*job), jobs))
+    by_symbol: Dict[str, list] = {}
+    for (symbol, start, end), rows in zip(jobs, results):
+        logger.info("Reprice: %d chiusure di %s tra %s e %s", len(rows), symbol, start, end)
+        by_symbol.setdefault(symbol, []).extend(rows)
+    inserted = sum(price_store.store_many(db, by_symbol).values())
+    db.commit()
+    return inserted
+
+
+def _closes_at(history: tuple, days: np.ndarray) -> np.ndarray:
+    """Chiusura di ogni giorno (o l'ultima nei MAX_STALE_DAYS precedenti), NaN se assente."""
+    hist_days, hist_close = history
+    result = np.full(len(days), np.nan)
+    if len(hist_days) == 0:
+        return result
+    idx = np.searchsorted(hist_days, days, side="right") - 1
+    found = idx >= 0
+    fresh = found.copy()
+    fresh[found] = (days[found] - hist_days[idx[found]]).astype(int) <= MAX_STALE_DAYS
+    result[fresh] = hist_close[idx[fresh]]
+    return result
+
+
+def _lookup(histories: Dict[str, tuple], pairs: List[Tuple[str, str]]) -> Dict[Tuple[str, str], float]:
+    """{(simbolo, giorno): chiusura} per le coppie con un prezzo nello storico."""
+    by_symbol: Dict[str, List[str]] = {}
+    for symbol, day in set(pairs):
+        if symbol in histories:
+            by_symbol.setdefault(symbol, []).append(day)
+    found: Dict[Tuple[str, str], float] = {}
+    for symbol, days in by_symbol.items():
+        closes = _closes_at(histories[symbol], np.array(days, dtype="datetime64[D]"))
+        found.update({(symbol, d): float(c) for d, c in zip(days, closes.tolist()) if c == c})
+    return found
+
+
+def _derive(row, asset, closes: Dict[Tuple[str, str], float], current_rates: Dict[str, float]) -> Tuple[dict, bool]:
+    """Campi derivati ricalcolati per una riga; il flag indica se manca un prezzo storico."""
+    day = str(row["date"])[:10]
+    symbol = row["symbol"]
+    ccy = _currency(row["purchase_currency"], asset)
+    missing = False
+
+    qty = abs(row["quantity"] or 0.0)
+    if row["operation_type"] in NEGATIVE_TYPES:
+        qty = -qty
+
+    fields = {"asset_symbol": symbol, "purchase_currency": ccy, "quantity": qty}
+    if row["price_manual"] is not None:
+        price = float(row["price_manual"])
+        fields.update(price_avg_day=price, price_high_day=price, price_low_day=price)
+    elif not _needs_market_price(symbol, asset):
+        price = 1.0
+        fields.update(price_avg_day=1.0, price_high_day=1.0, price_low_day=1.0)
+    elif (symbol, day) in closes:
+        price = closes[(symbol, day)]
+        # lo storico ha solo le chiusure: massimo e minimo salvati valgono solo se vengono
+        # dallo stesso giorno (stessa chiusura), altrimenti non sono ricavabili
+        if not _same_close(row["price_avg_day"], price):
+            fields.update(price_avg_day=price, price_high_day=None, price_low_day=None)
+    else:
+        price = row["price"] or 0.0
+        missing = True
+
+    if ccy == "EUR":
+        rate = 1.0
+    else:
+        rate = closes.get((services.fx_symbol(ccy, "EUR"), day)) or row["exchange_rate"]
+        if not rate:
+            if ccy not in current_rates:
+                current_rates[ccy] = services.get_conversion_rate(ccy, "EUR")
+            rate = current_rates[ccy]
+
+    fees = row["fees"] or 0.0
+    fields.update(price=price, exchange_rate=rate, fees=fees, total_value=(qty * price * rate) - fees * rate)
+    return fields, missing
+
+
+def _same_close(stored, close: float) -> bool:
+    return stored is not None and abs(float(stored) - close) <= 1e-9 * max(1.0, abs(close))
+
+
+def _changed(row, fields: dict) -> bool:
+    for key, value in fields.items():
+        old = row[key]
+        if isinstance(value, float):
+            if old is None or abs(float(old) - value) > 1e-9 * max(1.0, abs(value)):
+                return True
+        elif old != value:
+            return True
+    return False
+
+
+def derive_operation(db: Session, values: dict, fetch_missing: bool = True) -> dict:
+    """
+    Campi derivati di una singola operazione non ancora scritta ({colonna: valore},
+    es. i valori dopo una modifica), con le stesse regole di reprice_operations.
+    Vuoto per i tipi senza prezzo o senza simbolo/data. Non modifica operations, così
+    chi scrive la riga lo fa in un'unica transazione.
+    """
+    if values.get("operation_type") not in PRICED_TYPES or not values.get("asset_symbol") or not values.get("date"):
+        return {}
+    row = {**values, "symbol": values["asset_symbol"].upper()}
+    day = str(row["date"])[:10]
+    asset = asset_registry.get(db, row["symbol"])
+    ranges = {}
+    if row.get("price_manual") is None and _needs_market_price(row["symbol"], asset):
+        ranges[row["symbol"]] = (day, day)
+    ccy = _currency(row.get("purchase_currency"), asset)
+    if ccy != "EUR":
+        ranges[services.fx_symbol(ccy, "EUR")] = (day, day)
+    if fetch_missing and ranges:
+        fetch_missing_history(db, ranges)
+    closes = _lookup(price_store.load_history_arrays(db, ranges.keys()), [(key, day) for key in ranges])
+    fields, _ = _derive(row, asset, closes, {})
+    return fields
+
+
+def reprice_operations(
+    db: Session,
+    ids: Optional[Iterable[int]] = None,
+    portfolio_id: Optional[int] = None,
+    fetch_missing: bool = True,
+    notify: bool = True,
+) -> dict:
+    """
+    Ricalcola i campi derivati delle operazioni indicate (tutte se ids è None, filtrate
+    per portafoglio se dato). Ritorna i conteggi di righe lette, aggiornate, chiusure
+    scaricate e operazioni rimaste senza prezzo storico.
+    """
+    id_list = sorted(set(ids)) if ids is not None else None
+    where = _filter(id_list, portfolio_id)
+    params = {"ids": json.dumps(id_list) if id_list is not None else None, "portfolio_id": portfolio_id}
+
+    ranges = _plan(db, where, params)
+    fetched = fetch_missing_history(db, ranges) if fetch_missing and ranges else 0
+    histories = price_store.load_history_arrays(db, ranges.keys())
+
+    batch_sql = text(_BATCH.format(types=_TYPES_SQL, where=where))
+    current_rates: Dict[str, float] = {}
+    scanned = updated = missing = 0
+    symbols, portfolios = set(), set()
+    after = 0
+    while True:
+        rows = db.execute(batch_sql, {**params, "after": after, "limit": BATCH_SIZE}).mappings().all()
+        if not rows:
+            break
+        after = rows[-1]["id"]
+        scanned += len(rows)
+
+        pairs = []
+        for r in rows:
+            day = str(r["date"])[:10]
+            pairs.append((r["symbol"], day))
+            ccy = _currency(r["purchase_currency"], asset_registry.get(db, r["symbol"]))
+            if ccy != "EUR":
+                pairs.append((services.fx_symbol(ccy, "EUR"), day))
+        closes = _lookup(histories, pairs)
+
+        changes = []
+        for r in rows:
+            fields, no_price = _derive(r, asset_registry.get(db, r["symbol"]), closes, current_rates)
+            missing += no_price
+            if _changed(r, fields):
+                changes.append({"id": r["id"], **fields})
+                symbols.add(r["symbol"])
+                portfolios.add(r["portfolio_id"])
+        if changes:
+            db.execute(update(Operation), changes)
+            db.commit()
+            updated += len(changes)
+        logger.info("Reprice: %d operazioni lette, %d aggiornate", scanned, updated)
+
+    if updated:
+        ledger_cache.invalidate(*portfolios)
+        event_log.maybe_snapshot(db)
+        if notify:
+            alerts.on_operations_changed(db, symbols, *portfolios)
+    return {"operations": scanned, "updated": updated, "prices_fetched": fetched, "missing_prices": missing}
+
+
+def main(argv=None):
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Ricalcolo di prezzo, cambio e valore delle operazioni")
+    parser.add_argument("--ids", nargs="*", type=int, help="solo queste operazioni (default: tutte)")
+    parser.add_argument("--portfolio", type=int, help="solo le operazioni di questo portafoglio")
+    parser.add_argument("--no-fetch", action="store_true", help="usa solo lo storico già salvato")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    db = SessionLocal()
+    try:
+        result = reprice_operations(db, args.ids, args.portfolio, fetch_missing=not args.no_fetch)
+    finally:
+        db.close()
+    print(f"[OK] {result['operations']} operazioni, {result['updated']} aggiornate, "
+          f"{result['prices_fetched']} chiusure scaricate, {result['missing_prices']} senza prezzo storico")
+
+
+if __name__ == "__main__":
+    main()
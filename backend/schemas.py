@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict, field_validator
-from typing import List, Optional
+from typing import Any, List, Optional
 from datetime import date
 
 class OperationOut(BaseModel):
@@ -8,7 +8,7 @@ class OperationOut(BaseModel):
 
     id: int
     user: Optional[str]
-    date: Optional[str]  # manteniamo string per compatibilità con il backend attuale
+    date: Optional[date]
     operation_type: Optional[str]
     quantity: Optional[float]
     asset_symbol: Optional[str]
@@ -26,6 +26,7 @@ class OperationOut(BaseModel):
     total_value: Optional[float]
     fees: Optional[float]
     dividend_value: Optional[float]
+    portfolio_id: Optional[int] = None
 
     # Normalizza stringhe vuote/NaN e converte string->float per i campi numerici
     @field_validator(
@@ -92,6 +93,12 @@ class PortfolioOut(BaseModel):
     shared: Optional[bool]
 
 
+class PortfolioCreate(BaseModel):
+    name: str
+    owner_id: Optional[int] = None
+    shared: bool = False
+
+
 class CashflowOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
     id: int
@@ -99,11 +106,23 @@ class CashflowOut(BaseModel):
     type: str
     category: str
     description: Optional[str]
-    date: str
+    date: date
     amount: float
     recurring: bool
     recurrence_months: Optional[int]
-    end_date: Optional[str]
+    end_date: Optional[date]
+
+
+class CashflowIn(BaseModel):
+    user: str
+    type: str            # "Entrata" / "Uscita" (o importo con segno)
+    category: str
+    description: Optional[str] = None
+    date: date           # "YYYY-MM-DD", prima occorrenza
+    amount: float
+    recurring: bool = False
+    recurrence_months: Optional[int] = None  # ogni quanti mesi (default 1 se ricorrente)
+    end_date: Optional[date] = None
 
 
 class SettingOut(BaseModel):
@@ -127,18 +146,19 @@ class WalletBase(BaseModel):
 
 
 class WalletCreate(WalletBase):
-    pass
+    portfolio_id: Optional[int] = None
 
 
 class WalletOut(WalletBase):  # mantenuta per compatibilità con import esistenti
     id: int
+    portfolio_id: Optional[int] = None
 
     class Config:
         orm_mode = True
 
 
 class OperationIn(BaseModel):
-    date: str                       # "YYYY-MM-DD"
+    date: date                      # "YYYY-MM-DD"
     operation_type: str             # es. "Acquisto", "Vendita", "Dividendo", ...
     asset_symbol: str               # es. "ACN", "BTC-USD", "EUR", "USD"
     quantity: float                 # positiva (segno gestito dal backend)
@@ -150,6 +170,7 @@ class OperationIn(BaseModel):
     purchase_currency: Optional[str] = None # default = currency da AssetInfo o "EUR"
     fees: Optional[float] = 0.0
     comment: Optional[str] = None
+    portfolio_id: Optional[int] = None      # default = portafoglio del wallet
 
 
 # --- Asset schemas ---
@@ -174,6 +195,10 @@ class AssetOut(AssetBase):  # mantenuta per compatibilità con import esistenti
         orm_mode = True
 
 
+class AssetSearchResponse(BaseModel):
+    total: int                      # corrispondenze prima della paginazione
+    items: List[AssetOut]
+
 class AssetGuessOut(BaseModel):
     symbol: str
     name: str | None = None
@@ -219,4 +244,105 @@ class AssetByWalletResponse(BaseModel):
     price_used: float
     total_qty: float
     total_value: float
-    breakdown: List[AssetWalletBreakdownItem]
\ No newline at end of file
+    breakdown: List[AssetWalletBreakdownItem]
+
+class OperationEventOut(BaseModel):
+    event_id: int
+    kind: str                       # "insert" | "update" | "delete"
+    recorded_at: Optional[str]
+    before: Optional[dict] = None
+    after: Optional[dict] = None
+
+class LedgerHolding(BaseModel):
+    portfolio_id: Optional[int]
+    symbol: str
+    wallet_id: int
+    quantity: float
+
+class LedgerCostBasis(BaseModel):
+    portfolio_id: Optional[int]
+    symbol: str
+    quantity: float
+    cost: float
+    average_price: float
+
+class LedgerStateOut(BaseModel):
+    event_id: int                   # ultimo evento incluso
+    snapshot_event_id: int          # snapshot di partenza
+    replayed_events: int
+    holdings: List[LedgerHolding]
+    cost_basis: List[LedgerCostBasis]
+
+class RepriceRequest(BaseModel):
+    ids: Optional[List[int]] = None         # default: tutte le operazioni
+    portfolio_id: Optional[int] = None
+    fetch_missing: bool = True              # scarica lo storico mancante prima del ricalcolo
+
+class RepriceResult(BaseModel):
+    operations: int
+    updated: int
+    prices_fetched: int
+    missing_prices: int
+
+class BatchRequestItem(BaseModel):
+    method: str = "GET"
+    path: str                       # es. "/assets/STK1/delta?portfolio_id=1"
+
+class BatchRequest(BaseModel):
+    requests: List[BatchRequestItem]
+
+class BatchResultItem(BaseModel):
+    path: str
+    status: int
+    body: Any = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchResultItem]
+
+class PerformanceItem(BaseModel):
+    key: str
+    start_value: float
+    end_value: float
+    net_flows: float
+    twr: float
+    twr_annualized: Optional[float] = None
+    xirr: Optional[float] = None
+
+class PerformanceResponse(BaseModel):
+    start: Optional[str] = None
+    end: Optional[str] = None
+    group_by: str
+    base_currency: str = "EUR"
+    items: List[PerformanceItem]
+
+
+class AlertRuleIn(BaseModel):
+    kind: str                       # "position_value" | "drawdown" | "category_drift"
+    user: Optional[str] = None
+    portfolio_id: Optional[int] = None
+    symbol: Optional[str] = None    # per position_value / drawdown
+    category: Optional[str] = None  # per category_drift
+    direction: str = "above"        # position_value: "above" | "below"
+    threshold: Optional[float] = None       # default = Setting.alert_threshold
+    target_weight: Optional[float] = None   # category_drift: peso obiettivo (0-1)
+    active: bool = True
+
+
+class AlertRuleOut(AlertRuleIn):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    triggered: Optional[bool] = False
+
+
+class AlertEventOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    rule_id: Optional[int]
+    kind: Optional[str]
+    symbol: Optional[str]
+    category: Optional[str]
+    value: Optional[float]
+    threshold: Optional[float]
+    message: Optional[str]
+    created_at: Optional[str]
+    acknowledged: Optional[bool]
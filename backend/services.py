@@ -1,10 +1,33 @@
 # backend/services.py
-import yfinance as yf
-import requests
+# yfinance (che porta con sé pandas) e requests vengono importati al primo dato di
+# mercato richiesto, non all'avvio dell'applicazione.
+# Prezzi correnti e cambi passano dalla cache condivisa tra i worker (market_cache).
+# Con BUGETTO_MARKET_STUB=1 i dati arrivano da market_stub, senza rete.
+from . import market_cache, market_stub
+
+PRICE_TTL_SECONDS = 30
+FX_TTL_SECONDS = 60 * 60
+
+_yfinance = None
+
+
+def _yf():
+    global _yfinance
+    if _yfinance is None:
+        import yfinance
+        _yfinance = yfinance
+    return _yfinance
+
 
 def get_current_price(symbol: str) -> float:
+    return market_cache.cached(f"price:{symbol.upper()}", PRICE_TTL_SECONDS, lambda: _fetch_current_price(symbol))
+
+
+def _fetch_current_price(symbol: str) -> float:
+    if market_stub.enabled():
+        return market_stub.price(symbol)
     try:
-        ticker = yf.Ticker(symbol.upper())
+        ticker = _yf().Ticker(symbol.upper())
         data = ticker.history(period="1d")
         if data.empty:
             return 0
@@ -17,12 +40,17 @@ def get_exchange_rate(base_currency: str, quote_currency: str) -> float:
     Ritorna il tasso di cambio da base_currency → quote_currency (es. USD → EUR).
     Usa Yahoo Finance (es. USDEUR=X)
     """
+    if base_currency.upper() == quote_currency.upper():
+        return 1.0
+    pair = fx_symbol(base_currency, quote_currency)
+    return market_cache.cached(f"price:{pair}", FX_TTL_SECONDS, lambda: _fetch_exchange_rate(pair))
+
+
+def _fetch_exchange_rate(pair: str) -> float:
+    if market_stub.enabled():
+        return market_stub.price(pair)
     try:
-        if base_currency.upper() == quote_currency.upper():
-            return 1.0
-        
-        pair = f"{base_currency.upper()}{quote_currency.upper()}=X"
-        ticker = yf.Ticker(pair)
+        ticker = _yf().Ticker(pair)
         data = ticker.history(period="1d")
         
         if data.empty:
@@ -31,34 +59,38 @@ def get_exchange_rate(base_currency: str, quote_currency: str) -> float:
     except Exception:
         return 0
 
-conversion_cache = {}
-
 def get_conversion_rate(from_currency: str, to_currency: str = "EUR") -> float:
     if from_currency.upper() == to_currency.upper():
         return 1.0
 
-    key = (from_currency.upper(), to_currency.upper())
-    if key in conversion_cache:
-        return conversion_cache[key]
+    key = f"fx:{from_currency.upper()}:{to_currency.upper()}"
+    rate = market_cache.cached(key, FX_TTL_SECONDS, lambda: _fetch_conversion_rate(from_currency, to_currency))
+    return rate or 1.0  # fallback
 
+
+def _fetch_conversion_rate(from_currency: str, to_currency: str) -> float:
+    if market_stub.enabled():
+        return market_stub.rate(from_currency, to_currency)
     try:
+        import requests
+
         url = f"https://api.frankfurter.app/latest?from={from_currency.upper()}&to={to_currency.upper()}"
         response = requests.get(url)
         data = response.json()
-        rate = data["rates"][to_currency.upper()]
-        conversion_cache[key] = rate  # salva nel cache
-        return rate
+        return data["rates"][to_currency.upper()]
     except Exception as e:
         print(f"Errore cambio {from_currency}→{to_currency}:", e)
-        return 1.0  # fallback
+        return 0
 
 
 def get_day_prices(symbol: str):
     """
     Ritorna (close, high, low) del giorno per il simbolo dato.
     """
+    if market_stub.enabled():
+        return market_stub.day_prices(symbol)
     try:
-        t = yf.Ticker(symbol.upper())
+        t = _yf().Ticker(symbol.upper())
         data = t.history(period="1d")
         if data.empty:
             return (0.0, 0.0, 0.0)
@@ -68,9 +100,48 @@ def get_day_prices(symbol: str):
     except Exception:
         return (0.0, 0.0, 0.0)
 
+def normalize_currency(currency: str | None, default: str = "EUR") -> str:
+    """
+    Normalizza i codici valuta salvati in asset_info (es. "Euro ", "usd").
+    """
+    ccy = (currency or "").strip().upper()
+    if not ccy:
+        return default
+    if ccy == "EURO":
+        return "EUR"
+    return ccy
+
+
+def fx_symbol(from_currency: str, to_currency: str = "EUR") -> str:
+    """
+    Simbolo Yahoo Finance della coppia di cambio (es. USD, EUR -> "USDEUR=X").
+    Usato anche come chiave dei cambi nello storico prezzi.
+    """
+    return f"{from_currency.upper()}{to_currency.upper()}=X"
+
+
+def get_price_history(symbol: str, start: str, end: str | None = None):
+    """
+    Ritorna la lista [(YYYY-MM-DD, close), ...] delle chiusure giornaliere
+    del simbolo tra start (incluso) ed end (escluso, default oggi).
+    """
+    if market_stub.enabled():
+        return market_stub.history(symbol, start, end)
+    try:
+        t = _yf().Ticker(symbol.upper())
+        data = t.history(start=start, end=end, auto_adjust=False)
+        if data.empty:
+            return []
+        closes = data["Close"].dropna()
+        return list(zip(closes.index.strftime("%Y-%m-%d"), closes.astype(float).tolist()))
+    except Exception:
+        return []
+
 def guess_asset_metadata(symbol: str):
+    if market_stub.enabled():
+        return market_stub.metadata(symbol)
     try:
-        t = yf.Ticker(symbol.upper())
+        t = _yf().Ticker(symbol.upper())
         info = t.fast_info if hasattr(t, "fast_info") else None
         name = getattr(t, "info", {}).get("shortName") if hasattr(t, "info") else None
         currency = getattr(info, "currency", None) if info else None
@@ -0,0 +1,200 @@
+# backend/sql_budget.py
+"""
+Conteggio e impronta delle query SQL per richiesta, con un budget per endpoint.
+
+Un listener before_cursor_execute sull'engine registra ogni statement nel log attivo
+(ContextVar: una richiesta, o un blocco `with capture()`). L'impronta normalizza
+letterali e liste IN, così le query ripetute con parametri diversi (il classico N+1
+in un ciclo per simbolo) risultano uguali e report() le segnala.
+
+Con BUGETTO_SQL_TRACE=1, install() aggiunge all'app un middleware che mette il numero
+di statement nell'header X-SQL-Statements e scrive un warning quando un endpoint
+supera il budget di BUDGETS o ripete la stessa query almeno REPEAT_THRESHOLD volte.
+benchmarks/sql_budget.py verifica i budget sulla fixture sintetica.
+"""
+import logging
+import os
+import re
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+REPEAT_THRESHOLD = 5
+
+# statement massimi per richiesta a cache fredde, per (metodo, percorso della route);
+# current-price e convert ne usano solo con as_of (storico locale). Le route di
+# valorizzazione async contano anche la funzione needs di aio (valuta base, ledger e
+# registro asset se non in cache) per i dati di mercato da leggere in anticipo. Ogni sessione
+# che usa le cache in memoria legge una volta le generazioni condivise (generations.py):
+# una query in più, due per le route async (una sessione per fase)
+BUDGETS: Dict[Tuple[str, str], int] = {
+    ("GET", "/portfolios"): 1,
+    ("GET", "/operations/"): 1,
+    ("GET", "/wallets/"): 1,
+    ("GET", "/wallets"): 1,
+    ("GET", "/assets/"): 1,
+    ("GET", "/assets/visible"): 1,
+    ("GET", "/assets/search"): 2,
+    ("GET", "/assets/guess"): 4,
+    ("GET", "/dashboard/summary"): 5,
+    ("GET", "/dashboard/allocation/assets"): 2,
+    ("GET", "/dashboard/allocation/categories"): 2,
+    ("GET", "/dashboard/allocation/categories-group"): 4,
+    ("GET", "/dashboard/allocation/categories-history"): 4,
+    ("GET", "/assets/{symbol}/average-price"): 3,
+    ("GET", "/assets/{symbol}/wallet/{wallet_id}/quantity"): 2,
+    ("GET", "/assets/{symbol}/delta"): 5,
+    ("GET", "/assets/{symbol}/current-price"): 2,
+    ("GET", "/assets/{symbol}/total-quantity"): 2,
+    ("GET", "/assets/{symbol}/dividends"): 1,
+    ("GET", "/assets/{symbol}/last-purchase-meta"): 1,
+    ("GET", "/assets/{symbol}/by-wallet"): 5,
+    ("GET", "/assets/by-wallet"): 8,
+    ("GET", "/convert"): 2,
+    ("GET", "/wallets/summary"): 8,
+    ("GET", "/performance"): 6,
+    ("GET", "/performance/series"): 6,
+    ("GET", "/cashflow"): 1,
+    ("GET", "/cashflow/projection"): 3,
+    ("GET", "/alerts"): 1,
+    ("GET", "/alerts/rules"): 1,
+    ("POST", "/operations/preview"): 4,
+    ("GET", "/operations/{op_id}/events"): 1,
+    ("GET", "/ledger/state"): 3,
+    ("GET", "/operations/export"): 1,
+    # somma delle sotto-richieste (capture annidato)
+    ("POST", "/batch"): 10,
+    # lo stream non esegue query: le legge il ciclo di aggiornamento condiviso da tutti i client
+    ("GET", "/stream/prices"): 0,
+    # scritture: la riga, l'evento e lo snapshot del log, le cache invalidate e gli alert
+    # ricontrollati sui simboli toccati; PUT e reprice scaricano anche lo storico mancante
+    ("POST", "/portfolios"): 2,
+    ("POST", "/wallets"): 3,
+    ("POST", "/assets"): 3,
+    ("DELETE", "/assets/{asset_id}"): 2,
+    ("POST", "/operations/"): 17,
+    ("PUT", "/operations/{op_id}"): 17,
+    ("POST", "/operations/{op_id}/duplicate"): 11,
+    ("DELETE", "/operations/{op_id}"): 10,
+    ("POST", "/operations/reprice"): 17,
+    ("POST", "/ledger/snapshots"): 4,
+    ("POST", "/prices/sync"): 10,
+    ("POST", "/cashflow"): 2,
+    ("DELETE", "/cashflow/{cashflow_id}"): 2,
+    ("POST", "/alerts/rules"): 15,
+    ("POST", "/alerts/evaluate"): 8,
+    ("POST", "/alerts/{event_id}/ack"): 3,
+    ("DELETE", "/alerts/rules/{rule_id}"): 2,
+}
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*(?:\?\s*,\s*)+\?\s*\)"), "(?...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def fingerprint(statement: str) -> str:
+    """Statement con letterali e liste di parametri ridotti a segnaposto."""
+    text = statement
+    for pattern, replacement in _LITERALS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+class StatementLog:
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.statements: List[str] = []
+
+    def add(self, statement: str) -> None:
+        self.statements.append(statement)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def fingerprints(self) -> Counter:
+        return Counter(fingerprint(s) for s in self.statements)
+
+    def repeated(self, threshold: int = REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        """Impronte eseguite almeno threshold volte (probabile N+1), dalla più frequente."""
+        return [(fp, n) for fp, n in self.fingerprints().most_common() if n >= threshold]
+
+    def report(self, budget: Optional[int] = None, threshold: int = REPEAT_THRESHOLD) -> str:
+        head = f"{self.label}: {self.count} statement"
+        if budget is not None:
+            head += f" (budget {budget}{', SUPERATO' if self.count > budget else ''})"
+        lines = [head]
+        for fp, n in self.repeated(threshold):
+            lines.append(f"  N+1? {n}x {fp[:160]}")
+        return "\n".join(lines)
+
+
+_current: ContextVar[Optional[StatementLog]] = ContextVar("sql_statement_log", default=None)
+# ultimi log delle richieste tracciate dal middleware (per report e verifiche)
+recent: Deque[StatementLog] = deque(maxlen=100)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    log = _current.get()
+    if log is not None:
+        log.add(statement)
+
+
+def instrument(engine: Engine) -> None:
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+
+
+@contextmanager
+def capture(label: str = "") -> Iterator[StatementLog]:
+    """
+    Registra gli statement eseguiti nel blocco (e nei thread che ne copiano il contesto).
+    Un blocco annidato (le sotto-richieste di /batch) li conta anche nel log esterno.
+    """
+    outer = _current.get()
+    log = StatementLog(label)
+    token = _current.set(log)
+    try:
+        yield log
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.statements.extend(log.statements)
+
+
+def budget_for(method: str, route_path: str) -> Optional[int]:
+    return BUDGETS.get((method.upper(), route_path))
+
+
+def enabled() -> bool:
+    return os.environ.get("BUGETTO_SQL_TRACE", "") not in ("", "0")
+
+
+def install(app, engine: Engine) -> None:
+    """Middleware di conteggio per richiesta, attivo solo con BUGETTO_SQL_TRACE=1."""
+    if not enabled():
+        return
+    instrument(engine)
+
+    @app.middleware("http")
+    async def sql_statement_budget(request, call_next):
+        with capture(f"{request.method} {request.url.path}") as log:
+            response = await call_next(request)
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", request.url.path)
+        log.label = f"{request.method} {route_path}"
+        budget = budget_for(request.method, route_path)
+        response.headers["X-SQL-Statements"] = str(log.count)
+        recent.append(log)
+        if (budget is not None and log.count > budget) or log.repeated():
+            logger.warning(log.report(budget))
+        return response
@@ -0,0 +1,114 @@
+# benchmarks/analytics.py
+"""
+Confronto tra le aggregazioni sul ledger NumPy in cache e quelle DuckDB (backend/analytics.py).
+
+Crea la fixture sintetica del load test in una cartella temporanea e misura, per
+ogni percorso, la prima chiamata (ledger caricato da SQLite / tabella ops copiata in
+DuckDB) e le chiamate successive a cache calda, per monthly_deltas (allocazione
+storica per categoria) e positions (allocazione per gruppo), su tutto lo storico e
+con un limite di data. Verifica anche che i due percorsi diano gli stessi numeri
+e che le misure "duckdb" vengano davvero da DuckDB (non dal ripiego su NumPy).
+Senza duckdb installato misura solo il percorso NumPy.
+
+Uso:
+    python benchmarks/analytics.py
+    python benchmarks/analytics.py --operations 2000000 --years 20 --repeat 5
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOLERANCE = 1e-6
+
+
+def _timed(fn, repeat):
+    """(secondi della prima chiamata, mediana delle successive, risultato)."""
+    t0 = time.perf_counter()
+    result = fn()
+    cold = time.perf_counter() - t0
+    warm = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        warm.append(time.perf_counter() - t0)
+    return cold, statistics.median(warm) if warm else 0.0, result
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    return abs(a - b) <= TOLERANCE * max(1.0, abs(a))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregazioni sul ledger: NumPy in cache contro DuckDB")
+    parser.add_argument("--assets", type=int, default=200)
+    parser.add_argument("--operations", type=int, default=200000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        sys.path.insert(0, ROOT)
+        from load_test import build_fixture
+        from backend import analytics, crud, ledger_cache
+        from backend.database import SessionLocal
+
+        t0 = time.perf_counter()
+        build_fixture(args.assets, args.operations, args.years)
+        print(f"fixture: {args.operations} operazioni in {time.perf_counter() - t0:.1f}s")
+
+        types = crud.POSITIVE_TYPES | crud.NEGATIVE_TYPES
+        until = date.today() - timedelta(days=365 * args.years // 2)
+        cases = [
+            ("monthly_deltas", lambda db: analytics.monthly_deltas(db, None, types)),
+            ("monthly_deltas fino a metà", lambda db: analytics.monthly_deltas(db, None, types, until)),
+            ("positions", lambda db: analytics.positions(db, None, types)),
+            ("positions fino a metà", lambda db: analytics.positions(db, None, types, until)),
+        ]
+        paths = [("numpy", "")]
+        if analytics.duckdb is not None:
+            paths.append(("duckdb", "duckdb"))
+        else:
+            print("duckdb non installato: misuro solo il ledger NumPy")
+
+        db = SessionLocal()
+        failures = []
+        try:
+            print(f"{'aggregazione':28} {'percorso':>8} {'prima':>9} {'calda':>9}")
+            for name, fn in cases:
+                results = {}
+                for label, env in paths:
+                    os.environ["BUGETTO_ANALYTICS"] = env
+                    # prima chiamata come dopo una scrittura: ledger e tabella ops da ricaricare
+                    ledger_cache.invalidate()
+                    cold, warm, results[label] = _timed(lambda: fn(db), args.repeat)
+                    if env and (analytics._conn is None or not analytics.enabled()):
+                        print(f"\nFAIL: DuckDB non attivo per {name}: i tempi sarebbero quelli del ledger NumPy")
+                        return 1
+                    print(f"{name:28} {label:>8} {cold * 1000:8.1f}ms {warm * 1000:8.1f}ms")
+                if "duckdb" in results and not _same(results["numpy"], results["duckdb"]):
+                    failures.append(name)
+        finally:
+            db.close()
+            os.environ.pop("BUGETTO_ANALYTICS", None)
+            os.chdir(ROOT)
+
+    if failures:
+        print("\nFAIL: risultati diversi tra NumPy e DuckDB per " + ", ".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+# benchmarks/load_test.py
+"""
+Load test che riproduce le sequenze di chiamate delle pagine React.
+
+Ogni utente virtuale apre a caso una pagina (pesi in PAGES) e ne ripete le chiamate
+come fa il frontend, comprese le parti in parallelo (Promise.all, più componenti
+montati insieme) e quelle in sequenza (il for/await di AssetTable), poi attende un
+tempo di riflessione e ricomincia:
+
+  dashboard   Dashboard.tsx: summary, asset liquidi (visible → /batch con total-quantity
+              e convert per asset), AssetTable (visible/ → delta per asset, in sequenza, poi
+              l'espansione di una riga → /assets/by-wallet), CategoryAllocationChart e
+              CategoryHistoryChart
+  new-op      OperationForm.tsx: wallets, ricerca asset del picker, last-purchase-meta e preview
+  manage-ops  OperationsManagePage.tsx: wallets e operations; con --write-ratio anche
+              duplicate seguito da delete della copia (il ledger resta invariato)
+
+Senza --url l'app gira in questo processo su un database sintetico creato in una
+cartella temporanea, con i dati di mercato stub (BUGETTO_MARKET_STUB=1). Con --url si
+misura un server già avviato, che deve girare con BUGETTO_MARKET_STUB=1 per non
+chiamare Yahoo Finance.
+
+Uso:
+    python benchmarks/load_test.py                          # 10 utenti per 30 s
+    python benchmarks/load_test.py --users 50 --duration 60 --assets 120 --operations 20000
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --users 20
+    python benchmarks/load_test.py --max-p95-ms 500 --max-error-rate 0.01 --json out.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, route: str, ms: float, ok: bool) -> None:
+        self.latencies[route].append(ms)
+        if not ok:
+            self.errors[route] += 1
+
+    def rows(self, elapsed: float) -> list:
+        rows = []
+        for route in sorted(self.latencies):
+            ms = np.array(self.latencies[route])
+            p50, p90, p95, p99 = np.percentile(ms, [50, 90, 95, 99])
+            rows.append({
+                "route": route,
+                "count": len(ms),
+                "errors": self.errors[route],
+                "error_rate": self.errors[route] / len(ms),
+                "rps": len(ms) / elapsed,
+                "p50_ms": p50, "p90_ms": p90, "p95_ms": p95, "p99_ms": p99, "max_ms": float(ms.max()),
+            })
+        return rows
+
+
+class VirtualUser:
+    def __init__(self, client, stats: Stats, rnd: random.Random, write_ratio: float):
+        self.client = client
+        self.stats = stats
+        self.rnd = rnd
+        self.write_ratio = write_ratio
+
+    async def call(self, method: str, path: str, route: str, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            ok = response.status_code < 400
+            data = response.json() if ok and response.content else None
+        except Exception:
+            ok, data = False, None
+        self.stats.add(route, (time.perf_counter() - t0) * 1000, ok)
+        return data
+
+    def get(self, path: str, route: str = None):
+        return self.call("GET", path, route or path)
+
+    # --- pagine ---
+
+    async def dashboard(self):
+        async def liquidity():
+            assets = await self.get("/assets/visible") or []
+            liquid = [a for a in assets if a.get("visible") and a.get("type") == "Liquidi"]
+
+            paths = []
+            for asset in liquid:
+                paths.append(f"/assets/{asset['symbol']}/total-quantity")
+                if asset["symbol"] != "EUR":
+                    paths.append(f"/convert?from={asset['symbol']}&to=EUR")
+            if paths:
+                await self.call("POST", "/batch", "/batch", json={"requests": [{"path": p} for p in paths]})
+
+        async def asset_table():
+            assets = await self.get("/assets/visible/") or []
+            held = []
+            for asset in assets:
+                if asset.get("visible") and asset.get("type") != "Liquidi":
+                    data = await self.get(f"/assets/{asset['symbol']}/delta", "/assets/{symbol}/delta")
+                    if data and data.get("quantity", 0) > 0:
+                        held.append(asset["symbol"])
+            if held:
+                # la prima riga espansa carica il breakdown di tutti gli asset
+                await self.get("/assets/by-wallet")
+
+        await asyncio.gather(
+            self.get("/dashboard/summary"),
+            liquidity(),
+            asset_table(),
+            self.get("/dashboard/allocation/categories-group"),
+            self.get("/dashboard/allocation/categories-history"),
+        )
+
+    async def new_operation(self):
+        # picker: primi risultati all'apertura, poi la ricerca per il testo digitato
+        search = "/assets/search?limit=50&visible=true"
+        wallets, found = await asyncio.gather(self.get("/wallets"), self.get(search, "/assets/search"))
+        typed = await self.get(f"{search}&q=stk{self.rnd.randrange(10)}", "/assets/search")
+        assets = (typed or found or {}).get("items") or []
+        if not wallets or not assets:
+            return
+        symbol = self.rnd.choice(assets)["symbol"]
+        await self.get(f"/assets/{symbol}/last-purchase-meta", "/assets/{symbol}/last-purchase-meta")
+        payload = {
+            "date": date.today().isoformat(),
+            "operation_type": "Acquisto",
+            "asset_symbol": symbol,
+            "quantity": round(self.rnd.uniform(1, 10), 4),
+            "wallet_id": self.rnd.choice(wallets)["id"],
+        }
+        await self.call("POST", "/operations/preview", "/operations/preview", json=payload)
+
+    async def manage_operations(self):
+        _, operations = await asyncio.gather(self.get("/wallets"), self.get("/operations"))
+        if operations and self.rnd.random() < self.write_ratio:
+            op_id = self.rnd.choice(operations)["id"]
+            copy = await self.call("POST", f"/operations/{op_id}/duplicate", "/operations/{op_id}/duplicate")
+            if copy and copy.get("id"):
+                await self.call("DELETE", f"/operations/{copy['id']}", "/operations/{op_id}")
+
+    async def run(self, pages, weights, deadline: float, think_ms: float):
+        while time.perf_counter() < deadline:
+            name, page = self.rnd.choices(pages, weights)[0]
+            t0 = time.perf_counter()
+            await page(self)
+            self.stats.add(f"[page] {name}", (time.perf_counter() - t0) * 1000, True)
+            if think_ms:
+                await asyncio.sleep(self.rnd.expovariate(1000.0 / think_ms))
+
+
+PAGES = [
+    ("dashboard", VirtualUser.dashboard, 6),
+    ("new-op", VirtualUser.new_operation, 2),
+    ("manage-ops", VirtualUser.manage_operations, 2),
+]
+
+
+def build_fixture(n_assets: int, n_operations: int, years: int, seed: int = 1) -> None:
+    """Database sintetico in ./bugetto.db (cartella corrente): wallet, asset, operazioni."""
+    from sqlalchemy import insert
+    from backend import market_stub, models
+    from backend.database import SessionLocal, engine
+    from backend.migrations import migrate
+
+    migrate(engine)
+    rnd = random.Random(seed)
+    db = SessionLocal()
+    try:
+        db.execute(insert(models.Wallet), [{"id": i, "name": f"Wallet {i}"} for i in range(1, 6)])
+        assets = [
+            {
+                "symbol": f"STK{i}", "name": f"Asset {i}", "currency": "USD" if i % 3 == 0 else "EUR",
+                "type": "ETF" if i % 2 else "Azione", "category": f"Categoria {i % 5}", "visible": True,
+            }
+            for i in range(n_assets)
+        ]
+        # titoli senza quotazione con lo stub: valorizzati con l'ultimo prezzo delle operazioni
+        assets += [
+            {
+                "symbol": f"{market_stub.DELISTED_PREFIX}{i}", "name": f"Delisted {i}", "currency": "USD" if i % 2 else "EUR",
+                "type": "Azione", "category": f"Categoria {i % 5}", "visible": True,
+            }
+            for i in range(max(n_assets // 10, 1))
+        ]
+        assets += [
+            {"symbol": ccy, "name": ccy, "currency": ccy, "type": "Liquidi", "category": "Liquidità", "visible": True}
+            for ccy in ("EUR", "USD")
+        ]
+        db.execute(insert(models.AssetInfo), assets)
+
+        start = date.today() - timedelta(days=365 * years)
+        operations = []
+        for _ in range(n_operations):
+            asset = rnd.choice(assets)
+            liquid = asset["type"] == "Liquidi"
+            op_type = "Saving" if liquid else rnd.choice(["Acquisto", "Acquisto", "Acquisto", "Vendita", "Dividendo"])
+            qty = rnd.uniform(1, 10) * (-1 if op_type == "Vendita" else 1) if op_type != "Dividendo" else 0.0
+            price = 1.0 if liquid else rnd.uniform(20, 400)
+            rate = 0.92 if asset["currency"] == "USD" else 1.0
+            operations.append({
+                "date": start + timedelta(days=rnd.randrange(365 * years)),
+                "operation_type": op_type, "asset_symbol": asset["symbol"], "quantity": qty,
+                "wallet_id": rnd.randrange(1, 6), "accounting": True, "price": price,
+                "purchase_currency": asset["currency"], "exchange_rate": rate,
+                "total_value": qty * price * rate if op_type != "Dividendo" else rnd.uniform(5, 50), "fees": 0.0,
+            })
+        db.execute(insert(models.Operation), operations)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _client(url):
+    import httpx
+
+    if url:
+        return httpx.AsyncClient(base_url=url, follow_redirects=True, timeout=60.0)
+    from backend.main import app
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://loadtest", follow_redirects=True, timeout=60.0)
+
+
+async def run(args) -> tuple:
+    stats = Stats()
+    pages = [(name, page) for name, page, _ in PAGES]
+    weights = [w for _, _, w in PAGES]
+    async with _client(args.url) as client:
+        t0 = time.perf_counter()
+        deadline = t0 + args.duration
+        users = []
+        for i in range(args.users):
+            user = VirtualUser(client, stats, random.Random(args.seed + i), args.write_ratio)
+            users.append(asyncio.create_task(user.run(pages, weights, deadline, args.think_ms)))
+            if args.ramp_up:
+                await asyncio.sleep(args.ramp_up / args.users)
+        await asyncio.gather(*users)
+        return stats, time.perf_counter() - t0
+
+
+def report(rows: list, elapsed: float) -> None:
+    header = f"{'route':48} {'n':>7} {'err%':>6} {'rps':>7} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['route'][:48]:48} {r['count']:7d} {r['error_rate'] * 100:6.2f} {r['rps']:7.1f} "
+            f"{r['p50_ms']:8.1f} {r['p90_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f} {r['max_ms']:8.1f}"
+        )
+    requests = [r for r in rows if not r["route"].startswith("[page]")]
+    total = sum(r["count"] for r in requests)
+    errors = sum(r["errors"] for r in requests)
+    print(f"\n{total} richieste in {elapsed:.1f} s: {total / elapsed:.1f} req/s, errori {errors} ({errors / max(total, 1) * 100:.2f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test con le sequenze di chiamate del frontend")
+    parser.add_argument("--url", help="server già avviato (default: app in processo su fixture sintetica)")
+    parser.add_argument("--users", type=int, default=10, help="utenti virtuali concorrenti")
+    parser.add_argument("--duration", type=float, default=30.0, help="secondi di test")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="secondi per avviare tutti gli utenti")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="pausa media tra due pagine (0 = nessuna)")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="probabilità di duplicate+delete in manage-ops")
+    parser.add_argument("--assets", type=int, default=40, help="asset della fixture")
+    parser.add_argument("--operations", type=int, default=5000, help="operazioni della fixture")
+    parser.add_argument("--years", type=int, default=5, help="anni di storico della fixture")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="salva i risultati per route in questo file")
+    parser.add_argument("--max-p95-ms", type=float, help="exit code 1 se una route supera questo p95")
+    parser.add_argument("--max-error-rate", type=float, help="exit code 1 se il tasso di errori totale lo supera")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as cwd:
+        if not args.url:
+            # il database (./bugetto.db) e la cache prezzi vivono nella cartella temporanea
+            os.environ["BUGETTO_MARKET_STUB"] = "1"
+            # i log di warning per asset dell'app costerebbero più delle richieste
+            logging.disable(logging.WARNING)
+            os.chdir(cwd)
+            sys.path.insert(0, ROOT)
+            build_fixture(args.assets, args.operations, args.years, args.seed)
+        stats, elapsed = asyncio.run(run(args))
+        os.chdir(ROOT)
+
+    rows = stats.rows(elapsed)
+    report(rows, elapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"elapsed_s": elapsed, "users": args.users, "routes": rows}, f, indent=2)
+
+    failed = False
+    requests = [r for r in rows if not r["route"].startswith("[page]")]
+    if args.max_p95_ms is not None:
+        slow = [r["route"] for r in requests if r["p95_ms"] > args.max_p95_ms]
+        if slow:
+            print(f"FAIL: p95 oltre {args.max_p95_ms:.0f} ms: {', '.join(slow)}")
+            failed = True
+    if args.max_error_rate is not None:
+        total = sum(r["count"] for r in requests)
+        rate = sum(r["errors"] for r in requests) / max(total, 1)
+        if rate > args.max_error_rate:
+            print(f"FAIL: tasso di errori {rate:.2%} oltre {args.max_error_rate:.2%}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# benchmarks/sql_budget.py
+"""
+Verifica dei budget di query SQL per endpoint (backend/sql_budget.BUDGETS).
+
+Crea la fixture sintetica del load test in una cartella temporanea, avvia l'app con
+BUGETTO_SQL_TRACE=1 e dati di mercato stub, chiama ogni endpoint di lettura due volte:
+a cache in memoria svuotate (ledger, registro asset, storico prezzi, alert: il caso
+dopo una scrittura) e a cache calde; le scritture una volta sola, a cache fredde. Il
+budget vale per la chiamata a cache fredde. Le query ripetute almeno REPEAT_THRESHOLD
+volte nella stessa richiesta vengono mostrate come probabili N+1. Exit code 1 se un
+endpoint supera il budget, ripete una query, non ha un budget dichiarato o se una
+route dell'app non ha una richiesta in REQUESTS.
+
+Uso:
+    python benchmarks/sql_budget.py
+    python benchmarks/sql_budget.py --assets 200 --operations 20000 --verbose
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+OPERATION = {"date": "2024-01-02", "operation_type": "Acquisto", "asset_symbol": "STK1", "quantity": 1, "wallet_id": 1}
+
+# (metodo, url, corpo JSON): almeno una richiesta per ogni route dell'app
+REQUESTS = [
+    ("GET", "/portfolios", None),
+    ("GET", "/operations/", None),
+    ("GET", "/wallets/", None),
+    ("GET", "/wallets", None),
+    ("GET", "/assets/", None),
+    ("GET", "/assets/visible", None),
+    ("GET", "/assets/search?q=stk1&limit=20", None),
+    ("GET", "/assets/guess?symbol=NEWSYM", None),
+    ("GET", "/dashboard/summary", None),
+    ("GET", "/dashboard/allocation/assets", None),
+    ("GET", "/dashboard/allocation/categories", None),
+    ("GET", "/dashboard/allocation/categories-group", None),
+    ("GET", "/dashboard/allocation/categories-history", None),
+    ("GET", "/assets/STK1/average-price", None),
+    ("GET", "/assets/STK1/wallet/1/quantity", None),
+    ("GET", "/assets/STK1/delta", None),
+    ("GET", "/assets/STK1/current-price", None),
+    ("GET", "/assets/STK1/total-quantity", None),
+    ("GET", "/assets/STK1/dividends", None),
+    ("GET", "/assets/STK1/last-purchase-meta", None),
+    ("GET", "/assets/STK1/by-wallet", None),
+    ("GET", "/assets/DEL0/by-wallet", None),
+    ("GET", "/assets/by-wallet", None),
+    ("GET", "/convert?from=USD&to=EUR", None),
+    ("GET", "/wallets/summary", None),
+    ("GET", "/performance", None),
+    ("GET", "/performance/series", None),
+    ("GET", "/cashflow", None),
+    ("GET", "/cashflow/projection", None),
+    ("GET", "/alerts", None),
+    ("GET", "/alerts/rules", None),
+    ("POST", "/operations/preview", OPERATION),
+    ("GET", "/operations/1/events", None),
+    ("GET", "/ledger/state", None),
+    ("GET", "/operations/export?format=csv&compress=false", None),
+    ("POST", "/batch", {"requests": [{"path": "/assets/STK1/delta"}, {"path": "/wallets/summary"}]}),
+    # scritture, in quest'ordine sulla fixture: "{id}" nell'url è l'id restituito dalla
+    # richiesta precedente
+    ("POST", "/portfolios", {"name": "Benchmark"}),
+    ("POST", "/wallets", {"name": "Wallet benchmark"}),
+    ("POST", "/assets", {"symbol": "BENCH", "name": "Benchmark", "currency": "USD", "type": "Azione"}),
+    ("DELETE", "/assets/{id}", None),
+    ("POST", "/operations/", OPERATION),
+    ("PUT", "/operations/{id}", {**OPERATION, "quantity": 2, "date": "2024-01-03"}),
+    ("POST", "/operations/{id}/duplicate", None),
+    ("DELETE", "/operations/{id}", None),
+    ("POST", "/operations/reprice", {"ids": [1, 2, 3, 4, 5]}),
+    ("POST", "/ledger/snapshots", None),
+    ("POST", "/prices/sync", None),
+    ("POST", "/cashflow", {"user": "bench", "type": "Uscita", "category": "Casa", "date": "2024-01-01", "amount": 100}),
+    ("DELETE", "/cashflow/{id}", None),
+    ("POST", "/alerts/rules", {"kind": "position_value", "symbol": "STK1", "direction": "above", "threshold": 1}),
+    ("POST", "/alerts/evaluate", None),
+    ("POST", "/alerts/1/ack", None),
+    ("DELETE", "/alerts/rules/1", None),
+]
+
+# route senza una richiesta misurabile: lo stream SSE non termina e le sue query sono
+# del ciclo di aggiornamento condiviso, non della richiesta
+UNMEASURED = {("GET", "/stream/prices")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Budget di query SQL per endpoint sulla fixture sintetica")
+    parser.add_argument("--assets", type=int, default=40)
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--verbose", action="store_true", help="mostra le impronte di ogni richiesta")
+    args = parser.parse_args(argv)
+
+    os.environ["BUGETTO_SQL_TRACE"] = "1"
+    os.environ["BUGETTO_MARKET_STUB"] = "1"
+    logging.disable(logging.WARNING)
+    failures = []
+    with tempfile.TemporaryDirectory() as cwd:
+        os.chdir(cwd)
+        sys.path.insert(0, ROOT)
+        from load_test import build_fixture
+        from fastapi.routing import APIRoute
+        from fastapi.testclient import TestClient
+        from backend import alerts, asset_registry, ledger_cache, price_store, sql_budget
+        from backend.main import app
+
+        build_fixture(args.assets, args.operations, args.years)
+        client = TestClient(app)
+        print(f"{'endpoint':52} {'fredda':>7} {'calda':>7} {'budget':>7}")
+        measured = set(UNMEASURED)
+        last_id = None
+        for method, url, body in REQUESTS:
+            ledger_cache.invalidate()
+            asset_registry.invalidate()
+            price_store.invalidate_history()
+            alerts.reset()
+            url = url.replace("{id}", str(last_id))
+            counts = []
+            # le letture anche a cache calde; una scrittura ripetuta non sarebbe la stessa richiesta
+            for _ in range(2 if method == "GET" else 1):
+                response = client.request(method, url, json=body)
+                if response.status_code >= 400:
+                    failures.append(f"{method} {url}: HTTP {response.status_code}")
+                counts.append(sql_budget.recent[-1])
+            if method != "GET":
+                payload = response.json()
+                last_id = payload.get("id") if isinstance(payload, dict) else None
+            cold, warm = counts[0], counts[-1]
+            route = cold.label.split(" ", 1)[1]
+            measured.add((method, route))
+            budget = sql_budget.budget_for(method, route)
+            flag = ""
+            if budget is None:
+                flag = "  senza budget"
+                failures.append(f"{cold.label}: nessun budget dichiarato")
+            elif cold.count > budget:
+                flag = "  OLTRE BUDGET"
+                failures.append(f"{cold.label}: {cold.count} statement, budget {budget}")
+            if cold.repeated() or warm.repeated():
+                flag += "  N+1"
+                failures.append(cold.report(budget))
+            warm_count = warm.count if method == "GET" else "-"
+            print(f"{cold.label[:52]:52} {cold.count:7d} {warm_count:>7} {budget if budget is not None else '-':>7}{flag}")
+            if args.verbose:
+                for fp, n in cold.fingerprints().most_common():
+                    print(f"    {n}x {fp[:140]}")
+        for route in app.routes:
+            if not isinstance(route, APIRoute):
+                continue
+            for method in sorted(route.methods):
+                if (method, route.path) not in measured:
+                    failures.append(f"{method} {route.path}: nessuna richiesta in REQUESTS")
+                elif (method, route.path) in UNMEASURED and sql_budget.budget_for(method, route.path) is None:
+                    failures.append(f"{method} {route.path}: nessun budget dichiarato")
+        os.chdir(ROOT)
+
+    if failures:
+        print("\nFAIL:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\nOK: tutti gli endpoint entro il budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# benchmarks/startup.py
+"""
+Misura il tempo di avvio del backend: `import backend.main` in un interprete nuovo,
+come succede a ogni worker uvicorn.
+
+Ogni misura gira in un sottoprocesso con la cartella di lavoro in una directory
+temporanea (il database ./bugetto.db viene creato lì): la prima esecuzione crea lo
+schema, le successive trovano lo schema già alla versione corrente.
+
+Uso:
+    python benchmarks/startup.py                # 5 avvii, mediana e moduli più costosi
+    python benchmarks/startup.py --runs 10 --top 15
+    python benchmarks/startup.py --max-ms 1500  # exit code 1 se la mediana supera la soglia
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# moduli che non devono essere importati all'avvio (caricati al primo dato di mercato)
+LAZY_MODULES = ("yfinance", "pandas", "requests", "pyarrow")
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import backend.main
+elapsed = time.perf_counter() - t0
+print(json.dumps({"ms": elapsed * 1000, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def run_once(cwd: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=cwd, env=_env(), capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_profile(cwd: str, top: int) -> list:
+    """Moduli con il tempo cumulativo di import più alto (python -X importtime)."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        cwd=cwd, env=_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del tempo di avvio di backend.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="moduli più costosi da mostrare (0 = nessuno)")
+    parser.add_argument("--max-ms", type=float, help="soglia sulla mediana a schema aggiornato")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as cwd:
+        first = run_once(cwd)
+        warm = [run_once(cwd) for _ in range(args.runs)]
+        times = [r["ms"] for r in warm]
+        median = statistics.median(times)
+
+        print(f"primo avvio (crea lo schema): {first['ms']:.0f} ms")
+        print(f"avvio a schema aggiornato:    mediana {median:.0f} ms, min {min(times):.0f} ms, max {max(times):.0f} ms ({args.runs} run)")
+        loaded = sorted({m for r in warm for m in r["loaded"]})
+        if loaded:
+            print(f"ATTENZIONE: moduli pesanti importati all'avvio: {', '.join(loaded)}")
+
+        if args.top:
+            print("\nimport più costosi (tempo cumulativo):")
+            for cumulative_us, name in import_profile(cwd, args.top):
+                print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"\nFAIL: mediana {median:.0f} ms oltre la soglia di {args.max_ms:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,24 +25,43 @@ interface Asset {
 const API_BASE =
   (import.meta as any).env?.VITE_API_BASE?.replace(/\/+$/, "") || "http://127.0.0.1:8000";
 
+// asset per pagina: la ricerca e la paginazione sono fatte dal server (/assets/search)
+const PAGE_SIZE = 50;
+
 export default function AssetsManagePage() {
   const [assets, setAssets] = useState<Asset[]>([]);
+  const [query, setQuery] = useState("");
+  const [offset, setOffset] = useState(0);
+  const [total, setTotal] = useState(0);
   const [editingId, setEditingId] = useState<number | null>(null);
   const [draft, setDraft] = useState<Asset | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
   useEffect(() => {
-    setLoading(true);
-    fetch(`${API_BASE}/assets/`)
-      .then((r) => {
-        if (!r.ok) throw new Error(`Fetch failed: ${r.status}`);
-        return r.json();
-      })
-      .then((data: Asset[]) => setAssets(Array.isArray(data) ? data : []))
-      .catch((err) => setError(err.message))
-      .finally(() => setLoading(false));
-  }, []);
+    let cancelled = false;
+    const params = new URLSearchParams({ q: query, limit: String(PAGE_SIZE), offset: String(offset) });
+    const t = setTimeout(() => {
+      setLoading(true);
+      fetch(`${API_BASE}/assets/search?${params}`)
+        .then((r) => {
+          if (!r.ok) throw new Error(`Fetch failed: ${r.status}`);
+          return r.json();
+        })
+        .then((data: { total: number; items: Asset[] }) => {
+          if (cancelled) return;
+          setAssets(Array.isArray(data.items) ? data.items : []);
+          setTotal(data.total ?? 0);
+          setError(null);
+        })
+        .catch((err) => !cancelled && setError(err.message))
+        .finally(() => !cancelled && setLoading(false));
+    }, 200);
+    return () => {
+      cancelled = true;
+      clearTimeout(t);
+    };
+  }, [query, offset]);
 
   const startEdit = (asset: Asset) => {
     setEditingId(asset.id);
@@ -70,6 +89,7 @@ export default function AssetsManagePage() {
         throw new Error(`Delete failed: ${res.status}`);
       }
       setAssets((assets) => assets.filter((o) => o.id !== asset.id));
+      setTotal((n) => Math.max(n - 1, 0));
       if (editingId === asset.id) {
         setEditingId(null);
         setDraft(null);
@@ -103,7 +123,30 @@ export default function AssetsManagePage() {
       <div className="flex items-center justify-between">
         <h2 className="text-xl font-semibold">Gestisci asset</h2>
         <div className="text-sm text-muted-foreground">
-          {loading ? "Caricamento…" : error ? `Errore: ${error}` : `${assets.length} asset`}
+          {loading ? "Caricamento…" : error ? `Errore: ${error}` : `${total} asset`}
+        </div>
+      </div>
+
+      <div className="flex items-center gap-2">
+        <Input
+          placeholder="Cerca per simbolo, nome o ISIN…"
+          value={query}
+          onChange={(e) => {
+            setQuery(e.target.value);
+            setOffset(0);
+          }}
+          className="max-w-sm"
+        />
+        <div className="ml-auto flex items-center gap-2 text-sm text-muted-foreground">
+          <Button variant="outline" size="sm" disabled={offset === 0} onClick={() => setOffset(Math.max(offset - PAGE_SIZE, 0))}>
+            Precedenti
+          </Button>
+          <span>
+            {total === 0 ? 0 : offset + 1}–{Math.min(offset + PAGE_SIZE, total)} di {total}
+          </span>
+          <Button variant="outline" size="sm" disabled={offset + PAGE_SIZE >= total} onClick={() => setOffset(offset + PAGE_SIZE)}>
+            Successivi
+          </Button>
         </div>
       </div>
 
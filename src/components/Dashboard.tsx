@@ -4,6 +4,7 @@ import AssetsTable from "./AssetTable";
 import WalletSnapshot from "./WalletSnapshot";
 import CategoryAllocationChart from "./CategoryAllocationChart";
 import CategoryHistoryChart from "./CategoryHistoryChart";
+import { fetchBatch } from "@/utils/api";
 
 
 import {
@@ -32,20 +33,18 @@ export default function DashboardPage() {
 
       const liquid = assets.filter((a: any) => a.visible && a.type === "Liquidi");
 
-      const detailed = await Promise.all(
-        liquid.map(async (asset: any) => {
-          const q = await fetch(`${API_BASE}/assets/${asset.symbol}/total-quantity`);
-          const quantity = await q.json();
-
-          let conversion_rate = 1;
-          if (asset.symbol !== "EUR") {
-            const convRes = await fetch(`${API_BASE}/convert?from=${asset.symbol}&to=EUR`);
-            conversion_rate = await convRes.json();
-          }
-
-          return { ...asset, quantity, conversion_rate };
-        })
-      );
+      // quantità e cambi di tutti gli asset liquidi in una sola richiesta
+      const paths = liquid.flatMap((asset: any) => [
+        `/assets/${encodeURIComponent(asset.symbol)}/total-quantity`,
+        ...(asset.symbol !== "EUR" ? [`/convert?from=${encodeURIComponent(asset.symbol)}&to=EUR`] : []),
+      ]);
+      const results = await fetchBatch(paths);
+      let i = 0;
+      const detailed = liquid.map((asset: any) => {
+        const quantity = results[i++].body;
+        const conversion_rate = asset.symbol !== "EUR" ? results[i++].body : 1;
+        return { ...asset, quantity, conversion_rate };
+      });
 
       setLiquidAssets(detailed);
     };
@@ -18,7 +18,7 @@ import {
   getWallets,
   createWallet,
   getLastPurchaseMeta,
-  getVisibleAssets,
+  searchAssets,
   createAsset,
   guessAsset,
 } from "@/lib/api";
@@ -116,9 +116,11 @@ export default function OperationForm() {
   const [newWalletName, setNewWalletName] = useState("");
 
   // assets
-  const [assets, setAssets] = useState<
-    { id: number; symbol: string; name?: string; currency?: string }[]
-  >([]);
+  type AssetOption = { id: number; symbol: string; name?: string; currency?: string };
+  // risultati della ricerca lato server per il testo digitato nel picker
+  const [assets, setAssets] = useState<AssetOption[]>([]);
+  const [assetQuery, setAssetQuery] = useState("");
+  const [selectedAsset, setSelectedAsset] = useState<AssetOption | null>(null);
   const [assetOpen, setAssetOpen] = useState(false);
   const [newAssetOpen, setNewAssetOpen] = useState(false);
   const [newAsset, setNewAsset] = useState({
@@ -136,23 +138,36 @@ export default function OperationForm() {
 
 
 
-// Primo useEffect - carica wallets e assets
+// Primo useEffect - carica wallets
   useEffect(() => {
     getWallets().then(setWallets).catch(() => setWallets([]));
-    getVisibleAssets().then(setAssets).catch(() => setAssets([]));
   }, []);
 
+  // Asset visibili che corrispondono al testo del picker (ricerca sul server, con debounce)
+  useEffect(() => {
+    let cancelled = false;
+    const t = setTimeout(() => {
+      searchAssets(assetQuery, { limit: 50, visible: true })
+        .then((r) => !cancelled && setAssets(r.items))
+        .catch(() => !cancelled && setAssets([]));
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(t);
+    };
+  }, [assetQuery]);
+
     // Secondo useEffect - imposta la valuta di acquisto di default quando cambia asset
   useEffect(() => {
     const sym = form.asset_symbol?.trim();
     if (!sym) return;
-    const asset = assets.find(a => a.symbol === sym);
+    const asset = selectedAsset?.symbol === sym ? selectedAsset : null;
     // Se l'utente NON ha toccato manualmente la currency, aggiorno dal dato dell'asset
     if (asset && !currencyTouched) {
       update("purchase_currency", (asset.currency || "EUR").toUpperCase());
     }
-  }, [form.asset_symbol, assets, currencyTouched]);
- // <-- dipende da asset selezionato e lista assets
+  }, [form.asset_symbol, selectedAsset, currencyTouched]);
+ // <-- dipende da asset selezionato
 
   
   function update<K extends keyof (OperationIn & { user?: string | null })>(
@@ -291,7 +306,7 @@ export default function OperationForm() {
                     className={`flex-1 justify-between h-10 rounded-md border px-3 text-sm ${fieldErrors.asset ? 'border-red-500' : 'border-input bg-background text-foreground'}`}
                   >
                     {form.asset_symbol
-                      ? assets.find((a) => a.symbol === form.asset_symbol)?.name ||
+                      ? (selectedAsset?.symbol === form.asset_symbol && selectedAsset.name) ||
                         form.asset_symbol
                       : "Seleziona asset"}
                     <ChevronsUpDown className="ml-2 h-4 w-4 opacity-50" />
@@ -299,8 +314,8 @@ export default function OperationForm() {
                 </PopoverTrigger>
 
                 <PopoverContent align="start" className="p-0 w-[360px]">
-                  <Command className="max-h-72">
-                    <CommandInput placeholder="Cerca asset..." />
+                  <Command className="max-h-72" shouldFilter={false}>
+                    <CommandInput placeholder="Cerca asset..." value={assetQuery} onValueChange={setAssetQuery} />
                     <CommandList>
                       <CommandEmpty>Nessun risultato.</CommandEmpty>
                       <CommandGroup>
@@ -309,6 +324,7 @@ export default function OperationForm() {
                             key={a.id}
                             value={`${a.symbol} ${a.name ?? ""}`.trim()}
                             onSelect={() => {
+                              setSelectedAsset(a);
                               update("asset_symbol", a.symbol);
                               // resetto il flag così l'auto-set può agire per il nuovo asset
                               setCurrencyTouched(false);
@@ -438,9 +454,7 @@ export default function OperationForm() {
                         };
                         if (!payload.symbol || !payload.category) return;
                         const created = await createAsset(payload);
-                        setAssets((prev) =>
-                          [...prev, created].sort((a, b) => (a.name || a.symbol).localeCompare(b.name || b.symbol))
-                        );
+                        setSelectedAsset(created);
                         update("asset_symbol", created.symbol);
                         setNewAssetOpen(false);
                       }}
@@ -8,6 +8,7 @@ import {
   SelectContent,
   SelectItem,
 } from "@/components/ui/select";
+import { resetAssetsByWalletCache } from "@/utils/api";
 
 /** Tipi dal backend */
 interface Operation {
@@ -181,6 +182,7 @@ export default function OperationsManagePage() {
         body: JSON.stringify(draft),
       });
       if (!res.ok) throw new Error(`Update failed: ${res.status}`);
+      resetAssetsByWalletCache();
       const updated: Operation = await res.json();
       setOperations((ops) => ops.map((o) => (o.id === updated.id ? updated : o)));
       setEditingId(null);
@@ -198,6 +200,7 @@ export default function OperationsManagePage() {
         headers: { Accept: "application/json" },
       });
       if (!res.ok) throw new Error(`Duplicate failed: ${res.status}`);
+      resetAssetsByWalletCache();
       const newOp: Operation = await res.json();
       setOperations((ops) => [newOp, ...ops]);
     } catch (e: any) {
@@ -216,6 +219,7 @@ export default function OperationsManagePage() {
         if (res.status === 404) throw new Error("Operazione non trovata (già eliminata?)");
         throw new Error(`Delete failed: ${res.status}`);
       }
+      resetAssetsByWalletCache();
       setOperations((ops) => ops.filter((o) => o.id !== op.id));
       if (editingId === op.id) {
         setEditingId(null);
@@ -1,3 +1,5 @@
+import { resetAssetsByWalletCache } from "@/utils/api";
+
 export const API_BASE = "http://127.0.0.1:8000";
 export type Wallet = { id: number; name: string };
 
@@ -53,6 +55,7 @@ export async function createOperation(data: OperationIn) {
     body: JSON.stringify(data),
   });
   if (!res.ok) throw new Error(`Create failed: ${res.status}`);
+  resetAssetsByWalletCache();
   return res.json();
 }
 
@@ -64,6 +67,20 @@ export async function getVisibleAssets(): Promise<Asset[]> {
   return r.json();
 }
 
+export type AssetSearchResult = { total: number; items: Asset[] };
+
+// Ricerca lato server (simbolo, nome, ISIN; prefisso e approssimata), paginata
+export async function searchAssets(
+  q: string,
+  opts: { limit?: number; offset?: number; visible?: boolean } = {}
+): Promise<AssetSearchResult> {
+  const params = new URLSearchParams({ q, limit: String(opts.limit ?? 20), offset: String(opts.offset ?? 0) });
+  if (opts.visible !== undefined) params.set("visible", String(opts.visible));
+  const r = await fetch(`${API_BASE}/assets/search?${params}`);
+  if (!r.ok) throw new Error("search assets");
+  return r.json();
+}
+
 export async function createAsset(a: Partial<Asset> & {symbol: string}) {
   const r = await fetch(`${API_BASE}/assets`, {
     method: "POST",
@@ -11,7 +11,49 @@ export async function fetchWalletSummary(): Promise<WalletSummaryResponse> {
   return r.json();
 }
 
+export type BatchResult = { path: string; status: number; body: any };
+
+// Più GET in una richiesta: stessa sessione DB e stessi prezzi/cambi lato server
+export async function fetchBatch(paths: string[]): Promise<BatchResult[]> {
+  const r = await fetch(`${BASE}/batch`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ requests: paths.map((path) => ({ method: "GET", path })) }),
+  });
+  if (!r.ok) throw new Error("Failed to run batch");
+  return (await r.json()).results;
+}
+
+export async function fetchAssetsByWallet(): Promise<AssetByWalletResponse[]> {
+  const r = await fetch(`${BASE}/assets/by-wallet`);
+  if (!r.ok) throw new Error("Failed to load asset breakdown");
+  return r.json();
+}
+
+// Breakdown di tutti gli asset caricato una volta e condiviso dalle righe espanse
+// della tabella; scade dopo BY_WALLET_TTL_MS o quando un'operazione viene scritta
+// (resetAssetsByWalletCache).
+const BY_WALLET_TTL_MS = 30_000;
+let byWalletCache: { at: number; data: Promise<Map<string, AssetByWalletResponse>> } | null = null;
+
+// Da chiamare dopo ogni scrittura su operazioni (creazione, modifica, duplicazione, eliminazione)
+export function resetAssetsByWalletCache(): void {
+  byWalletCache = null;
+}
+
+function assetsByWalletMap(): Promise<Map<string, AssetByWalletResponse>> {
+  if (!byWalletCache || Date.now() - byWalletCache.at > BY_WALLET_TTL_MS) {
+    const data = fetchAssetsByWallet().then((items) => new Map(items.map((x) => [x.symbol, x])));
+    data.catch(() => { byWalletCache = null; });
+    byWalletCache = { at: Date.now(), data };
+  }
+  return byWalletCache.data;
+}
+
 export async function fetchAssetByWallet(symbol: string): Promise<AssetByWalletResponse> {
+  // se la richiesta complessiva fallisce si usa quella del singolo asset
+  const cached = await assetsByWalletMap().then((all) => all.get(symbol), () => undefined);
+  if (cached) return cached;
   const r = await fetch(`${BASE}/assets/${encodeURIComponent(symbol)}/by-wallet`);
   if (!r.ok) throw new Error("Failed to load asset breakdown");
   return r.json();